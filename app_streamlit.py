@@ -2,8 +2,11 @@
 # -*- coding: utf-8 -*-
 APP_VERSION = "2025-08-12 • Compat submit • Supabase + Excel • Valor Factura / Valor Radicado"
 
-import os, io, re
+import os, io, re, csv, time, threading, hashlib, hmac, base64, uuid, functools, contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date
+import numpy as np
 import pandas as pd
 import streamlit as st
 import plotly.express as px
@@ -31,15 +34,36 @@ except Exception:
         def __exit__(self, *exc): return False
     class Timeout(Exception): pass
 
+# ====== pyarrow opcional (Parquet + texto columnar) ======
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_OK = True
+except Exception:
+    PARQUET_OK = False
+TEXTO_DTYPE = "string[pyarrow]" if PARQUET_OK else "string"
+
 # ====== Constantes de archivos ======
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-INVENTARIO_LOCAL = os.path.join(BASE_DIR, "inventario_cuentas.xlsx")
-INVENTARIO_LOCK  = INVENTARIO_LOCAL + ".lock"
+INVENTARIO_LOCAL   = os.path.join(BASE_DIR, "inventario_cuentas.xlsx")     # importación / legado
+INVENTARIO_PARQUET = os.path.join(BASE_DIR, "inventario_cuentas.parquet")  # almacén local canónico
+INVENTARIO_LOCK    = os.path.join(BASE_DIR, "inventario_cuentas.lock")
 USUARIOS_FILE    = os.path.join(BASE_DIR, "usuarios.xlsx")  # opcional (login)
+EXPORTES_DIR     = os.path.join(BASE_DIR, "exportes_cache")  # archivos de exportaciones en segundo plano
+MOVIMIENTOS_DIR  = os.path.join(BASE_DIR, "movimientos")     # bitácora local de cambios de estado
+PROYECCIONES_FILE = os.path.join(BASE_DIR, "proyecciones.xlsx")  # metas de Avance (opcional)
+ID_CONTADOR      = os.path.join(BASE_DIR, "ids_contador.txt")  # último ID entregado (sin Supabase)
+ID_LOCK          = os.path.join(BASE_DIR, "ids_contador.lock")
 
 # ====== Catálogos / colores ======
 ESTADOS = ["Pendiente","Auditada","Subsanada","Radicada"]
 ESTADO_COLORES = {"Radicada":"green","Pendiente":"red","Auditada":"orange","Subsanada":"blue"}
+# Variantes de Estado (minúsculas, sin espacios) → Estado canónico
+ESTADO_CANON = {
+    "radicada":"Radicada","radicadas":"Radicada",
+    "pendiente":"Pendiente","pendientes":"Pendiente",
+    "auditada":"Auditada","auditadas":"Auditada",
+    "subsanada":"Subsanada","subsanadas":"Subsanada",
+}
 MES_NOMBRE = {1:"Enero",2:"Febrero",3:"Marzo",4:"Abril",5:"Mayo",6:"Junio",
               7:"Julio",8:"Agosto",9:"Septiembre",10:"Octubre",11:"Noviembre",12:"Diciembre"}
 
@@ -60,17 +84,64 @@ APP2DB = {
     "No Radicado": "no_radicado",
     "Mes": "mes",
     "Observaciones": "observaciones",
+    "Version": "version",                     # versión de la fila (control de concurrencia)
 }
 DB2APP = {v: k for k, v in APP2DB.items()}
 DB_TABLE = "inventario"
 DB_PK = "numero_factura"  # clave primaria en DB
 
+# ====== Métricas del proceso (tiempos de carga/guardado) ======
+# El script se re-ejecuta en cada rerun: el estado de proceso vive en cache_resource.
+@st.cache_resource
+def _registro_metricas() -> dict[str, deque]:
+    return {}
+
+def registrar_metrica(nombre: str, **datos):
+    """Guarda una medición (últimas 200 por nombre) para el panel de métricas."""
+    _registro_metricas().setdefault(nombre, deque(maxlen=200)).append({"ts": datetime.now(), **datos})
+
+def metricas_df(nombre: str) -> pd.DataFrame:
+    return pd.DataFrame(list(_registro_metricas().get(nombre, [])))
+
 # ====== Helpers UI ======
 def flash_success(msg: str): st.session_state["_flash_ok"] = msg
 def show_flash():
     msg = st.session_state.pop("_flash_ok", None)
     if msg: st.success(msg)
 
+# (nombre de métrica, título) que se muestran en el panel lateral
+PANEL_METRICAS = [
+    ("supabase_fetch", "Lecturas Supabase"),
+    ("supabase_pagina", "Páginas Supabase"),
+    ("supabase_sync", "Sincronización Supabase"),
+    ("supabase_cliente", "Clientes Supabase (pool)"),
+    ("supabase_llamada", "Llamadas Supabase"),
+    ("inventario_cache", "Cache de inventario"),
+    ("agregado", "Agregaciones"),
+    ("cubo", "Cubo de agregados"),
+    ("indice", "Índice de búsqueda"),
+    ("bandejas", "Motor de bandejas"),
+    ("exportacion", "Exportaciones"),
+    ("exportacion_job", "Exportaciones en segundo plano"),
+    ("movimientos", "Bitácora de movimientos"),
+    ("render", "Render por sección (fragmentos)"),
+    ("grafico", "Figuras (datos agregados)"),
+    ("importacion", "Importaciones por lotes"),
+    ("ids", "Reserva de IDs"),
+]
+
+def panel_metricas():
+    """Expander lateral con las últimas mediciones registradas en este proceso."""
+    with st.sidebar.expander("⏱️ Métricas", expanded=False):
+        vacio = True
+        for nombre, titulo in PANEL_METRICAS:
+            m = metricas_df(nombre)
+            if m.empty: continue
+            vacio = False
+            st.caption(titulo)
+            st.dataframe(m.tail(20), hide_index=True, use_container_width=True)
+        if vacio: st.caption("Sin mediciones todavía.")
+
 def _select_tab(label: str):
     js = f"""
     <script>
@@ -86,6 +157,8 @@ def _select_tab(label: str):
 # ====== Utilidades ======
 def _parse_currency(s):
     if pd.isna(s) or s == "": return pd.NA
+    if isinstance(s, (int, float, np.number)) and not isinstance(s, bool):
+        return float(s)  # ya es número: no pasar por texto (1500.5 → "15005")
     t = str(s).replace("$","").replace("\xa0","").replace(" ","")
     t = t.replace(".","").replace(",",".")
     try: return float(t)
@@ -93,12 +166,109 @@ def _parse_currency(s):
         try: return float(str(s).strip())
         except: return pd.NA
 
+# Lo que float() acepta tras limpiar un valor típico ("1234567.89", "-5", "1e3"); solo ASCII
+_NUM_RE = r"[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?"
+
+def _parse_currency_series(s: pd.Series) -> pd.Series:
+    """
+    _parse_currency vectorizado: limpia el texto con .str, valida con regex y convierte
+    con astype. Lo que la regex no reconoce (p.ej. '1_000', 'N/A') pasa por _parse_currency,
+    así el resultado es idéntico celda a celda.
+
+    Cambio de tipo deliberado respecto a s.apply(_parse_currency): devuelve float64 con NaN
+    en vez de object con pd.NA (normalize_dataframe lo pasa luego a Float64 igual que antes).
+    Las columnas ya numéricas no se tocan (no pasan por texto) y la regex es solo ASCII: los
+    dígitos de otros alfabetos caen al camino por fila. Ver tests/test_moneda.py.
+    """
+    if s.dtype.kind in "iuf":
+        return s.astype("float64")
+    vals = np.full(len(s), np.nan)
+    presente = s.notna().to_numpy(dtype=bool)
+    if pd.api.types.infer_dtype(s, skipna=True) in ("string", "empty"):
+        es_txt = presente
+    else:
+        es_txt = presente & s.map(lambda x: isinstance(x, str)).to_numpy(dtype=bool)
+        es_num = presente & ~es_txt & s.map(
+            lambda x: isinstance(x, (int, float, np.number)) and not isinstance(x, bool)).to_numpy(dtype=bool)
+        vals[es_num] = pd.to_numeric(s[es_num], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        otros = presente & ~es_txt & ~es_num
+        if otros.any():
+            vals[otros] = pd.to_numeric(s[otros].map(_parse_currency), errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    if es_txt.any():
+        limpio = s[es_txt].astype(TEXTO_DTYPE)
+        for a, b in (("$", ""), ("\xa0", ""), (" ", ""), (".", ""), (",", ".")):
+            limpio = limpio.str.replace(a, b, regex=False)
+        ok = limpio.str.fullmatch(_NUM_RE).fillna(False).to_numpy(dtype=bool)
+        v = np.full(len(limpio), np.nan)
+        v[ok] = limpio[ok].astype("float64").to_numpy()
+        dudosos = ~ok & (s[es_txt] != "").to_numpy(dtype=bool)
+        if dudosos.any():
+            v[dudosos] = pd.to_numeric(s[es_txt][dudosos].map(_parse_currency), errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        vals[es_txt] = v
+    return pd.Series(vals, index=s.index)
+
+def estado_canonico(estado: pd.Series) -> pd.Series:
+    """Estado → Radicada/Pendiente/Auditada/Subsanada (lo desconocido se deja tal cual)."""
+    return estado.astype(str).str.strip().str.lower().map(ESTADO_CANON).fillna(estado)
+
+# ====== Esquema tipado del inventario en memoria ======
+COLS_CATEGORIA = ["EPS","Estado","EstadoCanon","Mes"]
+COLS_TEXTO = ["ID","NumeroFactura","Documento","Paciente","No Radicado","Observaciones"]
+
+def aplicar_esquema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Tipos compactos: categorías para columnas de baja cardinalidad, Int16 para Vigencia,
+    Float64 para dinero y texto columnar para el resto. Estado/EstadoCanon siempre traen
+    ESTADOS entre sus categorías para poder mover facturas a cualquiera.
+    """
+    df = df.copy(deep=False)
+    for c in ["Fecha factura","FechaRadicacion","FechaMovimiento"]:
+        if c in df.columns: df[c] = pd.to_datetime(df[c], errors="coerce")
+    for c in ["Valor Factura","Valor Radicado"]:
+        if c in df.columns: df[c] = pd.to_numeric(df[c], errors="coerce").astype("Float64")
+    if "Vigencia" in df.columns:
+        v = pd.to_numeric(df["Vigencia"], errors="coerce").astype("float64")
+        df["Vigencia"] = v.where((v == v.round()) & (v.abs() < 2**15)).astype("Int16")
+    if "Version" in df.columns:
+        df["Version"] = pd.to_numeric(df["Version"], errors="coerce").astype("Int64")
+    for c in COLS_CATEGORIA:
+        if c not in df.columns: continue
+        txt = df[c].astype(object).where(df[c].notna()).astype(TEXTO_DTYPE)
+        cats = pd.Index(txt.dropna().unique())
+        if c in ("Estado","EstadoCanon"): cats = cats.union(pd.Index(ESTADOS), sort=False)
+        df[c] = pd.Categorical(txt, categories=cats)
+    for c in COLS_TEXTO:
+        if c in df.columns: df[c] = df[c].astype(object).where(df[c].notna()).astype(TEXTO_DTYPE)
+    return df
+
+def _para_editor(df: pd.DataFrame) -> pd.DataFrame:
+    """Las categorías pasan a texto para que el editor permita escribir valores nuevos."""
+    return df.astype({c: TEXTO_DTYPE for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)})
+
+def reporte_memoria(df: pd.DataFrame) -> pd.DataFrame:
+    """Bytes por columna con el esquema tipado vs. los tipos genéricos de antes (object/float64)."""
+    antes = {}
+    for c in df.columns:
+        s = df[c]
+        if isinstance(s.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(s.dtype):
+            s = s.astype(object)
+        elif pd.api.types.is_extension_array_dtype(s.dtype) and s.dtype.kind in "iuf":
+            s = s.astype("float64")
+        antes[c] = s.memory_usage(deep=True, index=False)
+    rep = pd.DataFrame({
+        "Tipo": df.dtypes.astype(str),
+        "Bytes": df.memory_usage(deep=True, index=False),
+        "Bytes sin esquema": pd.Series(antes),
+    })
+    rep["Reducción %"] = (100 - rep["Bytes"] / rep["Bytes sin esquema"].where(rep["Bytes sin esquema"] > 0) * 100).round(1)
+    return rep
+
 def normalize_dataframe(df_in: pd.DataFrame) -> pd.DataFrame:
     """
     Normaliza tipos sin crear columna 'Valor'. 
     Usamos explícitamente 'Valor Factura' y 'Valor Radicado' en cálculos/gráficos.
     """
-    df = df_in.copy()
+    df = df_in.astype({c: object for c in df_in.columns if isinstance(df_in[c].dtype, pd.CategoricalDtype)})
     # Asegurar columnas esperadas (aunque sea vacías)
     for c in APP2DB.keys():
         if c not in df.columns:
@@ -107,26 +277,20 @@ def normalize_dataframe(df_in: pd.DataFrame) -> pd.DataFrame:
     for c in ["Fecha factura","FechaRadicacion","FechaMovimiento"]:
         df[c] = pd.to_datetime(df[c], errors="coerce")
     # Números
-    df["Valor Factura"] = df["Valor Factura"].apply(_parse_currency)
-    df["Valor Radicado"] = df["Valor Radicado"].apply(_parse_currency)
+    df["Valor Factura"] = _parse_currency_series(df["Valor Factura"])
+    df["Valor Radicado"] = _parse_currency_series(df["Valor Radicado"])
     df["Vigencia"] = pd.to_numeric(df["Vigencia"], errors="coerce")
     # Estado canon
-    canon_map = {
-        "radicada":"Radicada","radicadas":"Radicada",
-        "pendiente":"Pendiente",
-        "auditada":"Auditada","auditadas":"Auditada",
-        "subsanada":"Subsanada","subsanadas":"Subsanada"
-    }
-    df["EstadoCanon"] = df["Estado"].astype(str).str.strip().str.lower().map(canon_map).fillna(df["Estado"])
+    df["EstadoCanon"] = estado_canonico(df["Estado"])
     # Mes desde FechaRadicacion si falta
     vacios = df["Mes"].isna() | (df["Mes"].astype(str).str.strip()=="")
     has_frad = df["FechaRadicacion"].notna()
     need = vacios & has_frad
     if need.any():
         df.loc[need, "Mes"] = df.loc[need, "FechaRadicacion"].dt.month.map(MES_NOMBRE)
-    return df.dropna(how="all")
+    return aplicar_esquema(df.dropna(how="all"))
 
-# ====== Excel local (fallback / o fuente principal) ======
+# ====== Excel (importación / exportación; almacén si falta pyarrow) ======
 def _read_excel_local(path: str) -> pd.DataFrame:
     if not os.path.exists(path): return pd.DataFrame()
     try:
@@ -135,20 +299,76 @@ def _read_excel_local(path: str) -> pd.DataFrame:
         st.error(f"Error leyendo Excel local: {e}")
         return pd.DataFrame()
 
-def _write_excel_local(df: pd.DataFrame, path: str) -> tuple[bool, str]:
+def _escribir_excel_atomico(df: pd.DataFrame, path: str, sheet_name: str = "inventario_cuentas"):
+    """Escribe a un temporal y lo renombra (el llamador debe tener el lock)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp.xlsx"
+    with pd.ExcelWriter(tmp, engine="openpyxl") as w:
+        df.to_excel(w, index=False, sheet_name=sheet_name)
+    if os.path.exists(path): os.remove(path)
+    os.rename(tmp, path)
+
+# ====== Almacén local columnar (Parquet; Excel solo para importar/exportar) ======
+# Si falta pyarrow seguimos con el Excel como antes
+INVENTARIO_STORE = INVENTARIO_PARQUET if PARQUET_OK else INVENTARIO_LOCAL
+
+def _tipar_parquet(df_in: pd.DataFrame) -> pd.DataFrame:
+    """
+    Parquet exige un tipo por columna: valores y fechas van tipados (no como texto: "9669259.0"
+    se releería con el punto como separador de miles); el resto de texto/mixtas (ID,
+    Vigencia '2023-2024', ...) va como string.
+    """
+    df = df_in.copy()
+    for c in COLS_VALOR:
+        if c in df.columns: df[c] = _parse_currency_series(df[c])
+    for c in COLS_FECHA:
+        if c in df.columns: df[c] = pd.to_datetime(df[c], errors="coerce")
+    if "Version" in df.columns:
+        df["Version"] = pd.to_numeric(df["Version"], errors="coerce").astype("Int64")
+    for c in df.columns:
+        if df[c].dtype == object or isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype("string")
+    return df
+
+def _read_local(path: str = INVENTARIO_STORE) -> pd.DataFrame:
+    if not path.endswith(".parquet"): return _read_excel_local(path)
+    if not os.path.exists(path): return pd.DataFrame()
+    try:
+        return pd.read_parquet(path, memory_map=True)
+    except Exception as e:
+        st.error(f"Error leyendo almacén local: {e}")
+        return pd.DataFrame()
+
+def _escribir_local_atomico(df: pd.DataFrame, path: str):
+    """Temporal + os.replace (el llamador debe tener el lock)."""
+    if not path.endswith(".parquet"): return _escribir_excel_atomico(df, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    _tipar_parquet(df).to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+def _write_local(df: pd.DataFrame, path: str = INVENTARIO_STORE) -> tuple[bool, str]:
     try:
-        os.makedirs(os.path.dirname(path), exist_ok=True)
         with FileLock(INVENTARIO_LOCK, timeout=10):
-            tmp = path + ".tmp.xlsx"
-            with pd.ExcelWriter(tmp, engine="openpyxl") as w:
-                df.to_excel(w, index=False, sheet_name="inventario_cuentas")
-            if os.path.exists(path): os.remove(path)
-            os.rename(tmp, path)
+            _escribir_local_atomico(df, path)
         return True, "OK_LOCAL"
     except Timeout:
         return False, "Otro usuario está guardando en este momento. Intenta de nuevo."
     except Exception as e:
-        return False, f"Error guardando Excel local: {e}"
+        return False, f"Error guardando almacén local: {e}"
+
+def _asegurar_store_local():
+    """Primera vez con Parquet: migra el inventario_cuentas.xlsx existente (el xlsx queda de respaldo)."""
+    if INVENTARIO_STORE == INVENTARIO_LOCAL or os.path.exists(INVENTARIO_STORE): return
+    if not os.path.exists(INVENTARIO_LOCAL): return
+    try:
+        with FileLock(INVENTARIO_LOCK, timeout=10):
+            if os.path.exists(INVENTARIO_STORE): return
+            df_xlsx = _read_excel_local(INVENTARIO_LOCAL)
+            if not df_xlsx.empty:
+                _escribir_local_atomico(df_xlsx, INVENTARIO_STORE)
+    except Timeout:
+        pass
 
 # ====== Supabase (cliente + mapeo snake_case) ======
 try:
@@ -156,12 +376,47 @@ try:
 except Exception:
     create_client = None
     Client = None
-
-def _get_supabase() -> "Client|None":
+try:
+    from supabase import ClientOptions
+except Exception:
+    try: from supabase.lib.client_options import ClientOptions
+    except Exception: ClientOptions = None
+
+SUPABASE_TIMEOUT_S = 20     # tiempo máximo por petición a PostgREST
+SUPABASE_REINTENTOS = 3     # reintentos ante fallos transitorios (red, 5xx, timeout)
+SUPABASE_BACKOFF_S = 0.5    # espera base del backoff exponencial (0.5, 1, 2, ...)
+
+def _config_supabase() -> dict:
+    """Ajustes opcionales de [supabase] en secrets (timeout_s, reintentos, backoff_s)."""
+    try: cfg = st.secrets.get("supabase", {})
+    except Exception: cfg = {}
+    def num(k, defecto, tipo):
+        try: return max(0, tipo(cfg.get(k, defecto)))
+        except Exception: return defecto
+    return {"timeout_s": num("timeout_s", SUPABASE_TIMEOUT_S, float),
+            "reintentos": num("reintentos", SUPABASE_REINTENTOS, int),
+            "backoff_s": num("backoff_s", SUPABASE_BACKOFF_S, float)}
+
+@st.cache_resource
+def _pool_supabase() -> dict:
+    """Clientes compartidos por todo el proceso (una sesión HTTP keep-alive por url/clave)."""
+    return {"clientes": {}, "lock": threading.Lock(), "creados": 0, "reusos": 0}
+
+def _crear_cliente(url: str, key: str, timeout_s: float):
+    if ClientOptions is not None:
+        try: return create_client(url, key, options=ClientOptions(postgrest_client_timeout=timeout_s))
+        except TypeError: pass  # versiones sin ese parámetro
+    return create_client(url, key)
+
+def _get_supabase(servicio: bool = False) -> "Client|None":
+    """
+    Cliente con la anon_key; servicio=True usa supabase.service_key (rol service_role, solo en el
+    servidor) para lo que la anon_key no puede leer o escribir (usuarios, metas, IDs, bitácora).
+    """
     try:
         cfg = st.secrets.get("supabase", {})
         url = (cfg.get("url") or "").strip()
-        key = (cfg.get("anon_key") or "").strip()
+        key = (cfg.get("service_key" if servicio else "anon_key") or "").strip()
         if not url or not key: return None
         if not url.startswith("https://") or ".supabase.co" not in url:
             st.info("Supabase: URL no válida en secrets. Usando Excel local.")
@@ -169,10 +424,58 @@ def _get_supabase() -> "Client|None":
         if not create_client:
             st.info("Supabase: librería no disponible. Usando Excel local.")
             return None
-        return create_client(url, key)
+        timeout_s = _config_supabase()["timeout_s"]
+        pool = _pool_supabase()
+        ident = (url, hashlib.sha256(key.encode()).hexdigest(), timeout_s)
+        with pool["lock"]:
+            cliente = pool["clientes"].get(ident)
+            if cliente is not None:
+                pool["reusos"] += 1
+                return cliente
+            t0 = time.perf_counter()
+            cliente = pool["clientes"][ident] = _crear_cliente(url, key, timeout_s)
+            pool["creados"] += 1
+        registrar_metrica("supabase_cliente", creados=pool["creados"], reusos=pool["reusos"],
+                          timeout_s=timeout_s, ms=round((time.perf_counter() - t0) * 1000, 1))
+        return cliente
     except Exception:
         return None
 
+def _es_transitorio(e: Exception) -> bool:
+    """Fallos de red / timeout / 5xx / 429: vale la pena reintentar. Errores de datos no."""
+    nombre = type(e).__name__
+    if any(s in nombre for s in ("Timeout", "ConnectError", "ReadError", "WriteError",
+                                 "RemoteProtocolError", "PoolTimeout", "NetworkError")):
+        return True
+    if isinstance(e, (ConnectionError, TimeoutError)): return True
+    codigo = str(getattr(e, "code", "") or getattr(getattr(e, "response", None), "status_code", "") or "")
+    return codigo in ("429", "500", "502", "503", "504")
+
+def ejecutar_supabase(consulta, operacion: str, reintentar: bool = True):
+    """
+    consulta.execute() con reintentos y backoff exponencial ante fallos transitorios.
+    Registra intentos y latencia por operación en la métrica 'supabase_llamada'.
+    reintentar=False para lo que no es idempotente (compare-and-set por versión, reserva de IDs):
+    si el timeout llega después de que el servidor aplicó el cambio, repetirlo daría otro resultado.
+    """
+    cfg = _config_supabase()
+    t0 = time.perf_counter()
+    intento = 0
+    while True:
+        intento += 1
+        try:
+            res = consulta.execute()
+        except Exception as e:
+            if not reintentar or intento > cfg["reintentos"] or not _es_transitorio(e):
+                registrar_metrica("supabase_llamada", operacion=operacion, intentos=intento, ok=False,
+                                  error=type(e).__name__, ms=round((time.perf_counter() - t0) * 1000, 1))
+                raise
+            time.sleep(cfg["backoff_s"] * (2 ** (intento - 1)))
+            continue
+        registrar_metrica("supabase_llamada", operacion=operacion, intentos=intento, ok=True,
+                          ms=round((time.perf_counter() - t0) * 1000, 1))
+        return res
+
 def _df_app_to_db(df_app: pd.DataFrame) -> pd.DataFrame:
     if df_app is None or df_app.empty: return pd.DataFrame()
     df = df_app.copy()
@@ -185,8 +488,9 @@ def _df_app_to_db(df_app: pd.DataFrame) -> pd.DataFrame:
     # Numéricos
     for c in ["valor_factura","valor_radicado","vigencia"]:
         if c in df.columns: df[c] = pd.to_numeric(df[c], errors="coerce")
-    # NaN/NaT → None
-    return df.where(pd.notna(df), None)
+    df["version"] = pd.to_numeric(df["version"], errors="coerce").round().astype("Int64")  # bigint: sin ".0"
+    # NaN/NaT/NA → None (object para que los tipos nullable no dejen pd.NA en el JSON)
+    return df.astype(object).where(pd.notna(df), None)
 
 def _df_db_to_app(df_db: pd.DataFrame) -> pd.DataFrame:
     if df_db is None or df_db.empty:
@@ -201,15 +505,81 @@ def _df_db_to_app(df_db: pd.DataFrame) -> pd.DataFrame:
     df["Vigencia"] = pd.to_numeric(df["Vigencia"], errors="coerce")
     return df
 
-def supabase_fetch_all() -> pd.DataFrame:
+SUPABASE_PAGE_SIZE = 1000  # PostgREST corta por defecto en 1000 filas por respuesta
+
+def _tipo_columna_db(col: str) -> str:
+    if col.startswith("fecha_") or col.endswith("_at"): return "datetime64[ns]"
+    if col in ("valor_factura","valor_radicado","vigencia","version"): return "float64"
+    return "object"
+
+def _convertir_pagina(serie: pd.Series, tipo: str) -> np.ndarray:
+    if tipo == "datetime64[ns]":
+        t = pd.to_datetime(serie, errors="coerce", utc=True).dt.tz_convert(None)
+        return t.to_numpy(dtype="datetime64[ns]")
+    if tipo == "float64":
+        return pd.to_numeric(serie, errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    return serie.to_numpy(dtype=object)
+
+def _buffer_vacio(tipo: str, n: int) -> np.ndarray:
+    if tipo == "datetime64[ns]": return np.full(n, np.datetime64("NaT"), dtype=tipo)
+    if tipo == "float64": return np.full(n, np.nan)
+    return np.full(n, None, dtype=object)
+
+def supabase_fetch_all(columnas: list[str] | None = None, page_size: int | None = None,
+                       columnas_extra: list[str] = (), desde: tuple[str, object] | None = None) -> pd.DataFrame:
+    """
+    Lee el inventario por páginas (keyset sobre numero_factura) y las vuelca en
+    buffers tipados preasignados con el conteo de la primera respuesta.
+    `columnas` (nombres App) limita el SELECT; la PK siempre viaja.
+    `columnas_extra` son columnas DB fuera de APP2DB (p.ej. updated_at) y
+    `desde=(columna_db, valor)` filtra las filas con columna >= valor.
+    """
     sb = _get_supabase()
     if not sb: raise RuntimeError("Supabase no configurado")
-    res = sb.table(DB_TABLE).select("*").execute()
-    rows = res.data or []
-    df_db = pd.DataFrame(rows)
-    df_app = _df_db_to_app(df_db)
-    for k in APP2DB.keys():
-        if k not in df_app.columns: df_app[k] = pd.NA
+    if page_size is None:
+        try: page_size = int(st.secrets.get("supabase", {}).get("page_size", SUPABASE_PAGE_SIZE))
+        except Exception: page_size = SUPABASE_PAGE_SIZE
+    page_size = max(1, int(page_size))
+
+    cols_db = [APP2DB[c] for c in columnas if c in APP2DB] if columnas else list(APP2DB.values())
+    if DB_PK not in cols_db: cols_db = [DB_PK] + cols_db
+    cols_db += [c for c in columnas_extra if c not in cols_db]
+    tipos = {c: _tipo_columna_db(c) for c in cols_db}
+
+    t_total = time.perf_counter()
+    bufs, capacidad, n, ultimo, pagina = None, 0, 0, None, 0
+    while True:
+        t0 = time.perf_counter()
+        q = sb.table(DB_TABLE).select(",".join(cols_db), count="exact" if pagina == 0 else None)
+        if desde is not None:
+            v = desde[1]
+            q = q.gte(desde[0], v.isoformat() if hasattr(v, "isoformat") else v)
+        if ultimo is not None: q = q.gt(DB_PK, ultimo)
+        res = ejecutar_supabase(q.order(DB_PK).limit(page_size), "select")
+        rows = res.data or []
+        if bufs is None:
+            capacidad = max(int(getattr(res, "count", None) or 0), len(rows))
+            bufs = {c: _buffer_vacio(t, capacidad) for c, t in tipos.items()}
+        if n + len(rows) > capacidad:  # crecieron las filas entre páginas
+            extra = max(n + len(rows) - capacidad, page_size)
+            bufs = {c: np.concatenate([b, _buffer_vacio(tipos[c], extra)]) for c, b in bufs.items()}
+            capacidad += extra
+        if rows:
+            page = pd.DataFrame(rows, columns=cols_db)
+            for c, t in tipos.items():
+                bufs[c][n:n+len(rows)] = _convertir_pagina(page[c], t)
+            n += len(rows)
+            ultimo = rows[-1][DB_PK]
+        registrar_metrica("supabase_pagina", pagina=pagina + 1, filas=len(rows),
+                          ms=round((time.perf_counter() - t0) * 1000, 1))
+        pagina += 1
+        if len(rows) < page_size: break
+    registrar_metrica("supabase_fetch", paginas=pagina, filas=n, columnas=len(cols_db),
+                      ms=round((time.perf_counter() - t_total) * 1000, 1))
+
+    df_app = pd.DataFrame({DB2APP.get(c, c): b[:n] for c, b in bufs.items()})
+    for k in (columnas or APP2DB.keys()):
+        if k in APP2DB and k not in df_app.columns: df_app[k] = pd.NA
     return df_app
 
 def supabase_upsert(df_app: pd.DataFrame, pk: str = DB_PK) -> tuple[bool, str]:
@@ -223,68 +593,2537 @@ def supabase_upsert(df_app: pd.DataFrame, pk: str = DB_PK) -> tuple[bool, str]:
         return False, f"Hay registros sin '{pk}'"
     try:
         records = df_db.to_dict(orient="records")
-        sb.table(DB_TABLE).upsert(records, on_conflict=pk).execute()
+        ejecutar_supabase(sb.table(DB_TABLE).upsert(records, on_conflict=pk), "upsert")
         return True, "OK_SUPABASE"
     except Exception as e:
         return False, f"Error Supabase upsert: {e}"
 
+def supabase_delete(claves: list[str], pk: str = DB_PK, lote: int = 500) -> tuple[bool, str]:
+    sb = _get_supabase()
+    if not sb: return False, "Supabase no configurado"
+    if not claves: return True, "OK_SUPABASE_NOOP"
+    try:
+        for i in range(0, len(claves), lote):
+            ejecutar_supabase(sb.table(DB_TABLE).delete().in_(pk, claves[i:i+lote]), "delete")
+        return True, "OK_SUPABASE"
+    except Exception as e:
+        return False, f"Error Supabase delete: {e}"
+
+def supabase_update_lote(claves: list[str], cambios: dict, pk: str = DB_PK, lote: int = 500,
+                         version: int | None = None) -> tuple[bool, str, list[str]]:
+    """
+    UPDATE ... SET cambios WHERE pk IN (claves), en lotes (sin reenviar filas completas).
+    Con `version`, solo las filas que siguen en esa versión (AND version = v): devuelve
+    además las claves que sí se actualizaron.
+    """
+    sb = _get_supabase()
+    if not sb: return False, "Supabase no configurado", []
+    if not claves or not cambios: return True, "OK_SUPABASE_NOOP", []
+    valores = {APP2DB.get(k, k): (v.isoformat() if isinstance(v, pd.Timestamp) else v) for k, v in cambios.items()}
+    hechas = []
+    try:
+        for i in range(0, len(claves), lote):
+            q = sb.table(DB_TABLE).update(valores).in_(pk, claves[i:i+lote])
+            if version is not None:
+                q = q.eq("version", version) if version else q.or_("version.is.null,version.eq.0")
+            res = ejecutar_supabase(q, "update", reintentar=version is None)
+            hechas += [str(r.get(pk)).strip() for r in (res.data or [])] if version is not None else claves[i:i+lote]
+        return True, "OK_SUPABASE", hechas
+    except Exception as e:
+        return False, f"Error Supabase update: {e}", hechas
+
+def supabase_versiones(claves: list[str], pk: str = DB_PK, lote: int = 500) -> pd.Series:
+    """Version vigente en la DB por clave (las que no existen no aparecen)."""
+    sb = _get_supabase()
+    if not sb: raise RuntimeError("Supabase no configurado")
+    filas = []
+    for i in range(0, len(claves), lote):
+        res = ejecutar_supabase(sb.table(DB_TABLE).select(f"{pk},version").in_(pk, claves[i:i+lote]), "versiones")
+        filas += res.data or []
+    return _versiones_de(pd.DataFrame(filas, columns=[pk, "version"]).rename(columns=DB2APP))
+
+GUARDAR_RPC = "guardar_con_version"  # ver supabase/version.sql
+
+def _esperadas_delta(delta: dict) -> pd.Series:
+    """Version que vio el usuario por clave: la de cada upsert (0 = nueva) y la previa de cada borrada."""
+    up = delta["upserts"]
+    k_up = _clave_factura(up["NumeroFactura"]).to_numpy() if len(up) else np.array([], dtype=object)
+    v_up = pd.to_numeric(up["Version"], errors="coerce").fillna(0).to_numpy(dtype=float) if len(up) else []
+    borrar = pd.Index(delta["borrar"], dtype=object)
+    return pd.concat([pd.Series(v_up, index=k_up, dtype=float),
+                      _versiones_de(delta["previos"]).reindex(borrar).fillna(0)])
+
+def supabase_guardar_versionado(delta: dict, pk: str = DB_PK, lote: int = 500) -> tuple[bool, str, list[str]]:
+    """
+    Escribe el delta con compare-and-set: cada upsert va con Version + 1 solo si la fila sigue en la
+    Version que vio el usuario (o se inserta si era nueva y nadie la creó); cada clave de 'borrar' se
+    elimina solo si sigue en su versión previa. Con la función guardar_con_version de Postgres es una
+    llamada por lote; sin ella, UPDATE ... WHERE version = v fila a fila y DELETE por versión.
+    Devuelve (ok, msg, claves escritas o eliminadas); las demás cambiaron entre tanto.
+    """
+    sb = _get_supabase()
+    if not sb: return False, "Supabase no configurado", []
+    esperadas = _esperadas_delta(delta)
+    up = delta["upserts"]
+    registros = []
+    if len(up):
+        filas = _df_app_to_db(up.assign(Version=esperadas.iloc[:len(up)].to_numpy() + 1))
+        if filas[pk].isna().any() or (filas[pk].astype(str).str.strip() == "").any():
+            return False, f"Hay registros sin '{pk}'", []
+        registros = filas.to_dict(orient="records")
+    borrar = [{pk: k, "version": int(v)} for k, v in esperadas.iloc[len(up):].items()]
+    hechas = []
+    try:
+        try:
+            for i in range(0, max(len(registros), len(borrar)), lote):
+                res = ejecutar_supabase(sb.rpc(GUARDAR_RPC, {"filas": registros[i:i+lote], "borrar": borrar[i:i+lote]}),
+                                        "guardar", reintentar=False)
+                hechas += [str(d if not isinstance(d, dict) else next(iter(d.values()), "")).strip() for d in res.data or []]
+            return True, "OK_SUPABASE", hechas
+        except Exception as e:
+            if hechas or _es_transitorio(e): raise
+            registrar_metrica("supabase_llamada", operacion="guardar (sin función, fila a fila)", error=str(e)[:120])
+        for r in registros:
+            k, v = str(r[pk]).strip(), int(r["version"]) - 1
+            q = sb.table(DB_TABLE).update(r).eq(pk, k)
+            res = ejecutar_supabase(q.eq("version", v) if v else q.or_("version.is.null,version.eq.0"), "update",
+                                    reintentar=False)
+            if not res.data and not v:
+                res = ejecutar_supabase(sb.table(DB_TABLE).upsert(r, on_conflict=pk, ignore_duplicates=True), "upsert",
+                                        reintentar=False)
+            if res.data: hechas.append(k)
+        por_version = pd.Series([b[pk] for b in borrar], index=[b["version"] for b in borrar], dtype=object)
+        for v, claves in por_version.groupby(level=0):
+            claves = list(claves)
+            for i in range(0, len(claves), lote):
+                q = sb.table(DB_TABLE).delete().in_(pk, claves[i:i+lote])
+                res = ejecutar_supabase(q.eq("version", v) if v else q.or_("version.is.null,version.eq.0"), "delete",
+                                        reintentar=False)
+                hechas += [str(r.get(pk)).strip() for r in res.data or []]
+        return True, "OK_SUPABASE", hechas
+    except Exception as e:
+        return False, f"Error Supabase guardar: {e}", hechas
+
+# ====== Delta de cambios (solo filas insertadas / actualizadas / eliminadas) ======
+COLS_FECHA = ["Fecha factura","FechaRadicacion","FechaMovimiento"]
+COLS_VALOR = ["Valor Factura","Valor Radicado"]
+
+def _tipar_guardado(df_in: pd.DataFrame) -> pd.DataFrame:
+    """Columnas esperadas + tipos de fechas/valores, igual para guardar y para comparar."""
+    df = df_in.astype({c: object for c in df_in.columns if isinstance(df_in[c].dtype, pd.CategoricalDtype)})
+    for c in APP2DB.keys():
+        if c not in df.columns: df[c] = pd.NA
+    for c in COLS_FECHA:
+        df[c] = pd.to_datetime(df[c], errors="coerce")
+    for c in COLS_VALOR:
+        df[c] = pd.to_numeric(df[c], errors="coerce")
+    df["Version"] = pd.to_numeric(df["Version"], errors="coerce")
+    return df
+
+def _clave_factura(s: pd.Series) -> pd.Series:
+    """NumeroFactura normalizado como texto ('' si falta)."""
+    return s.astype(object).where(s.notna(), "").astype(str).str.strip()
+
+def _en_claves(claves: pd.Series, conjunto) -> np.ndarray:
+    """claves.isin(conjunto) como máscara; en object porque isin sobre texto Arrow recorre los valores uno a uno."""
+    return claves.astype(object).isin(conjunto).to_numpy(dtype=bool)
+
+def calcular_delta(df_base: pd.DataFrame, df_nuevo: pd.DataFrame, permitir_borrado: bool = False) -> dict:
+    """
+    Compara el frame editado contra el snapshot cargado (clave NumeroFactura).
+    Devuelve 'upserts' (filas nuevas + modificadas), 'borrar' (claves eliminadas),
+    'previos' (versión anterior de las filas tocadas) y los conteos.
+    Las filas sin NumeroFactura van como nuevas (Supabase las rechaza, igual que antes); con
+    permitir_borrado (frame completo) reemplazan a las sin clave del almacén en vez de duplicarlas.
+    """
+    cols = list(APP2DB.keys())
+    if df_base is None: df_base = pd.DataFrame(columns=cols)
+    base = _tipar_guardado(df_base)
+    nuevo = _tipar_guardado(df_nuevo)
+    kb = _clave_factura(base["NumeroFactura"]).to_numpy()
+    kn = _clave_factura(nuevo["NumeroFactura"]).to_numpy()
+
+    b = base[cols].copy(); b.index = kb
+    b = b[(b.index != "") & ~b.index.duplicated(keep="last")]
+    sin_clave = nuevo.loc[kn == "", cols]
+    base_sin_clave = base.loc[kb == "", cols] if permitir_borrado else base.loc[[], cols]
+    n = nuevo[cols].copy(); n.index = kn
+    n = n[(n.index != "") & ~n.index.duplicated(keep="last")]
+
+    nuevas = n.index.difference(b.index, sort=False)
+    comunes = n.index.intersection(b.index, sort=False)
+    nb, nn = b.loc[comunes], n.loc[comunes]
+    actualizadas = comunes[~_filas_iguales(nb, nn)]
+    borradas = b.index.difference(n.index, sort=False) if permitir_borrado else b.index[:0]
+
+    upserts = pd.concat([n.loc[nuevas], n.loc[actualizadas], sin_clave]).reset_index(drop=True)
+    previos = pd.concat([b.loc[actualizadas.append(borradas)], base_sin_clave]).reset_index(drop=True)
+    sc_nuevas, sc_borradas = _diferencia_filas(sin_clave, base_sin_clave)
+    return {
+        "upserts": upserts,
+        "borrar": [str(k) for k in borradas],
+        "previos": previos,
+        "reemplazar_sin_clave": permitir_borrado,
+        "insertadas": len(nuevas) + (sc_nuevas if permitir_borrado else len(sin_clave)),
+        "actualizadas": len(actualizadas),
+        "eliminadas": len(borradas) + sc_borradas,
+    }
+
+def _filas_iguales(a: pd.DataFrame, b: pd.DataFrame) -> np.ndarray:
+    """Por fila, si a y b (mismo índice y columnas) tienen los mismos valores; NA es igual a NA."""
+    # En object y con None: comparar pd.NA contra un tipo nullable (Int16, Float64) lanza TypeError
+    a = a.astype(object).where(a.notna(), None)
+    b = b.astype(object).where(b.notna(), None)
+    return (b.eq(a) | (b.isna() & a.isna())).all(axis=1).to_numpy(dtype=bool)
+
+def _diferencia_filas(a: pd.DataFrame, b: pd.DataFrame) -> tuple[int, int]:
+    """Filas (como multiconjunto) que están solo en a y solo en b."""
+    if a.empty or b.empty: return len(a), len(b)
+    ha = pd.util.hash_pandas_object(a.astype(object).astype(str), index=False).value_counts()
+    hb = pd.util.hash_pandas_object(b.astype(object).astype(str), index=False).value_counts()
+    dif = ha.sub(hb, fill_value=0)
+    return int(dif.clip(lower=0).sum()), int((-dif).clip(lower=0).sum())
+
+def _filas_sin_clave_a_quitar(df_actual: pd.DataFrame, k_act: pd.Series, quitar: pd.DataFrame) -> np.ndarray:
+    """
+    Máscara de las filas sin clave de df_actual iguales (columnas APP2DB, ya normalizadas) a las
+    de `quitar`, una por cada fila de `quitar`. Las que otro ya cambió o borró no se encuentran.
+    """
+    marca = np.zeros(len(df_actual), dtype=bool)
+    cand = np.flatnonzero((k_act == "").to_numpy())
+    if not len(cand) or quitar is None or quitar.empty: return marca
+    def firmas(d):
+        n = normalize_dataframe(d).reindex(d.index)
+        return pd.util.hash_pandas_object(n[list(APP2DB)].astype(object).astype(str), index=False).to_numpy()
+    pendientes = pd.Series(firmas(quitar)).value_counts().to_dict()
+    for p, h in zip(cand, firmas(df_actual.iloc[cand])):
+        if pendientes.get(h, 0) > 0:
+            pendientes[h] -= 1
+            marca[p] = True
+    return marca
+
+def _fusionar_delta(df_actual: pd.DataFrame, delta: dict) -> pd.DataFrame:
+    """
+    Aplica un delta sobre el inventario completo conservando el orden de las filas existentes.
+    'quitar_sin_clave' (filas sin NumeroFactura borradas o editadas en la Tabla) las quita por contenido.
+    """
+    cambios = delta["upserts"]
+    if df_actual is None or df_actual.empty:
+        return cambios.reset_index(drop=True)
+    if "NumeroFactura" in df_actual.columns:
+        k_act = _clave_factura(df_actual["NumeroFactura"])
+    else:
+        k_act = pd.Series("", index=df_actual.index)
+    k_cam = _clave_factura(cambios["NumeroFactura"])
+
+    pos = pd.Series(np.arange(len(df_actual)), index=k_act.to_numpy())
+    pos = pos[(pos.index != "") & ~pos.index.duplicated()]
+    orden_cam = np.array(k_cam.map(pos), dtype=float)
+    nuevas = np.isnan(orden_cam)
+    orden_cam[nuevas] = len(df_actual) + np.arange(nuevas.sum())
+    # Columnas que solo existen en el archivo (p.ej. heredadas) se conservan en las filas actualizadas
+    extra = [c for c in df_actual.columns if c not in cambios.columns]
+    if extra:
+        src = df_actual[extra].iloc[np.where(nuevas, 0, orden_cam).astype(int)].reset_index(drop=True)
+        cambios = pd.concat([cambios.reset_index(drop=True), src.mask(pd.Series(nuevas), axis=0)], axis=1)
+
+    tocadas = set(k_cam[k_cam != ""]) | set(delta["borrar"])
+    if delta.get("reemplazar_sin_clave"): tocadas.add("")
+    resto_mask = ~_en_claves(k_act, tocadas)
+    if not delta.get("reemplazar_sin_clave"):
+        resto_mask &= ~_filas_sin_clave_a_quitar(df_actual, k_act, delta.get("quitar_sin_clave"))
+    resto = df_actual[resto_mask].assign(_orden=np.flatnonzero(resto_mask))
+    out = pd.concat([resto, cambios.assign(_orden=orden_cam)], ignore_index=True)
+    return out.sort_values("_orden", kind="stable").drop(columns="_orden").reset_index(drop=True)
+
+# ====== Control optimista de concurrencia (columna Version por fila) ======
+COLS_CONFLICTO = (["NumeroFactura","Operación","Motivo","Tu versión","Versión actual"]
+                  + [c for c in APP2DB if c != "NumeroFactura"])
+
+def _sin_conflictos() -> pd.DataFrame:
+    return pd.DataFrame(columns=COLS_CONFLICTO)
+
+def _versiones_de(df: pd.DataFrame) -> pd.Series:
+    """Version vigente por NumeroFactura (sin versión = 0; filas sin clave fuera)."""
+    if df is None or df.empty or "NumeroFactura" not in df.columns: return pd.Series(dtype=float)
+    v = pd.to_numeric(df["Version"], errors="coerce") if "Version" in df.columns else pd.Series(np.nan, index=df.index)
+    out = pd.Series(v.fillna(0).to_numpy(dtype=float), index=_clave_factura(df["NumeroFactura"]).to_numpy())
+    return out[(out.index != "") & ~out.index.duplicated(keep="last")]
+
+def _version_fila(v) -> int:
+    v = pd.to_numeric(v, errors="coerce")
+    return 0 if pd.isna(v) else int(v)
+
+def _delta_vacio(delta: dict) -> bool:
+    return (delta["upserts"].empty and not delta["borrar"] and not delta.get("reemplazar_sin_clave")
+            and not len(delta.get("quitar_sin_clave", ())))
+
+def separar_conflictos(delta: dict, vigentes: pd.Series) -> tuple[dict, pd.DataFrame]:
+    """
+    Cada fila del delta trae la Version que vio quien la editó (0 si es nueva). Si la vigente
+    (`vigentes`, por clave; ausente = 0) es otra, alguien más la cambió entre tanto: la fila sale
+    del delta y va a conflictos. Las que pasan se escriben con Version + 1.
+    """
+    up, previos = delta["upserts"], delta["previos"]
+    vigentes = vigentes[~vigentes.index.duplicated(keep="last")]
+    k_up = _clave_factura(up["NumeroFactura"]).to_numpy() if len(up) else np.array([], dtype=object)
+    esperada = pd.to_numeric(up["Version"], errors="coerce").fillna(0).to_numpy(dtype=float)
+    existe = pd.Index(k_up).isin(vigentes.index)
+    vig = np.where(existe, vigentes.reindex(k_up).to_numpy(dtype=float), 0.0)
+    choque = (k_up != "") & (vig != esperada)
+
+    ver_prev = _versiones_de(previos)
+    borrar = pd.Index(delta["borrar"], dtype=object)
+    vig_b = vigentes.reindex(borrar)
+    esp_b = ver_prev.reindex(borrar).fillna(0)
+    choque_b = (vig_b.notna() & (vig_b != esp_b)).to_numpy(dtype=bool)  # ya borradas: sin conflicto
+
+    era_nueva = ~pd.Index(k_up[choque]).isin(ver_prev.index)
+    conf_up = up[choque].assign(**{
+        "Operación": np.where(era_nueva, "crear", "actualizar"),
+        "Motivo": np.select([~existe[choque], era_nueva],
+                            ["eliminada por otro usuario", "creada por otro usuario"], "modificada por otro usuario"),
+        "Tu versión": esperada[choque], "Versión actual": vig[choque]})
+    k_prev = _clave_factura(previos["NumeroFactura"]).to_numpy() if len(previos) else np.array([], dtype=object)
+    sel_b = pd.Series(choque_b, index=borrar)
+    en_conf_b = pd.Index(k_prev).isin(borrar[choque_b])
+    conf_b = previos[en_conf_b].assign(**{
+        "Operación": "eliminar", "Motivo": "modificada por otro usuario",
+        "Tu versión": ver_prev.reindex(k_prev[en_conf_b]).to_numpy(),
+        "Versión actual": vigentes.reindex(k_prev[en_conf_b]).to_numpy()})
+    conflictos = pd.concat([_sin_conflictos(), conf_up, conf_b], ignore_index=True)[COLS_CONFLICTO]
+    conflictos = conflictos.astype({"Tu versión": "Int64", "Versión actual": "Int64"})
+
+    fuera = set(k_up[choque]) | set(borrar[choque_b])
+    upserts = up[~choque].assign(Version=esperada[~choque] + 1).reset_index(drop=True)
+    n_upd = int((conf_up["Operación"] == "actualizar").sum())
+    return {
+        **delta,
+        "upserts": upserts,
+        "borrar": [k for k, c in sel_b.items() if not c],
+        "previos": previos[~pd.Index(k_prev).isin(list(fuera))].reset_index(drop=True),
+        "insertadas": delta["insertadas"] - (len(conf_up) - n_upd),
+        "actualizadas": delta["actualizadas"] - n_upd,
+        "eliminadas": delta["eliminadas"] - int(choque_b.sum()),
+    }, conflictos
+
+def _aplicar_delta_local(delta: dict, path: str = INVENTARIO_STORE) -> tuple[bool, str, dict, pd.DataFrame]:
+    """
+    Relee el almacén local bajo lock, descarta las filas en conflicto de versión, aplica el resto
+    y lo reescribe (no pisa filas ajenas). Devuelve (ok, msg, delta aplicado, conflictos).
+    """
+    _asegurar_store_local()
+    try:
+        with FileLock(INVENTARIO_LOCK, timeout=10):
+            actual = _read_local(path)
+            delta, conflictos = separar_conflictos(delta, _versiones_de(actual))
+            if not _delta_vacio(delta):
+                _escribir_local_atomico(_fusionar_delta(actual, delta), path)
+        return True, "OK_LOCAL", delta, conflictos
+    except Timeout:
+        return False, "Otro usuario está guardando en este momento. Intenta de nuevo.", delta, _sin_conflictos()
+    except Exception as e:
+        return False, f"Error guardando almacén local: {e}", delta, _sin_conflictos()
+
+def _delta_normalizado(delta: dict) -> dict:
+    """'previos' y 'upserts' con los mismos tipos/derivadas que load_data (para el cubo)."""
+    norm = lambda d: d if d is None or d.empty else normalize_dataframe(d)
+    return {"previos": norm(delta["previos"]), "upserts": norm(delta["upserts"])}
+
+def _registrar_guardado(delta: dict, destino: str, t0: float, conflictos: pd.DataFrame | None = None):
+    st.session_state["_ultimo_guardado"] = {
+        "destino": destino,
+        "insertadas": delta["insertadas"],
+        "actualizadas": delta["actualizadas"],
+        "eliminadas": delta["eliminadas"],
+        "conflictos": 0 if conflictos is None else len(conflictos),
+        "segundos": time.perf_counter() - t0,
+    }
+    if conflictos is not None and not conflictos.empty:
+        st.session_state["_conflictos"] = conflictos
+
+def resumen_guardado() -> str:
+    """Texto corto con filas tocadas y duración del último guardado de esta sesión."""
+    g = st.session_state.get("_ultimo_guardado")
+    if not g: return ""
+    n = g["insertadas"] + g["actualizadas"] + g["eliminadas"]
+    conf = f"; {g['conflictos']} en conflicto sin guardar" if g.get("conflictos") else ""
+    if n == 0: return f"sin cambios{conf} ({g['segundos']:.2f} s)"
+    return (f"{n} filas ({g['insertadas']} nuevas, {g['actualizadas']} actualizadas, "
+            f"{g['eliminadas']} eliminadas{conf}) en {g['segundos']:.2f} s")
+
+def conflictos_guardado() -> pd.DataFrame:
+    """Filas del último guardado de esta sesión que no se escribieron por conflicto de versión."""
+    return st.session_state.get("_conflictos", _sin_conflictos())
+
+# ====== Sincronización incremental con Supabase (snapshot + marca de agua) ======
+SYNC_FULL_CADA_S = 15 * 60               # relectura completa periódica (borrados / filas sin marca)
+SYNC_MARGEN = pd.Timedelta(minutes=5)    # tolerancia a relojes desfasados entre servidores
+
+def _columna_sync() -> str:
+    """Columna DB usada como marca de agua (secrets supabase.columna_sync; p.ej. updated_at)."""
+    try:
+        return (st.secrets.get("supabase", {}).get("columna_sync") or "fecha_movimiento").strip()
+    except Exception:
+        return "fecha_movimiento"
+
+@st.cache_resource
+def _estado_sync() -> dict:
+    """Último inventario normalizado leído de Supabase y su marca (compartido por el proceso)."""
+    return {"df": None, "marca": None, "full_ts": 0.0, "version": None, "lock": threading.Lock()}
+
+def reiniciar_sync():
+    est = _estado_sync()
+    with est["lock"]:
+        est["df"], est["marca"], est["full_ts"], est["version"] = None, None, 0.0, None
+
+def _marca_de(df_app: pd.DataFrame, col_db: str):
+    col = DB2APP.get(col_db, col_db)
+    if df_app is None or df_app.empty or col not in df_app.columns: return None
+    m = pd.to_datetime(df_app[col], errors="coerce").max()
+    return None if pd.isna(m) else m
+
+def supabase_sync(version: int | None = None) -> pd.DataFrame:
+    """
+    Devuelve el inventario normalizado trayendo solo las filas con marca >= última marca
+    y fusionándolas por numero_factura. Lee todo si no hay snapshot o si venció el refresco.
+    Las ediciones que no mueven la marca (con fecha_movimiento) llegan en el refresco completo;
+    las propias se fusionan al guardar (_sync_aplicar_delta).
+    `version` es la versión de datos que se está cargando: se sincroniza una vez por versión
+    (todas las proyecciones de esa versión ven las mismas filas) y el cubo de esa versión se ajusta.
+    """
+    est = _estado_sync()
+    col = _columna_sync()
+    extra = [] if col in DB2APP else [col]
+    with est["lock"]:
+        t0 = time.perf_counter()
+        completo = est["df"] is None or est["marca"] is None or (time.time() - est["full_ts"]) > SYNC_FULL_CADA_S
+        if not completo and version is not None and est["version"] == version:
+            return est["df"]
+        est["version"] = version
+        if completo:
+            leidas = supabase_fetch_all(columnas_extra=extra)
+            est["df"] = normalize_dataframe(leidas)
+            est["full_ts"] = time.time()
+            _ajustar_cubo(version)
+        else:
+            leidas = supabase_fetch_all(columnas_extra=extra, desde=(col, est["marca"] - SYNC_MARGEN))
+            if not leidas.empty:
+                nuevas = normalize_dataframe(leidas)
+                k_ant = _clave_factura(est["df"]["NumeroFactura"])
+                previos = est["df"][k_ant.isin(set(_clave_factura(nuevas["NumeroFactura"]))).to_numpy()]
+                est["df"] = aplicar_esquema(_fusionar_delta(est["df"], {"upserts": nuevas, "borrar": []}))
+                _ajustar_cubo(version, {"previos": previos, "upserts": nuevas})
+        marca = _marca_de(leidas, col)
+        if marca is not None and (est["marca"] is None or marca > est["marca"]):
+            est["marca"] = marca
+        registrar_metrica("supabase_sync", modo="completo" if completo else "incremental",
+                          filas=len(leidas), total=len(est["df"]),
+                          ms=round((time.perf_counter() - t0) * 1000, 1))
+        return est["df"]
+
+def _sync_aplicar_delta(delta: dict):
+    """Fusiona en el snapshot lo que acabamos de guardar (sin mover la marca)."""
+    est = _estado_sync()
+    with est["lock"]:
+        if est["df"] is None: return
+        cambios = delta["upserts"]
+        if not cambios.empty: cambios = normalize_dataframe(cambios)
+        est["df"] = aplicar_esquema(_fusionar_delta(est["df"], {**delta, "upserts": cambios}))
+
 # ====== Carga/guardado central ======
-@st.cache_data
-def load_data():
+# Columnas que bastan para Dashboard / Reportes / Avance (sin observaciones, paciente, etc.)
+COLS_RESUMEN = ("NumeroFactura","EPS","Vigencia","Estado","Valor Factura","Valor Radicado","FechaRadicacion","Mes")
+
+@st.cache_resource
+def _cache_inventario() -> dict:
+    """
+    Inventario compartido por todas las sesiones del proceso, por proyección de columnas.
+    'version' es la versión de datos: sube solo al guardar/recargar/importar (nueva_version_datos);
+    cada entrada guarda la versión con la que empezó a cargarse. 'cargando' marca la carga en curso
+    (una sola por proyección: los demás esperan o reciben la versión anterior).
+    """
+    return {"version": 0, "entradas": {}, "cargando": {}, "aciertos": 0, "cond": threading.Condition()}
+
+def version_datos() -> int:
+    return _cache_inventario()["version"]
+
+_hilo_servidas = threading.local()
+
+@contextlib.contextmanager
+def versiones_servidas():
+    """
+    Junta la versión de cada inventario / cubo entregado en este hilo dentro del bloque (arranca
+    con la versión vigente). Lo que se arme con ellos se etiqueta con min(usadas): si se usó la
+    copia anterior de una carga en curso, el resultado no pasa por la versión nueva.
+    """
+    previas = getattr(_hilo_servidas, "usadas", None)
+    _hilo_servidas.usadas = usadas = [version_datos()]
+    try:
+        yield usadas
+    finally:
+        _hilo_servidas.usadas = previas
+        if previas is not None: previas.extend(usadas)
+
+def _anotar_servida(version: int):
+    usadas = getattr(_hilo_servidas, "usadas", None)
+    if usadas is not None: usadas.append(version)
+
+def load_data(columnas: tuple[str, ...] | None = None, fresco: bool = False) -> pd.DataFrame:
+    """
+    Inventario normalizado desde el cache compartido. Si la versión cambió, una sola sesión
+    recarga; las demás reciben la copia anterior mientras tanto, salvo fresco=True
+    (guardar / verificar), que espera a la carga en curso.
+    """
+    version, df = load_data_version(columnas, fresco)
+    _anotar_servida(version)
+    return df
+
+def load_data_version(columnas: tuple[str, ...] | None = None, fresco: bool = False) -> tuple[int, pd.DataFrame]:
+    """
+    Como load_data, con la versión de datos del inventario entregado: mientras otra sesión
+    recarga puede ser anterior a version_datos(). Los caches derivados se etiquetan con ella.
+    """
+    c = _cache_inventario()
+    clave = tuple(columnas) if columnas else ()
+    t0 = time.perf_counter()
+    _pedir_sync_completo()
+    with c["cond"]:
+        while True:
+            version = c["version"]
+            entrada = c["entradas"].get(clave)
+            if entrada is not None and entrada[0] == version:
+                c["aciertos"] += 1
+                return entrada[0], entrada[1].copy(deep=False)  # copia perezosa (copy-on-write)
+            if clave not in c["cargando"]:
+                c["cargando"][clave] = version
+                break
+            if entrada is not None and not fresco:
+                registrar_metrica("inventario_cache", evento="versión anterior", version=entrada[0],
+                                  ms=round((time.perf_counter() - t0) * 1000, 1))
+                return entrada[0], entrada[1].copy(deep=False)
+            c["cond"].wait(timeout=1.0)
+    df = None
+    try:
+        df = _cargar_inventario(columnas, version)
+    finally:
+        with c["cond"]:
+            c["cargando"].pop(clave, None)
+            if df is not None:
+                previa = c["entradas"].get(clave)
+                if previa is None or previa[0] <= version:
+                    c["entradas"][clave] = (version, df)
+            c["cond"].notify_all()
+    registrar_metrica("inventario_cache", evento="carga", version=version, filas=len(df),
+                      aciertos=c["aciertos"], ms=round((time.perf_counter() - t0) * 1000, 1))
+    return version, df.copy(deep=False)
+
+def _pedir_sync_completo():
+    """
+    El refresco completo de Supabase va por edad, no solo por guardados locales: si el snapshot
+    tiene más de SYNC_FULL_CADA_S y es de la versión vigente, se relee todo (borrados y ediciones
+    ajenas que no mueven la marca). La versión sube solo si llegó algo distinto; la carga que
+    sigue usa ese snapshot sin volver a leer.
+    """
+    est, c = _estado_sync(), _cache_inventario()
+    if est["df"] is None or (time.time() - est["full_ts"]) <= SYNC_FULL_CADA_S: return
+    if not est["lock"].acquire(blocking=False): return   # sincronización en curso
+    try:
+        if (time.time() - est["full_ts"]) <= SYNC_FULL_CADA_S or est["version"] != version_datos(): return
+        t0 = time.perf_counter()
+        col = _columna_sync()
+        try:
+            leidas = supabase_fetch_all(columnas_extra=[] if col in DB2APP else [col])
+        except Exception as e:
+            registrar_metrica("supabase_sync", modo="completo", error=str(e)[:200])
+            return   # la próxima carga lo intenta por su cuenta (supabase_sync, por edad)
+        nuevo = normalize_dataframe(leidas)
+        cambio = not _misma_firma(nuevo, est["df"])
+        with c["cond"]:
+            if est["version"] != c["version"]: return   # alguien guardó mientras se leía
+            if cambio:
+                est["df"] = nuevo
+                est["version"] = nueva_version_datos()
+            est["full_ts"] = time.time()
+            marca = _marca_de(leidas, col)
+            if marca is not None and (est["marca"] is None or marca > est["marca"]):
+                est["marca"] = marca
+        registrar_metrica("supabase_sync", modo="completo", filas=len(leidas), cambio=cambio,
+                          ms=round((time.perf_counter() - t0) * 1000, 1))
+    finally:
+        est["lock"].release()
+
+def _misma_firma(a: pd.DataFrame, b: pd.DataFrame) -> bool:
+    """Mismas columnas y mismas filas sin importar el orden (hash por fila)."""
+    if len(a) != len(b) or set(a.columns) != set(b.columns): return False
+    cols = sorted(a.columns)
+    ha = np.sort(pd.util.hash_pandas_object(a[cols], index=False).to_numpy())
+    hb = np.sort(pd.util.hash_pandas_object(b[cols], index=False).to_numpy())
+    return bool(np.array_equal(ha, hb))
+
+def _cargar_inventario(columnas: tuple[str, ...] | None = None, version: int | None = None) -> pd.DataFrame:
+    """
+    Inventario normalizado. En Supabase se sincroniza incrementalmente contra el snapshot
+    del proceso; `columnas` (nombres App) trae solo esa proyección si aún no hay snapshot.
+    """
     # 1) Intentar Supabase
     try:
         sb = _get_supabase()
         if sb:
-            df_app = supabase_fetch_all()
+            if columnas and _estado_sync()["df"] is None:
+                df_app = normalize_dataframe(supabase_fetch_all(columnas=list(columnas)))
+            else:
+                df_app = supabase_sync(version)
             if df_app is not None and len(df_app) > 0:
-                return normalize_dataframe(df_app)
+                return df_app
             else:
-                st.info("Supabase sin datos; usando Excel local.")
+                st.info("Supabase sin datos; usando almacén local.")
     except Exception as e:
-        st.warning(f"No pude leer Supabase, uso Excel local: {e}")
+        st.warning(f"No pude leer Supabase, uso almacén local: {e}")
 
-    # 2) Excel local
-    df_raw = _read_excel_local(INVENTARIO_LOCAL)
+    # 2) Almacén local (se lee entero una vez; la proyección reutiliza ese cache). fresco: la
+    # proyección no puede quedar guardada con la versión nueva y las filas de la anterior
+    if columnas: return load_data(fresco=True)
+    _asegurar_store_local()
+    df_raw = _read_local(INVENTARIO_STORE)
     if df_raw.empty:
         cols_min = list(APP2DB.keys())
         return normalize_dataframe(pd.DataFrame(columns=cols_min))
     return normalize_dataframe(df_raw)
 
-def guardar_inventario(df: pd.DataFrame, factura_verificar: str | None = None) -> tuple[bool, str]:
-    """Guarda en Supabase si está configurado; si no, en Excel. Luego verifica."""
-    df_to_save = df.copy()
-    # Tipos antes de guardar
-    for c in ["Fecha factura","FechaRadicacion","FechaMovimiento"]:
-        df_to_save[c] = pd.to_datetime(df_to_save[c], errors="coerce")
-    for c in ["Valor Factura","Valor Radicado"]:
-        df_to_save[c] = pd.to_numeric(df_to_save[c], errors="coerce")
+def _verificar_factura(factura_verificar: str | None, destino: str) -> tuple[bool, str]:
+    if not factura_verificar: return True, ""
+    df_new = load_data(fresco=True)
+    ok_row = _clave_factura(df_new["NumeroFactura"]).eq(str(factura_verificar).strip()).any()
+    if not ok_row:
+        return False, f"Guardó en {destino}, pero la factura {factura_verificar} no aparece al releer."
+    return True, ""
 
-    # Supabase
+def _claves_delta(delta: dict) -> list[str]:
+    return [k for k in _clave_factura(delta["upserts"]["NumeroFactura"]) if k] + list(delta["borrar"])
+
+def guardar_inventario(df: pd.DataFrame | None, factura_verificar: str | None = None,
+                       permitir_borrado: bool = False, base: pd.DataFrame | None = None,
+                       origen: str = "Tabla", delta: dict | None = None) -> tuple[bool, str]:
+    """
+    Guarda solo el delta frente a `base` (el snapshot que editó el usuario; por defecto el último
+    cargado): Supabase si está configurado; si no, almacén local. Luego verifica.
+    Si ya se tiene el delta (p.ej. delta_tabla de la Tabla por ventanas) se pasa en `delta` y df se ignora.
+    Las filas cuya Version cambió desde que el usuario las abrió no se escriben: quedan en
+    conflictos_guardado() para revisarlas. Solo la Tabla (edición libre) debe pasar permitir_borrado=True.
+    Los cambios de Estado quedan en la bitácora de movimientos con `origen` (pestaña que guardó).
+    """
+    t0 = time.perf_counter()
+    st.session_state.pop("_conflictos", None)
+    if delta is None:
+        delta = calcular_delta(load_data(fresco=True) if base is None else base, df, permitir_borrado=permitir_borrado)
+
+    # Supabase: escritura condicionada a la versión (compare-and-set); de las que no se escribieron
+    # se relee la versión vigente para mostrarlas como conflicto
     try:
         sb = _get_supabase()
         if sb:
-            ok, msg = supabase_upsert(df_to_save, pk=DB_PK)
+            ok, msg, hechas = supabase_guardar_versionado(delta, pk=DB_PK)
             if not ok: return False, msg
-            st.cache_data.clear()
-            if factura_verificar:
-                df_new = load_data()
-                ok_row = df_new["NumeroFactura"].astype(str).str.strip().eq(str(factura_verificar).strip()).any()
-                if not ok_row:
-                    return False, f"Guardó en Supabase, pero la factura {factura_verificar} no aparece al releer."
-            return True, "OK_SUPABASE"
+            esperadas = _esperadas_delta(delta)
+            vigentes = esperadas[esperadas.index.isin(hechas)]
+            fallidas = [k for k in _claves_delta(delta) if k not in set(hechas)]
+            if fallidas: vigentes = pd.concat([vigentes, supabase_versiones(fallidas)])
+            delta, conflictos = separar_conflictos(delta, vigentes)
+            return _cerrar_guardado(delta, conflictos, "Supabase", t0, factura_verificar, origen)
     except Exception as e:
-        st.warning(f"No pude guardar en Supabase, intento Excel local: {e}")
+        st.warning(f"No pude guardar en Supabase, intento almacén local: {e}")
 
-    # Excel
-    ok, msg = _write_excel_local(df_to_save, INVENTARIO_LOCAL)
+    # Local (Parquet, o Excel si falta pyarrow); el chequeo de versión va dentro del lock
+    ok, msg, delta, conflictos = _aplicar_delta_local(delta, INVENTARIO_STORE)
+    if not ok: return False, msg
+    return _cerrar_guardado(delta, conflictos, "local", t0, factura_verificar, origen)
+
+def _cerrar_guardado(delta: dict, conflictos: pd.DataFrame, destino: str, t0: float,
+                     factura_verificar: str | None, origen: str) -> tuple[bool, str]:
+    if destino == "Supabase": _sync_aplicar_delta(delta)
+    _anotar_movimientos(delta, origen)
+    nueva_version_datos(_delta_normalizado(delta))
+    _registrar_guardado(delta, destino, t0, conflictos)
+    if not conflictos.empty:
+        if _delta_vacio(delta):
+            return False, (f"{len(conflictos)} fila(s) cambiaron por otro usuario desde que las abriste; "
+                           "no se guardó nada. Revisa los conflictos.")
+        if str(factura_verificar or "").strip() in set(conflictos["NumeroFactura"].astype(str)):
+            factura_verificar = None  # no se escribió: no hay nada que verificar
+    ok, msg = _verificar_factura(factura_verificar, "Supabase" if destino == "Supabase" else "el almacén local")
     if not ok: return False, msg
-    st.cache_data.clear()
-    if factura_verificar:
-        df_new = load_data()
-        ok_row = df_new["NumeroFactura"].astype(str).str.strip().eq(str(factura_verificar).strip()).any()
-        if not ok_row:
-            return False, f"Guardó en Excel, pero la factura {factura_verificar} no aparece al releer."
-    return True, "OK_LOCAL"
+    return True, "OK_SUPABASE" if destino == "Supabase" else "OK_LOCAL"
+
+def _soltar_base_tabla():
+    """La Tabla vuelve a abrirse sobre el inventario vigente (y el editor sin ediciones pendientes)."""
+    st.session_state.pop("_tabla_base", None)
+    _descartar_ediciones_tabla()
+
+def _descartar_ediciones_tabla():
+    st.session_state.pop("_tabla_pendientes", None)
+    st.session_state.pop("_tabla_ventana", None)
+    for k in [k for k in st.session_state.keys() if str(k).startswith("tabla_editor_")]:
+        del st.session_state[k]
+
+def _olvidar_versiones_vistas(claves):
+    """Quita la versión recordada (y los widgets) de Gestión para esas facturas: se reabren frescas."""
+    vistas = st.session_state.get("_versiones_vistas", {})
+    for k in claves:
+        vistas.pop(k, None)
+        for w in [w for w in st.session_state.keys() if str(w).startswith(f"gestion_{k}_")]:
+            del st.session_state[w]
+
+def panel_conflictos(key: str):
+    """Filas no guardadas por conflicto de versión: tu versión junto a la actual, para decidir."""
+    conf = conflictos_guardado()
+    if conf.empty: return
+    st.warning(f"⚠️ {len(conf)} fila(s) no se guardaron: otro usuario las cambió después de que las abriste.")
+    actual = load_data()
+    claves = set(conf["NumeroFactura"].astype(str).str.strip())
+    vig = actual[_clave_factura(actual["NumeroFactura"]).isin(claves).to_numpy()]
+    comp = pd.concat([conf.assign(Origen="Tu versión"),
+                      vig.assign(Origen="Actual", **{"Operación": "", "Motivo": ""})], ignore_index=True)
+    cols = ["NumeroFactura","Origen","Operación","Motivo"] + [c for c in APP2DB if c != "NumeroFactura"]
+    st.dataframe(comp.sort_values(["NumeroFactura","Origen"], ascending=[True, False], kind="stable")[cols],
+                 use_container_width=True, hide_index=True, key=f"{key}_tabla_conflictos")
+    st.caption("Las eliminaciones en conflicto no se fuerzan: revisa la fila actual y bórrala de nuevo si corresponde.")
+    c1, c2 = st.columns(2)
+    if c1.button("Guardar mi versión de todos modos", key=f"{key}_forzar_conflictos"):
+        mias = conf[conf["Operación"] != "eliminar"]
+        mias = mias.assign(Version=_clave_factura(mias["NumeroFactura"]).map(_versiones_de(actual)).fillna(0).to_numpy())
+        ok, msg = guardar_inventario(mias[list(APP2DB.keys())], origen="Conflictos")
+        if ok:
+            _olvidar_versiones_vistas(claves)
+            flash_success(f"✅ Tu versión quedó guardada — {resumen_guardado()}.")
+            st.rerun()
+        else:
+            st.error(f"❌ {msg}")
+    if c2.button("Descartar mis cambios en conflicto", key=f"{key}_descartar_conflictos"):
+        st.session_state.pop("_conflictos", None)
+        _olvidar_versiones_vistas(claves)
+        st.rerun()
+
+# ====== Tabla por ventanas (filtro, orden y página en el servidor) ======
+# El editor recibe solo la página visible del snapshot. Su estado (edited_rows / added_rows /
+# deleted_rows, por posición dentro de la página) se traduce a etiquetas del snapshot y se acumula
+# en sesión al cambiar de página; al guardar viaja solo el delta de las filas tocadas.
+TABLA_FILAS_POR_PAGINA = [50, 100, 200, 500]
+TABLA_ORIGINAL = "(orden original)"
+
+def tabla_pendientes() -> dict:
+    """Ediciones de la Tabla aún sin guardar: {'editadas': {etiqueta: {col: valor}}, 'nuevas': [...], 'borradas': {...}}."""
+    return st.session_state.setdefault("_tabla_pendientes", {"editadas": {}, "nuevas": [], "borradas": set()})
+
+def _acumular_editor(key: str, etiquetas) -> bool:
+    """Pasa el estado del editor `key` (mostrado sobre `etiquetas`) a las pendientes. True si había algo."""
+    estado = st.session_state.get(key) or {}
+    editadas, nuevas, borradas = (estado.get("edited_rows") or {}), (estado.get("added_rows") or []), (estado.get("deleted_rows") or [])
+    pend = tabla_pendientes()
+    for pos, cambios in editadas.items():
+        pend["editadas"].setdefault(etiquetas[int(pos)], {}).update(cambios)
+    for pos in borradas:
+        pend["borradas"].add(etiquetas[int(pos)])
+        pend["editadas"].pop(etiquetas[int(pos)], None)
+    pend["nuevas"].extend(f for f in nuevas if f)
+    return bool(editadas or nuevas or borradas)
+
+def _con_pendientes(df: pd.DataFrame, editadas: dict) -> pd.DataFrame:
+    """df (ya en tipos de editor) con las ediciones pendientes de sus filas aplicadas."""
+    ed = {et: c for et, c in editadas.items() if et in df.index}
+    if not ed: return df
+    df = df.copy()
+    for col in {c for cambios in ed.values() for c in cambios if c in df.columns}:
+        s = df[col].astype(object)
+        for et, cambios in ed.items():
+            if col in cambios: s.at[et] = cambios[col]
+        try:
+            df[col] = s.astype(df[col].dtype)
+        except (TypeError, ValueError):
+            df[col] = s
+    return df
+
+def filas_tabla(df: pd.DataFrame, q: str, estado: str, eps: str, orden: str, asc: bool, excluir) -> pd.Index:
+    """Etiquetas del snapshot que pasan el filtro, en el orden pedido (sin las borradas pendientes)."""
+    m = ~df.index.isin(list(excluir))
+    if estado != "Todos": m &= (df["Estado"].astype(object) == estado).to_numpy()
+    if eps != "Todos": m &= (df["EPS"].astype(object) == eps).to_numpy()
+    txt = str(q).strip()
+    if txt:
+        hit = np.zeros(len(df), dtype=bool)
+        for c in ("NumeroFactura","Paciente","Documento"):
+            if c in df.columns:
+                hit |= df[c].astype(TEXTO_DTYPE).str.contains(txt, case=False, regex=False).fillna(False).to_numpy(dtype=bool)
+        m &= hit
+    sub = df[m]
+    if orden != TABLA_ORIGINAL and orden in sub.columns:
+        sub = sub.sort_values(orden, ascending=asc, kind="stable", na_position="last",
+                              key=lambda s: s.astype(object) if isinstance(s.dtype, pd.CategoricalDtype) else s)
+    return sub.index
+
+def delta_tabla(base: pd.DataFrame, pend: dict) -> dict:
+    """
+    Delta (formato de calcular_delta) solo de las filas tocadas: editadas y borradas (por etiqueta
+    del snapshot) y nuevas. Cambiar el NumeroFactura de una fila la renombra, como en la tabla completa.
+    Las filas sin NumeroFactura borradas o editadas van en 'quitar_sin_clave' (su contenido en el
+    snapshot, que las identifica en el almacén) y la editada vuelve como fila nueva.
+    """
+    tocadas = base.index[base.index.isin(list(pend["editadas"]) + list(pend["borradas"]))]
+    previas = base.loc[tocadas]
+    vivas = _con_pendientes(_para_editor(previas[~previas.index.isin(list(pend["borradas"]))]),
+                            pend["editadas"]).astype(object)
+    sin_clave = _clave_factura(previas["NumeroFactura"]).to_numpy() == ""
+    # Sin clave editadas que quedaron igual: no se tocan
+    sc_vivas = previas.index[sin_clave].intersection(vivas.index, sort=False)
+    cols = list(APP2DB.keys())
+    iguales = sc_vivas[_filas_iguales(_tipar_guardado(previas.loc[sc_vivas])[cols],
+                                      _tipar_guardado(vivas.loc[sc_vivas])[cols])]
+    vivas = vivas.drop(iguales)
+    quitar = previas[sin_clave].drop(iguales)
+    nuevo = pd.concat([vivas, pd.DataFrame(pend["nuevas"], columns=vivas.columns).astype(object)], ignore_index=True)
+    delta = calcular_delta(previas[~sin_clave], nuevo, permitir_borrado=True)
+    delta["reemplazar_sin_clave"] = False   # las filas sin clave que no se tocaron siguen en el almacén
+    if not quitar.empty:
+        reemplazadas = int(quitar.index.isin(vivas.index).sum())
+        delta["quitar_sin_clave"] = quitar
+        delta["previos"] = pd.concat([delta["previos"], _tipar_guardado(quitar)[cols]], ignore_index=True)
+        delta["insertadas"] -= reemplazadas
+        delta["actualizadas"] += reemplazadas
+        delta["eliminadas"] += len(quitar) - reemplazadas
+    return delta
+
+# ====== Asignación de IDs (contador atómico: Postgres o archivo local con lock) ======
+# El siguiente CHIA-NNNN ya no sale de escanear todos los ID del inventario (O(n) y dos usuarios
+# podían recibir el mismo): se reserva en un contador. Las reservas se piden por rangos, así una
+# importación obtiene todos los IDs de un lote en una sola llamada.
+ID_PREFIJO = "CHIA-"
+ID_RPC = "reservar_ids"             # ver supabase/ids.sql (con la service_key)
+ID_RPC_ADELANTAR = "adelantar_ids"  # solo la importación
+ID_RESERVA_MAX = 5000               # tope por llamada de la función (un lote de importación)
+
+def numero_id(ids: pd.Series) -> pd.Series:
+    """Sufijo numérico de cada ID ('CHIA-0042' → 42; NaN si no tiene)."""
+    txt = ids.astype(object).where(ids.notna(), "").astype(str)
+    return pd.to_numeric(txt.str.extract(r"(\d+)$")[0], errors="coerce")
+
+def formatear_id(n: int) -> str:
+    return f"{ID_PREFIJO}{n:04d}"
+
+def _reservar_ids_local(n: int, minimo: int) -> int:
+    """Contador en archivo bajo lock; la primera vez arranca en el mayor ID del inventario."""
+    try:
+        with FileLock(ID_LOCK, timeout=10):
+            ultimo = None
+            if os.path.exists(ID_CONTADOR):
+                with open(ID_CONTADOR, encoding="utf-8") as f:
+                    txt = f.read().strip()
+                ultimo = int(txt) if txt.isdigit() else None
+            if ultimo is None:
+                ids = load_data(("ID",))
+                m = numero_id(ids["ID"]).max() if "ID" in ids.columns else np.nan
+                ultimo = 0 if pd.isna(m) else int(m)
+            ultimo = max(ultimo, int(minimo))
+            tmp = ID_CONTADOR + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(str(ultimo + n))
+                f.flush(); os.fsync(f.fileno())
+            os.replace(tmp, ID_CONTADOR)
+        return ultimo + 1
+    except Timeout:
+        raise RuntimeError("Otro usuario está reservando IDs en este momento. Intenta de nuevo.")
+
+def _rpc_ids(nombre: str, params: dict, reintentar: bool) -> int | None:
+    """Entero que devuelve la función de ids.sql; None si no hay service_key o falla (→ contador local)."""
+    sb = _get_supabase(servicio=True)
+    if not sb: return None
+    try:
+        d = ejecutar_supabase(sb.rpc(nombre, params), "ids", reintentar=reintentar).data
+        if isinstance(d, list): d = d[0] if d else None
+        if isinstance(d, dict): d = next(iter(d.values()), None)
+        return int(d)
+    except Exception as e:
+        transitorio = _es_transitorio(e)
+        registrar_metrica("ids", backend="supabase (error)" if transitorio else "local (fallback)",
+                          funcion=nombre, error=str(e)[:120])
+        # Un timeout pudo reservar en el servidor: seguir con el contador local repetiría esos IDs.
+        # Solo se pasa al local cuando la función no existe o no hay permiso.
+        if transitorio:
+            raise RuntimeError(f"No pude reservar IDs en Supabase ({type(e).__name__}). Intenta de nuevo.") from e
+        return None
+
+def reservar_ids(n: int = 1) -> list[str]:
+    """
+    Reserva n IDs y los devuelve formateados (consecutivos por tramos de ID_RESERVA_MAX). Con
+    Supabase los entrega la función reservar_ids de Postgres (service_key); sin ella el contador
+    local. Un ID reservado y no guardado deja un hueco, nunca un repetido.
+    """
+    t0 = time.perf_counter()
+    ids, backend = [], "local"
+    while len(ids) < n:
+        k = min(int(n) - len(ids), ID_RESERVA_MAX)
+        primero = _rpc_ids(ID_RPC, {"n": k}, reintentar=False)   # un reintento gastaría otro rango
+        if primero is None:
+            primero = _reservar_ids_local(k, 0)
+        else:
+            backend = "supabase"
+        ids += [formatear_id(i) for i in range(primero, primero + k)]
+    registrar_metrica("ids", backend=backend, n=n, primero=ids[0] if ids else "",
+                      ms=round((time.perf_counter() - t0) * 1000, 1))
+    return ids
+
+def adelantar_ids(minimo: int):
+    """
+    Solo para la importación: el contador pasa a `minimo` (el mayor ID que trae el archivo) para
+    no entregar uno ya usado. En Supabase solo service_role puede llamar adelantar_ids.
+    """
+    if _rpc_ids(ID_RPC_ADELANTAR, {"minimo": int(minimo)}, reintentar=True) is None:   # greatest(): idempotente
+        _reservar_ids_local(0, int(minimo))
+
+def _ids_vigentes(df: pd.DataFrame) -> pd.Series:
+    """ID actual por NumeroFactura (solo los que tienen ID)."""
+    if df is None or df.empty or "ID" not in df.columns: return pd.Series(dtype=object)
+    ids = df["ID"].astype(object).where(df["ID"].notna(), "").astype(str).str.strip()
+    out = pd.Series(ids.to_numpy(), index=_clave_factura(df["NumeroFactura"]).to_numpy())
+    return out[(out.index != "") & (out != "") & ~out.index.duplicated(keep="last")]
+
+def completar_ids(df: pd.DataFrame, vigentes: pd.Series) -> pd.DataFrame:
+    """
+    Importación: las filas sin ID conservan el de su factura si ya existe; las nuevas reciben un
+    rango reservado en una sola llamada. El contador se adelanta antes a los IDs que ya trae el lote.
+    """
+    ids = df["ID"].astype(object).where(df["ID"].notna(), "").astype(str).str.strip()
+    ids = ids.where(ids != "", _clave_factura(df["NumeroFactura"]).map(vigentes).fillna(""))
+    ids = ids.astype(object)  # con dtype str (pandas 3) la asignación por máscara de una lista falla
+    faltan = (ids == "").to_numpy()
+    maximo = numero_id(ids[~faltan]).max()
+    if pd.notna(maximo):
+        adelantar_ids(int(maximo))
+    if faltan.any():
+        ids.loc[faltan] = np.array(reservar_ids(int(faltan.sum())), dtype=object)
+    return df.assign(ID=ids.astype(TEXTO_DTYPE))
+
+# ====== Importación por lotes (xlsx / csv en streaming, validación, reemplazar o combinar) ======
+# El archivo se lee por partes (openpyxl read_only / pandas chunksize): nunca se arma el libro
+# completo en memoria. Cada lote se normaliza igual que el inventario, se valida y las filas
+# válidas se escriben por lotes en el backend activo; las rechazadas van a un reporte.
+IMPORT_LOTE = 5000               # filas por lote leído / normalizado
+IMPORT_LOTE_SUPABASE = 1000      # filas por upsert en Supabase
+IMPORT_RECHAZOS_MAX = 10000      # filas rechazadas que se guardan para el reporte (el conteo sigue)
+IMPORT_MODOS = {
+    "combinar": "Combinar: actualiza y agrega por NumeroFactura",
+    "reemplazar": "Reemplazar: el archivo pasa a ser el inventario",
+}
+
+def _encabezado_import(fila) -> list[str]:
+    """Encabezados en nombres App (acepta también los snake_case de la DB)."""
+    out = []
+    for c in fila:
+        t = "" if c is None else str(c).strip()
+        out.append(DB2APP.get(t, t))
+    return out
+
+def _marco_lote(filas: list, cab: list[str], primera: int) -> pd.DataFrame:
+    df = pd.DataFrame(filas, columns=cab, index=pd.RangeIndex(primera, primera + len(filas)))
+    return df.loc[:, (df.columns != "") & ~df.columns.duplicated()]
+
+def _lotes_xlsx(archivo, filas: int):
+    import openpyxl
+    wb = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]  # igual que pd.read_excel: primera hoja
+        total = ws.max_row or 0
+        it = ws.iter_rows(values_only=True)
+        cab = _encabezado_import(next(it, ()))
+        n, buf, fila = len(cab), [], 1
+        for r in it:
+            fila += 1
+            buf.append(r[:n] if len(r) >= n else r + (None,) * (n - len(r)))
+            if len(buf) == filas:
+                yield _marco_lote(buf, cab, fila - len(buf) + 1), (min(fila / total, 1.0) if total else 0.0)
+                buf = []
+        if buf or fila == 1:
+            yield _marco_lote(buf, cab, fila - len(buf) + 1), 1.0
+    finally:
+        wb.close()
+
+def _lotes_csv(archivo, filas: int):
+    total = archivo.seek(0, 2); archivo.seek(0)
+    muestra = archivo.read(64 * 1024); archivo.seek(0)
+    codificacion = "utf-8-sig"
+    try:
+        texto = muestra.decode(codificacion)
+    except UnicodeDecodeError as e:
+        if e.start < len(muestra) - 3: codificacion = "latin-1"  # no es solo un carácter cortado al final
+        texto = muestra.decode(codificacion, errors="ignore")
+    try:
+        sep = csv.Sniffer().sniff(texto.splitlines()[0] if texto else ",", delimiters=",;\t|").delimiter
+    except csv.Error:
+        sep = ","
+    # Todo como texto: NumeroFactura/Documento conservan ceros a la izquierda; los tipos los pone
+    # normalize_dataframe. Las líneas vacías se leen (y luego se descartan) para no correr las filas.
+    lector = pd.read_csv(archivo, sep=sep, encoding=codificacion, dtype=str, chunksize=filas, skip_blank_lines=False)
+    for lote in lector:
+        lote.columns = _encabezado_import(lote.columns)
+        lote.index = lote.index + 2
+        yield lote.loc[:, (lote.columns != "") & ~lote.columns.duplicated()], (min(archivo.tell() / total, 1.0) if total else 0.0)
+
+def leer_lotes(archivo, nombre: str, filas: int = IMPORT_LOTE):
+    """
+    Genera (lote, avance) leyendo el archivo por partes: xlsx fila a fila con openpyxl en modo
+    read_only, csv por chunks de pandas (separador y codificación detectados). El índice de cada
+    lote es la fila en el archivo (1 = encabezado); avance va de 0 a 1.
+    """
+    if str(nombre).lower().endswith(".csv"):
+        yield from _lotes_csv(archivo, filas)
+    else:
+        yield from _lotes_xlsx(archivo, filas)
+
+def _con_dato(s: pd.Series) -> pd.Series:
+    return s.notna() & (s.astype(object).astype(str).str.strip() != "")
+
+def validar_lote(lote: pd.DataFrame, vistas: dict) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Normaliza el lote (normalize_dataframe) y separa las filas rechazadas: sin NumeroFactura,
+    valor o fecha que no se pudo leer, o NumeroFactura repetido (se queda la primera aparición).
+    `vistas` (clave → fila) acumula las claves aceptadas de lotes anteriores.
+    Devuelve (válidas con las columnas del inventario, rechazadas [Fila, NumeroFactura, Motivo]).
+    """
+    norm = normalize_dataframe(lote)
+    crudo = lote.loc[norm.index]
+    k = _clave_factura(norm["NumeroFactura"])
+    motivo = pd.Series("", index=norm.index, dtype=object)
+    def marcar(mascara: pd.Series, texto):
+        libre = mascara & (motivo == "")
+        motivo[libre] = texto[libre] if isinstance(texto, pd.Series) else texto
+    marcar(k == "", "Sin NumeroFactura")
+    for c in COLS_VALOR:
+        if c in crudo.columns: marcar(_con_dato(crudo[c]) & norm[c].isna(), f"{c} no es un número")
+    for c in COLS_FECHA:
+        if c in crudo.columns: marcar(_con_dato(crudo[c]) & norm[c].isna(), f"{c} no es una fecha")
+    filas = pd.Series(norm.index, index=norm.index)
+    primera = k.map(vistas).fillna(filas.groupby(k.to_numpy()).transform("first")).astype("int64")
+    marcar((k != "") & (primera != filas), "NumeroFactura repetido (primera vez en la fila " + primera.astype(str) + ")")
+    ok = (motivo == "").to_numpy()
+    vistas.update(zip(k[ok], filas[ok]))
+    rechazadas = pd.DataFrame({"Fila": filas[~ok], "NumeroFactura": k[~ok], "Motivo": motivo[~ok]})
+    return norm.loc[ok, list(APP2DB.keys())], rechazadas.reset_index(drop=True)
+
+def importar_inventario(archivo, nombre: str, modo: str = "combinar", progreso=None) -> tuple[bool, str, pd.DataFrame]:
+    """
+    Importa el archivo por lotes al backend activo. 'combinar' hace upsert por NumeroFactura;
+    'reemplazar' además elimina las facturas que no vienen en el archivo (las rechazadas se
+    conservan). La Version de cada fila escrita sube en 1 sobre la vigente, así los demás usuarios
+    ven la importación como cambio ajeno. `progreso(avance, texto)` recibe el avance.
+    Devuelve (ok, mensaje, filas rechazadas).
+    """
+    t0 = time.perf_counter()
+    avisar = progreso or (lambda a, t: None)
+    actual = load_data(fresco=True)
+    versiones = _versiones_de(actual)
+    ids_vigentes = _ids_vigentes(actual)
+    sb = _get_supabase()
+    destino = "Supabase" if sb else "local"
+    vistas, rechazos, n_rech, lotes, escritas, locales = {}, [], 0, 0, 0, []
+    claves_rech = set()
+    try:
+        for lote, avance in leer_lotes(archivo, nombre):
+            if "NumeroFactura" not in lote.columns:
+                return False, "El archivo no tiene la columna NumeroFactura.", pd.DataFrame()
+            validas, rech = validar_lote(lote, vistas)
+            lotes += 1
+            n_rech += len(rech)
+            claves_rech.update(rech.loc[rech["NumeroFactura"] != "", "NumeroFactura"])
+            if sum(len(r) for r in rechazos) < IMPORT_RECHAZOS_MAX:
+                rechazos.append(rech)
+            if not validas.empty:
+                k = _clave_factura(validas["NumeroFactura"])
+                validas = completar_ids(validas, ids_vigentes).assign(Version=k.map(versiones).fillna(0).to_numpy() + 1)
+                if sb:
+                    for i in range(0, len(validas), IMPORT_LOTE_SUPABASE):
+                        ok, msg = supabase_upsert(validas.iloc[i:i + IMPORT_LOTE_SUPABASE], pk=DB_PK)
+                        if not ok:
+                            return False, f"{msg} (ya se habían escrito {escritas} filas)", _reporte_rechazos(rechazos, n_rech)
+                        escritas += min(IMPORT_LOTE_SUPABASE, len(validas) - i)
+                    _anotar_movimientos({"upserts": validas, "previos": actual[_en_claves(_clave_factura(actual["NumeroFactura"]), k)]}, "Importación")
+                else:  # categorías distintas por lote se concatenarían como object: van como texto
+                    locales.append(validas.astype({c: TEXTO_DTYPE for c in COLS_CATEGORIA if c in validas.columns}))
+            avisar(avance, f"Lote {lotes}: {len(vistas)} filas válidas, {n_rech} rechazadas")
+
+        if not vistas:
+            return False, "El archivo no trae filas válidas; no se cambió nada.", _reporte_rechazos(rechazos, n_rech)
+        borrar = []
+        if modo == "reemplazar":
+            k_act = _clave_factura(actual["NumeroFactura"])
+            borrar = list(set(k_act[(k_act != "").to_numpy() & ~_en_claves(k_act, vistas) & ~_en_claves(k_act, claves_rech)]))
+        if sb:
+            ok, msg = supabase_delete(borrar, pk=DB_PK)
+            if not ok: return False, msg, _reporte_rechazos(rechazos, n_rech)
+        else:
+            avisar(1.0, "Escribiendo almacén local…")
+            ok, msg, borrar = _importar_local(locales, borrar, modo)
+            locales = None
+            if not ok: return False, msg, _reporte_rechazos(rechazos, n_rech)
+    finally:
+        if escritas or locales is None:
+            if sb: reiniciar_sync()
+            nueva_version_datos()
+
+    nuevas = sum(1 for k in vistas if k not in versiones.index)
+    _registrar_guardado({"insertadas": nuevas, "actualizadas": len(vistas) - nuevas, "eliminadas": len(borrar)},
+                        destino, t0)
+    registrar_metrica("importacion", modo=modo, destino=destino, lotes=lotes, filas=len(vistas),
+                      rechazadas=n_rech, eliminadas=len(borrar), ms=round((time.perf_counter() - t0) * 1000, 1))
+    return True, "OK_SUPABASE" if sb else "OK_LOCAL", _reporte_rechazos(rechazos, n_rech)
+
+def _importar_local(lotes: list[pd.DataFrame], borrar: list[str], modo: str) -> tuple[bool, str, list[str]]:
+    """Aplica lo importado sobre el almacén local bajo lock (versiones releídas dentro del lock)."""
+    _asegurar_store_local()
+    nuevas = pd.concat(lotes, ignore_index=True)
+    lotes.clear()
+    try:
+        with FileLock(INVENTARIO_LOCK, timeout=10):
+            actual = _read_local(INVENTARIO_STORE)
+            k = _clave_factura(nuevas["NumeroFactura"])
+            if not actual.empty and "NumeroFactura" in actual.columns:
+                nuevas["Version"] = k.map(_versiones_de(actual)).fillna(0).to_numpy() + 1
+                previos = actual[_en_claves(_clave_factura(actual["NumeroFactura"]), k)]
+                if modo == "reemplazar":
+                    k_act = _clave_factura(actual["NumeroFactura"])
+                    borrar = list(set(borrar) & set(k_act))
+            else:
+                previos, borrar = pd.DataFrame(columns=list(APP2DB.keys())), []
+            delta = {"upserts": nuevas, "borrar": borrar, "previos": previos,
+                     "reemplazar_sin_clave": modo == "reemplazar"}
+            _escribir_local_atomico(_fusionar_delta(actual, delta), INVENTARIO_STORE)
+        for i in range(0, len(nuevas), IMPORT_LOTE):  # bitácora por lotes: acota la memoria
+            _anotar_movimientos({"upserts": nuevas.iloc[i:i + IMPORT_LOTE], "previos": previos}, "Importación")
+        return True, "OK_LOCAL", borrar
+    except Timeout:
+        return False, "Otro usuario está guardando en este momento. Intenta de nuevo.", []
+    except Exception as e:
+        return False, f"Error guardando almacén local: {e}", []
+
+def _reporte_rechazos(rechazos: list[pd.DataFrame], total: int = 0) -> pd.DataFrame:
+    """Primeras IMPORT_RECHAZOS_MAX rechazadas; attrs['total'] lleva el conteo completo."""
+    rep = pd.concat(rechazos, ignore_index=True).head(IMPORT_RECHAZOS_MAX) if rechazos else pd.DataFrame(columns=["Fila","NumeroFactura","Motivo"])
+    rep.attrs["total"] = max(total, len(rep))
+    return rep
+
+# ====== Movimientos de estado en lote (Bandejas) ======
+# Estado origen -> destinos permitidos (hoy cualquier cambio entre estados distintos)
+TRANSICIONES = {e: {d for d in ESTADOS if d != e} for e in ESTADOS}
+
+def mover_facturas(facturas, destino: str, ahora: pd.Timestamp | None = None) -> tuple[bool, str, pd.DataFrame]:
+    """
+    Mueve un conjunto de NumeroFactura al estado destino en una sola escritura:
+    UPDATE ... WHERE numero_factura IN (...) en Supabase, o parche del almacén local.
+    Devuelve (ok, msg, resultado por factura: Estado anterior y Resultado).
+    """
+    t0 = time.perf_counter()
+    ahora = ahora if ahora is not None else pd.Timestamp(datetime.now())
+    base = load_data(fresco=True)
+    claves = pd.Index(pd.unique(_clave_factura(pd.Series(list(facturas), dtype=object)).to_numpy()))
+    claves = claves[claves != ""]
+    k_base = _clave_factura(base["NumeroFactura"])
+    pos = pd.Series(np.arange(len(base)), index=k_base.to_numpy())
+    pos = pos[~pos.index.duplicated(keep="last")]
+    encontrada = claves.isin(pos.index)
+    previo = pd.Series(pd.NA, index=claves, dtype=object)
+    previo[encontrada] = base["Estado"].astype(object).to_numpy()[pos[claves[encontrada]].to_numpy()]
+
+    if destino not in ESTADOS:
+        motivo = np.full(len(claves), "estado destino inválido", dtype=object)
+    else:
+        permitida = previo.map(lambda e: destino in TRANSICIONES.get(e, set(ESTADOS)) or e == destino)
+        motivo = np.select(
+            [~encontrada, (previo == destino).fillna(False).to_numpy(dtype=bool), ~permitida.to_numpy(dtype=bool)],
+            ["no existe", "sin cambio", "transición no permitida"], default="movida")
+    resultado = pd.DataFrame({"NumeroFactura": claves, "Estado anterior": previo.to_numpy(), "Resultado": motivo})
+    mover = claves[motivo == "movida"]
+    if len(mover) == 0:
+        return True, "OK_NOOP", resultado
+
+    filas = base.iloc[pos[mover].to_numpy()].assign(Estado=destino, FechaMovimiento=ahora)
+    delta = calcular_delta(base, filas)
+    cambios = {"Estado": destino, "FechaMovimiento": ahora}
+    vistas = pd.Series(pd.to_numeric(filas["Version"], errors="coerce").fillna(0).to_numpy(dtype=float), index=list(mover))
+
+    # Supabase: un UPDATE por lote de claves y versión vista (AND version = v: no pisa cambios ajenos)
+    try:
+        sb = _get_supabase()
+        if sb:
+            hechas = []
+            for v, grupo in vistas.groupby(vistas):
+                ok, msg, h = supabase_update_lote(list(grupo.index), {**cambios, "Version": int(v) + 1},
+                                                  pk=DB_PK, version=int(v))
+                hechas += h
+                if not ok: return False, msg, resultado
+            fallidas = vistas.index.difference(hechas, sort=False)
+            vigentes = vistas.drop(fallidas)
+            if len(fallidas): vigentes = pd.concat([vigentes, supabase_versiones(list(fallidas))])
+            delta, conflictos = separar_conflictos(delta, vigentes)
+            return _cerrar_movimiento(delta, conflictos, "Supabase", t0, resultado)
+    except Exception as e:
+        st.warning(f"No pude mover en Supabase, intento almacén local: {e}")
+
+    # Local: parche de solo esas filas bajo lock
+    ok, msg, delta, conflictos = _aplicar_delta_local(delta, INVENTARIO_STORE)
+    if not ok: return False, msg, resultado
+    return _cerrar_movimiento(delta, conflictos, "local", t0, resultado)
+
+def _cerrar_movimiento(delta: dict, conflictos: pd.DataFrame, destino: str, t0: float,
+                       resultado: pd.DataFrame) -> tuple[bool, str, pd.DataFrame]:
+    if not conflictos.empty:
+        choque = resultado["NumeroFactura"].isin(set(conflictos["NumeroFactura"].astype(str)))
+        resultado = resultado.assign(Resultado=resultado["Resultado"].where(~choque, "conflicto de versión"))
+    if destino == "Supabase": _sync_aplicar_delta(delta)
+    _anotar_movimientos(delta, "Bandejas")
+    nueva_version_datos(_delta_normalizado(delta))
+    _registrar_guardado(delta, destino, t0)
+    return True, "OK_SUPABASE" if destino == "Supabase" else "OK_LOCAL", resultado
+
+# ====== Bitácora de movimientos (solo se agrega; segmentos JSONL → Parquet) ======
+# Cada cambio de Estado (Gestión, Bandejas, Tabla) deja una fila: factura, desde, hacia, usuario,
+# momento y valores. Con secrets supabase.movimientos_tabla (y service_key: anon no tiene acceso)
+# va a esa tabla; si no, a movimientos/activo_NNNNNN.jsonl, que al crecer se compacta en seg_NNNNNN.parquet.
+MOV_COLS = ["id","ts","factura","desde","hacia","usuario","origen","eps","vigencia","valor_factura","valor_radicado"]
+MOV_ACTIVO_MAX_BYTES = 4 * 1024 * 1024   # ~20 mil movimientos por segmento
+MOV_PAGINA = 1000
+
+def _tabla_movimientos() -> str:
+    """Tabla Supabase de la bitácora (secrets supabase.movimientos_tabla, con la service_key); vacío = archivos locales."""
+    try:
+        return (st.secrets.get("supabase", {}).get("movimientos_tabla") or "").strip()
+    except Exception:
+        return ""
+
+def _movimientos_de_delta(delta: dict, origen: str) -> pd.DataFrame:
+    """Filas del delta cuyo Estado cambió (o que se crearon) como movimientos de la bitácora."""
+    up = delta["upserts"]
+    if up.empty: return pd.DataFrame(columns=MOV_COLS)
+    k_up = _clave_factura(up["NumeroFactura"])
+    prev = delta["previos"]
+    k_prev = _clave_factura(prev["NumeroFactura"]) if len(prev) else pd.Series([], dtype=object)
+    desde_de = pd.Series(prev["Estado"].astype(object).to_numpy(), index=k_prev.to_numpy())
+    desde_de = desde_de[(desde_de.index != "") & ~desde_de.index.duplicated(keep="last")]
+    desde = k_up.map(desde_de).astype(object)
+    hacia = up["Estado"].astype(object)
+    txt = lambda s: s.where(s.notna(), "").astype(str).str.strip()
+    cambio = (k_up != "") & (txt(desde) != txt(hacia)) & (txt(hacia) != "")
+    if not cambio.any(): return pd.DataFrame(columns=MOV_COLS)
+    m = up[cambio.to_numpy()]
+    ahora = pd.Timestamp(datetime.now())
+    return pd.DataFrame({
+        "id": [uuid.uuid4().hex for _ in range(len(m))],
+        "ts": ahora,
+        "factura": k_up[cambio].to_numpy(),
+        "desde": desde[cambio].where(desde[cambio].notna(), None).to_numpy(),
+        "hacia": txt(hacia)[cambio].to_numpy(),
+        "usuario": str(st.session_state.get("usuario", "")),
+        "origen": origen,
+        "eps": m["EPS"].astype(object).to_numpy(),
+        "vigencia": pd.to_numeric(m["Vigencia"], errors="coerce").to_numpy(dtype=float),
+        "valor_factura": pd.to_numeric(m["Valor Factura"], errors="coerce").to_numpy(dtype=float),
+        "valor_radicado": pd.to_numeric(m["Valor Radicado"], errors="coerce").to_numpy(dtype=float),
+    })
+
+def _ruta_mov(prefijo: str, n: int) -> str:
+    ext = "jsonl" if prefijo == "activo" or not PARQUET_OK else "parquet"
+    return os.path.join(MOVIMIENTOS_DIR, f"{prefijo}_{n:06d}.{ext}")
+
+def _numeros_mov() -> dict[int, str]:
+    """Número de segmento -> 'seg' (compactado) o 'activo' (JSONL en escritura)."""
+    out = {}
+    if not os.path.isdir(MOVIMIENTOS_DIR): return out
+    for nombre in os.listdir(MOVIMIENTOS_DIR):
+        m = re.fullmatch(r"(seg|activo)_(\d{6})\.(jsonl|parquet)", nombre)
+        if m and out.get(int(m.group(2))) != "seg": out[int(m.group(2))] = m.group(1)
+    return dict(sorted(out.items()))
+
+def _leer_jsonl(data: bytes) -> pd.DataFrame:
+    if not data.strip(): return pd.DataFrame(columns=MOV_COLS)
+    df = pd.read_json(io.BytesIO(data), lines=True, dtype=False, convert_dates=False)
+    df["ts"] = pd.to_datetime(df["ts"], errors="coerce")
+    return df
+
+def _leer_segmento_mov(n: int) -> pd.DataFrame:
+    path = _ruta_mov("seg", n)
+    if path.endswith(".parquet"): return pd.read_parquet(path)
+    with open(path, "rb") as f: return _leer_jsonl(f.read())
+
+def _compactar_activo(n: int):
+    """activo_n.jsonl → seg_n.parquet (temporal + rename); el llamador tiene el lock."""
+    activo, seg = _ruta_mov("activo", n), _ruta_mov("seg", n)
+    if seg.endswith(".parquet"):
+        with open(activo, "rb") as f: df = _leer_jsonl(f.read())
+        tmp = seg + ".tmp"
+        df.astype({c: "string" for c in df.columns if df[c].dtype == object}).to_parquet(tmp, index=False)
+        os.replace(tmp, seg)
+        os.remove(activo)
+    else:
+        os.replace(activo, seg)
+
+def _agregar_movimientos_local(mov: pd.DataFrame):
+    os.makedirs(MOVIMIENTOS_DIR, exist_ok=True)
+    lineas = mov.to_json(orient="records", lines=True, date_format="iso", force_ascii=False)
+    with FileLock(os.path.join(MOVIMIENTOS_DIR, "bitacora.lock"), timeout=10):
+        nums = _numeros_mov()
+        n = max(nums, default=1)
+        if nums.get(n) == "seg": n += 1
+        activo = _ruta_mov("activo", n)
+        with open(activo, "a", encoding="utf-8") as f:
+            f.write(lineas if lineas.endswith("\n") else lineas + "\n")
+            f.flush(); os.fsync(f.fileno())
+        if os.path.getsize(activo) > MOV_ACTIVO_MAX_BYTES:
+            _compactar_activo(n)
+
+def registrar_movimientos(mov: pd.DataFrame):
+    """Agrega movimientos a la bitácora (Supabase o archivos locales). No reescribe nada."""
+    if mov is None or mov.empty: return
+    t0 = time.perf_counter()
+    tabla = _tabla_movimientos()
+    sb = _get_supabase(servicio=True) if tabla else None
+    if sb:
+        registros = mov.assign(ts=mov["ts"].map(lambda t: t.isoformat())).astype(object)
+        registros = registros.where(pd.notna(registros), None).to_dict(orient="records")
+        # id generado aquí: un reintento tras un timeout no duplica filas
+        ejecutar_supabase(sb.table(tabla).upsert(registros, on_conflict="id", ignore_duplicates=True), "movimientos")
+        backend = "supabase"
+    else:
+        _agregar_movimientos_local(mov)
+        backend = "local"
+    registrar_metrica("movimientos", backend=backend, filas=len(mov),
+                      ms=round((time.perf_counter() - t0) * 1000, 1))
+
+def _anotar_movimientos(delta: dict, origen: str):
+    """La bitácora no debe tumbar un guardado ya hecho: si falla, solo avisa."""
+    try:
+        registrar_movimientos(_movimientos_de_delta(delta, origen))
+    except Exception as e:
+        st.warning(f"Cambios guardados, pero no pude anotarlos en la bitácora de movimientos: {e}")
+
+# Flujo por período: conteos diarios (Fecha, Desde, Hacia) que se amplían solo con lo nuevo
+@st.cache_resource
+def _estado_flujo() -> dict:
+    return {"diario": None, "origen": None, "n": 1, "filas": 0, "bytes": 0, "ultimo": 0, "lock": threading.Lock()}
+
+def _contar_diario(mov: pd.DataFrame) -> pd.DataFrame:
+    cols = ["Fecha","Desde","Hacia","Movimientos"]
+    if mov is None or mov.empty: return pd.DataFrame(columns=cols)
+    desde = mov["desde"].astype(object).where(mov["desde"].notna(), "(nueva)")
+    g = pd.DataFrame({"Fecha": pd.to_datetime(mov["ts"], errors="coerce").dt.normalize(),
+                      "Desde": desde.astype(str), "Hacia": mov["hacia"].astype(str)})
+    return g.groupby(["Fecha","Desde","Hacia"]).size().reset_index(name="Movimientos")
+
+def _nuevos_locales(est: dict) -> list[pd.DataFrame]:
+    """Lee solo lo que no se contó: segmentos nuevos y la cola del JSONL activo (por bytes)."""
+    nuevos = []
+    for n, tipo in _numeros_mov().items():
+        if n < est["n"]: continue
+        if n > est["n"]: est["n"], est["filas"], est["bytes"] = n, 0, 0
+        try:
+            if tipo == "seg":
+                df = _leer_segmento_mov(n).iloc[est["filas"]:]   # lo ya leído del activo se salta
+                nuevos.append(df)
+                est["n"], est["filas"], est["bytes"] = n + 1, 0, 0
+            else:
+                with open(_ruta_mov("activo", n), "rb") as f:
+                    f.seek(est["bytes"]); data = f.read()
+                data = data[:data.rfind(b"\n") + 1]            # sin la línea a medio escribir
+                df = _leer_jsonl(data)
+                nuevos.append(df)
+                est["bytes"] += len(data); est["filas"] += len(df)
+        except FileNotFoundError:
+            break   # se compactó mientras leíamos: el próximo refresco lee el segmento
+    return nuevos
+
+def _nuevos_supabase(est: dict, tabla: str) -> list[pd.DataFrame]:
+    sb = _get_supabase(servicio=True)
+    nuevos = []
+    while True:
+        q = sb.table(tabla).select("n,ts,desde,hacia").gt("n", est["ultimo"]).order("n").limit(MOV_PAGINA)
+        filas = ejecutar_supabase(q, "movimientos_lectura").data or []
+        if filas:
+            df = pd.DataFrame(filas)
+            df["ts"] = pd.to_datetime(df["ts"], errors="coerce", utc=True).dt.tz_convert(None)
+            nuevos.append(df)
+            est["ultimo"] = int(df["n"].max())
+        if len(filas) < MOV_PAGINA: return nuevos
+
+def flujo_movimientos(periodo: str = "Día") -> pd.DataFrame:
+    """
+    Movimientos por período (Día / Semana / Mes) y estado destino, desde la bitácora.
+    Solo se leen los movimientos nuevos desde la última consulta del proceso.
+    """
+    est = _estado_flujo()
+    tabla = _tabla_movimientos()
+    origen = "supabase" if tabla and _get_supabase(servicio=True) else "local"
+    with est["lock"]:
+        t0 = time.perf_counter()
+        if est["origen"] != origen:
+            est.update({"diario": _contar_diario(None), "origen": origen, "n": 1, "filas": 0, "bytes": 0, "ultimo": 0})
+        nuevos = _nuevos_supabase(est, tabla) if origen == "supabase" else _nuevos_locales(est)
+        n_nuevos = sum(len(d) for d in nuevos)
+        if n_nuevos:
+            todos = pd.concat([est["diario"]] + [_contar_diario(d) for d in nuevos if len(d)], ignore_index=True)
+            est["diario"] = todos.groupby(["Fecha","Desde","Hacia"]).Movimientos.sum().astype("int64").reset_index()
+            registrar_metrica("movimientos", backend=f"{origen} (lectura)", filas=n_nuevos,
+                              ms=round((time.perf_counter() - t0) * 1000, 1))
+        diario = est["diario"]
+    if diario.empty: return pd.DataFrame(columns=["Periodo","Hacia","Movimientos"])
+    frecuencia = {"Día": "D", "Semana": "W", "Mes": "M"}[periodo]
+    inicio = diario["Fecha"].dt.to_period(frecuencia).dt.start_time.rename("Periodo")
+    return diario.groupby([inicio, "Hacia"]).Movimientos.sum().reset_index()
+
+# ====== Versión de datos + cubo de agregados (EPS × Vigencia × Estado × MesClave) ======
+CUBO_DIMS = ["EPS","Vigencia","Estado","EstadoCanon","MesClave"]
+CUBO_MEDIDAS = ["Filas","Cuentas","Facturas","Valor_Facturado","Valor_Radicado"]
+
+def _textos_unicos(s: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """Código por fila y str(valor).strip() de cada valor distinto (lo que vería una fila de apply)."""
+    obj = s.astype(object).to_numpy()
+    codigos, unicos = pd.factorize(obj)
+    if len({type(v) for v in unicos}) > 1:
+        # factorize junta 2024 con 2024.0 (y 1 con True), pero su texto difiere: agrupar por texto
+        codigos, unicos = pd.factorize(np.array([v if pd.isna(v) else str(v) for v in obj], dtype=object))
+    textos = [str(v).strip() for v in unicos]
+    falta = codigos < 0
+    if falta.any():
+        # Un faltante se lee como su propio objeto ('nan', '<NA>', 'None'...): con dtype tipado es uno solo
+        vals = obj[falta] if s.dtype == object else obj[falta][:1]
+        f_cod, f_txt = pd.factorize(np.array([str(v).strip() for v in vals], dtype=object))
+        codigos[falta] = len(textos) + f_cod
+        textos += list(f_txt)
+    return codigos, np.array(textos, dtype=object)
+
+def mes_clave(df: pd.DataFrame) -> pd.Series:
+    """
+    Mes de avance por fila: mes de FechaRadicacion ('Octubre 2025'); si no hay, 'Mes' tal cual
+    cuando ya trae año, 'Mes Vigencia' cuando la Vigencia es un año, o 'Sin Mes'.
+    Vectorizado: las etiquetas se arman una vez por valor distinto y se reparten por código.
+    """
+    if df.empty: return pd.Series([], index=df.index, dtype=object)
+    n = len(df)
+    vacio = (np.zeros(n, dtype=np.intp), np.array([""], dtype=object))
+    m_cod, m_txt = _textos_unicos(df["Mes"]) if "Mes" in df.columns else vacio
+    v_cod, v_txt = _textos_unicos(df["Vigencia"]) if "Vigencia" in df.columns else vacio
+    con_anio = np.array([re.search(r"\b20\d{2}\b", t) is not None for t in m_txt], dtype=bool)
+    vig_anio = np.array([t.isdigit() for t in v_txt], dtype=bool)
+
+    # Respaldo por combinación (Mes, Vigencia) distinta
+    combo_cod, combos = pd.factorize(m_cod.astype(np.int64) * len(v_txt) + v_cod)
+    etiquetas = []
+    for c in combos:
+        i, j = divmod(int(c), len(v_txt))
+        m = m_txt[i]
+        etiquetas.append(m if con_anio[i] else (f"{m} {v_txt[j]}" if m and vig_anio[j] else (m or "Sin Mes")))
+    out = np.array(etiquetas, dtype=object)[combo_cod]
+
+    # FechaRadicacion manda cuando es una fecha válida
+    if "FechaRadicacion" in df.columns:
+        fr = df["FechaRadicacion"]
+        if not pd.api.types.is_datetime64_any_dtype(fr.dtype):
+            fr = pd.to_datetime(fr, errors="coerce", format="mixed")
+        ok = fr.notna().to_numpy()
+        if ok.any():
+            mes_cod, meses = pd.factorize((fr.dt.year * 12 + fr.dt.month - 1)[ok].astype(np.int64))
+            nombres = np.array([f"{MES_NOMBRE[int(k) % 12 + 1]} {int(k) // 12}" for k in meses], dtype=object)
+            out[ok] = nombres[mes_cod]
+    return pd.Series(out, index=df.index, dtype=object)
+
+@st.cache_resource
+def _estado_cubo() -> dict:
+    return {"cubo": None, "version": -1, "unicas": True, "lock": threading.Lock()}
+
+def nueva_version_datos(delta: dict | None = None) -> int:
+    """
+    Sube la versión de datos (el inventario cacheado se recarga una sola vez, en lugar de
+    st.cache_data.clear(), que borra todo). Con un delta ('previos' → 'upserts', filas
+    normalizadas) el cubo vigente se actualiza en sitio; sin delta (recarga, importación) se
+    descarta y se recalcula.
+    """
+    c, est = _cache_inventario(), _estado_cubo()
+    with c["cond"], est["lock"]:
+        al_dia = est["cubo"] is not None and est["version"] == c["version"] and est["unicas"]
+        c["version"] += 1
+        if delta is not None and al_dia:
+            est["cubo"] = _sumar_cubos(est["cubo"], _cubo_de(delta.get("previos")), _cubo_de(delta.get("upserts")))
+            est["version"] = c["version"]
+        else:
+            est["cubo"] = None
+        return c["version"]
+
+def _ajustar_cubo(version: int | None, delta: dict | None = None):
+    """
+    La sincronización cambió las filas de `version` sin subirla: si el cubo ya es de esa versión
+    se le aplica el delta en sitio (o se descarta); uno más viejo se recalcula al servirse la nueva.
+    """
+    est = _estado_cubo()
+    with est["lock"]:
+        if est["cubo"] is None or est["version"] != (version_datos() if version is None else version): return
+        if delta is not None and est["unicas"]:
+            est["cubo"] = _sumar_cubos(est["cubo"], _cubo_de(delta.get("previos")), _cubo_de(delta.get("upserts")))
+        else:
+            est["cubo"] = None
+
+def _dim_texto(s: pd.Series) -> pd.Series:
+    return s.astype(object).where(s.notna(), None)
+
+def _cubo_de(df: pd.DataFrame | None, facturas_unicas: bool = True) -> pd.DataFrame:
+    """Aporte de unas filas normalizadas a cada celda del cubo."""
+    if df is None or df.empty:
+        return pd.DataFrame(columns=CUBO_DIMS + CUBO_MEDIDAS)
+    canon = df["EstadoCanon"] if "EstadoCanon" in df.columns else estado_canonico(df["Estado"])
+    k = _clave_factura(df["NumeroFactura"])
+    d = pd.DataFrame({
+        "EPS": _dim_texto(df["EPS"]),
+        "Vigencia": pd.to_numeric(df["Vigencia"], errors="coerce").round().astype("Int16"),
+        "Estado": _dim_texto(df["Estado"]),
+        "EstadoCanon": _dim_texto(canon),
+        "MesClave": mes_clave(df).astype(object),
+        "Filas": 1,
+        "Cuentas": df["NumeroFactura"].notna().astype("int64"),
+        "Facturas": (k != "").astype("int64"),
+        "Valor_Facturado": pd.to_numeric(df["Valor Factura"], errors="coerce").fillna(0).astype("float64"),
+        "Valor_Radicado": pd.to_numeric(df["Valor Radicado"], errors="coerce").fillna(0).astype("float64"),
+    })
+    gb = d.groupby(CUBO_DIMS, dropna=False, sort=False)
+    cubo = gb[CUBO_MEDIDAS].sum()
+    if not facturas_unicas:
+        cubo["Facturas"] = k.where(k != "").groupby([d[c] for c in CUBO_DIMS], dropna=False, sort=False).nunique()
+    return cubo.reset_index()
+
+def _sumar_cubos(cubo: pd.DataFrame, restar: pd.DataFrame, sumar: pd.DataFrame) -> pd.DataFrame:
+    """cubo - restar + sumar por celda (Facturas suma/resta 1 por factura: claves únicas)."""
+    partes = [p for p in (cubo, restar.assign(**{m: -restar[m] for m in CUBO_MEDIDAS}), sumar) if not p.empty]
+    if not partes: return cubo
+    out = pd.concat(partes, ignore_index=True)
+    out["Vigencia"] = out["Vigencia"].astype("Int16")
+    out = out.groupby(CUBO_DIMS, dropna=False, sort=False)[CUBO_MEDIDAS].sum().reset_index()
+    out[["Valor_Facturado","Valor_Radicado"]] = out[["Valor_Facturado","Valor_Radicado"]].round(2)
+    return out[out["Filas"] != 0].reset_index(drop=True)
+
+def cubo_agregado() -> pd.DataFrame:
+    """
+    Cubo compartido (una fila por EPS/Vigencia/Estado/EstadoCanon/MesClave con Filas, Cuentas,
+    Facturas y valores). Se calcula una vez por versión de datos; Dashboard, Reportes, Avance y
+    exportaciones solo lo re-agrupan. Lleva la versión del inventario con que se armó: si se
+    entregó la copia anterior de una carga en curso, se recalcula cuando llegue la nueva.
+    """
+    v, df = load_data_version(COLS_RESUMEN)
+    est = _estado_cubo()
+    with est["lock"]:
+        if est["cubo"] is None or est["version"] < v:
+            t0 = time.perf_counter()
+            k = _clave_factura(df["NumeroFactura"]) if "NumeroFactura" in df.columns else pd.Series(dtype=str)
+            est["unicas"] = not k[k != ""].duplicated().any()
+            est["cubo"] = _cubo_de(df, facturas_unicas=est["unicas"])
+            est["version"] = v
+            registrar_metrica("cubo", version=v, filas=len(df), celdas=len(est["cubo"]),
+                              ms=round((time.perf_counter() - t0) * 1000, 1))
+        _anotar_servida(est["version"])
+        return est["cubo"]
+
+# ====== Proyecciones de Avance (metas por mes y EPS) ======
+# Metas en proyecciones.xlsx (Periodo 'AAAA-MM', EPS vacío = total, Cuentas estimadas) o en la tabla
+# de secrets supabase.proyecciones_tabla (periodo, eps, cuentas). Sin archivo ni tabla se usan las
+# metas iniciales de Agosto–Noviembre 2025.
+PROYECCION_INICIAL = pd.DataFrame({
+    "Periodo": ["2025-08","2025-09","2025-10","2025-11"],
+    "EPS": "",
+    "Cuentas estimadas": [515, 1489, 1797, 1738],
+})
+PROYECCIONES_TTL_S = 300   # tabla Supabase: se relee cada 5 min (como usuarios)
+MES_NUMERO = {v.lower(): k for k, v in MES_NOMBRE.items()}
+
+def _tabla_proyecciones() -> str:
+    """Tabla Supabase de metas (secrets supabase.proyecciones_tabla); vacío = proyecciones.xlsx."""
+    try:
+        return (st.secrets.get("supabase", {}).get("proyecciones_tabla") or "").strip()
+    except Exception:
+        return ""
+
+def periodo_de_etiqueta(s: pd.Series) -> pd.Series:
+    """'2025-08', '2025-08-01' u 'Agosto 2025' -> primer día del mes (NaT si no se reconoce)."""
+    txt = s.astype(object).where(s.notna(), "").astype(str).str.strip()
+    iso = pd.to_datetime(txt.str.slice(0, 7), format="%Y-%m", errors="coerce")
+    partes = txt.str.lower().str.extract(r"^([a-záéíóú]+)\s+(\d{4})$")
+    mes = partes[0].map(MES_NUMERO)
+    ym = partes[1].where(mes.notna()) + "-" + mes.astype("Int64").astype(str).str.zfill(2)
+    return iso.fillna(pd.to_datetime(ym, format="%Y-%m", errors="coerce"))
+
+def _normalizar_proyecciones(df: pd.DataFrame) -> pd.DataFrame:
+    """Periodo (primer día del mes), EPS ('' = total) y Cuentas estimadas; filas inválidas fuera."""
+    cols = ["Periodo","EPS","Cuentas estimadas"]
+    if df is None or df.empty: return pd.DataFrame({"Periodo": pd.Series(dtype="datetime64[ns]"),
+                                                    "EPS": pd.Series(dtype=object), "Cuentas estimadas": pd.Series(dtype="int64")})
+    df = df.rename(columns={"periodo": "Periodo", "eps": "EPS", "cuentas": "Cuentas estimadas"})
+    for c in cols:
+        if c not in df.columns: df[c] = pd.NA
+    out = pd.DataFrame({
+        "Periodo": periodo_de_etiqueta(df["Periodo"]),
+        "EPS": df["EPS"].astype(object).where(df["EPS"].notna(), "").astype(str).str.strip(),
+        "Cuentas estimadas": pd.to_numeric(df["Cuentas estimadas"], errors="coerce"),
+    }).dropna(subset=["Periodo","Cuentas estimadas"])
+    out["Cuentas estimadas"] = out["Cuentas estimadas"].round().astype("int64")
+    return (out.groupby(["Periodo","EPS"], as_index=False)["Cuentas estimadas"].sum()
+               .sort_values(["Periodo","EPS"], ignore_index=True))
+
+@st.cache_resource
+def _estado_proyecciones() -> dict:
+    return {"metas": None, "origen": None, "marca": None, "lock": threading.Lock()}
+
+def proyecciones() -> pd.DataFrame:
+    """Metas normalizadas; el archivo se relee si cambió su mtime y la tabla cada PROYECCIONES_TTL_S."""
+    est = _estado_proyecciones()
+    tabla = _tabla_proyecciones()
+    sb = _get_supabase() if tabla else None
+    with est["lock"]:
+        if sb:
+            marca = ("supabase", int(time.time() // PROYECCIONES_TTL_S))
+            if est["marca"] != marca:
+                try:
+                    res = ejecutar_supabase(sb.table(tabla).select("periodo,eps,cuentas"), "proyecciones")
+                    est["metas"], est["marca"] = _normalizar_proyecciones(pd.DataFrame(res.data or [])), marca
+                except Exception as e:
+                    st.warning(f"No pude leer las metas de Supabase, uso {os.path.basename(PROYECCIONES_FILE)}: {e}")
+                    sb = None
+            if sb: return est["metas"]
+        marca = ("local", os.stat(PROYECCIONES_FILE).st_mtime_ns if os.path.exists(PROYECCIONES_FILE) else None)
+        if est["marca"] != marca:
+            crudo = pd.read_excel(PROYECCIONES_FILE, dtype=str) if marca[1] else PROYECCION_INICIAL
+            est["metas"], est["marca"] = _normalizar_proyecciones(crudo), marca
+        return est["metas"]
+
+def marca_proyecciones():
+    proyecciones()
+    return _estado_proyecciones()["marca"]
+
+def guardar_proyecciones(df_edit: pd.DataFrame) -> tuple[bool, str]:
+    """
+    Reemplaza las metas (tabla de Supabase si está configurada; si no, proyecciones.xlsx).
+    En Supabase se escribe con la service_key: la anon_key solo puede leer la tabla.
+    """
+    metas = _normalizar_proyecciones(df_edit)
+    filas = metas.assign(Periodo=metas["Periodo"].dt.strftime("%Y-%m"))
+    tabla = _tabla_proyecciones()
+    sb = _get_supabase(servicio=True) if tabla else None
+    if tabla and not sb and _get_supabase():
+        return False, "Editar metas en Supabase requiere supabase.service_key en secrets (la anon_key solo las lee)."
+    try:
+        if sb:
+            previas = _normalizar_proyecciones(pd.DataFrame(
+                ejecutar_supabase(sb.table(tabla).select("periodo,eps,cuentas"), "proyecciones").data or []))
+            quedan = set(zip(filas["Periodo"], filas["EPS"]))
+            for p, e in zip(previas["Periodo"].dt.strftime("%Y-%m"), previas["EPS"]):
+                if (p, e) not in quedan:
+                    ejecutar_supabase(sb.table(tabla).delete().eq("periodo", p).eq("eps", e), "proyecciones")
+            registros = [{"periodo": p, "eps": e, "cuentas": int(c)}
+                         for p, e, c in zip(filas["Periodo"], filas["EPS"], filas["Cuentas estimadas"])]
+            if registros:
+                ejecutar_supabase(sb.table(tabla).upsert(registros, on_conflict="periodo,eps"), "proyecciones")
+            destino = "OK_SUPABASE"
+        else:
+            with FileLock(PROYECCIONES_FILE + ".lock", timeout=10):
+                _escribir_excel_atomico(filas, PROYECCIONES_FILE, sheet_name="proyecciones")
+            destino = "OK_LOCAL"
+    except Timeout:
+        return False, "Otro usuario está guardando las metas. Intenta de nuevo."
+    except Exception as e:
+        return False, f"Error guardando metas: {e}"
+    _estado_proyecciones()["marca"] = None
+    return True, destino
+
+@st.cache_resource
+def _estado_avance() -> dict:
+    """Radicadas por (Periodo, EPS) y series ya armadas, válidas para una versión de datos + metas."""
+    return {"clave": None, "reales": None, "series": {}, "lock": threading.Lock()}
+
+def _radicadas_por_mes() -> pd.DataFrame:
+    """Facturas radicadas por mes de avance y EPS, desde el cubo (sin recorrer el inventario)."""
+    cubo = cubo_agregado()
+    rad = cubo[cubo["EstadoCanon"] == "Radicada"]
+    g = rad.groupby(["MesClave","EPS"], dropna=False, observed=True)["Facturas"].sum().reset_index()
+    etiquetas = pd.Series(pd.unique(g["MesClave"]))
+    periodo = pd.Series(periodo_de_etiqueta(etiquetas).to_numpy(), index=etiquetas.to_numpy())
+    g["Periodo"] = g["MesClave"].map(periodo)
+    g["EPS"] = g["EPS"].astype(object).where(g["EPS"].notna(), "").astype(str).str.strip()
+    return g.dropna(subset=["Periodo"]).groupby(["Periodo","EPS"], as_index=False)["Facturas"].sum()
+
+def avance_series(eps: str | None = None) -> pd.DataFrame:
+    """
+    Real vs proyectado acumulado por mes (todas las EPS o una). Las radicadas salen del cubo y se
+    agrupan una vez por versión de datos; cada serie se arma una vez por versión + metas.
+    """
+    est = _estado_avance()
+    with est["lock"]:
+        clave = (version_datos(), marca_proyecciones())
+        if est["clave"] != clave or est["reales"] is None:
+            with versiones_servidas() as usadas:
+                est["reales"], est["series"] = _radicadas_por_mes(), {}
+            est["clave"] = (min(usadas), clave[1])
+        if eps in est["series"]: return est["series"][eps]
+        metas, reales = proyecciones(), est["reales"]
+        if eps:
+            metas, reales = metas[metas["EPS"] == eps], reales[reales["EPS"] == eps]
+        elif (metas["EPS"] == "").any():
+            metas = metas[metas["EPS"] == ""]
+        base = metas.groupby("Periodo", as_index=False)["Cuentas estimadas"].sum().sort_values("Periodo")
+        reales = reales.groupby("Periodo")["Facturas"].sum()
+        total_meta = int(base["Cuentas estimadas"].sum())
+        comp = base.assign(
+            Mes=[f"{MES_NOMBRE[p.month]} {p.year}" for p in base["Periodo"]],
+            **{"Cuentas reales": base["Periodo"].map(reales).fillna(0).astype(int).to_numpy()})
+        comp["Cuentas estimadas acumuladas"] = comp["Cuentas estimadas"].cumsum()
+        comp["% proyectado acumulado"] = (comp["Cuentas estimadas acumuladas"]/total_meta*100).round(2) if total_meta else 0.0
+        comp["Cuentas reales acumuladas"] = comp["Cuentas reales"].cumsum()
+        comp["% real acumulado"] = (comp["Cuentas reales acumuladas"]/total_meta*100).round(2) if total_meta else 0.0
+        comp["Diferencia % (Real - Proy)"] = (comp["% real acumulado"] - comp["% proyectado acumulado"]).round(2)
+        comp = comp[["Periodo","Mes","Cuentas estimadas","Cuentas estimadas acumuladas","% proyectado acumulado",
+                     "Cuentas reales","Cuentas reales acumuladas","% real acumulado","Diferencia % (Real - Proy)"]]
+        est["series"][eps] = comp.reset_index(drop=True)
+        return est["series"][eps]
+
+# ====== Índice de búsqueda (NumeroFactura / Documento / Paciente) ======
+INDICE_CAMPOS = ("NumeroFactura","Documento","Paciente")
+INDICE_N = 3   # n-gramas para búsquedas "contiene"
+
+@st.cache_resource
+def _estado_indice() -> dict:
+    return {"indice": None, "version": -1, "lock": threading.Lock()}
+
+INDICE_MAX_LARGO = 64   # textos más largos no van a los n-gramas; se revisan siempre
+
+def _codigo_ngramas(cps: np.ndarray, n: int = INDICE_N) -> np.ndarray:
+    """Código int64 de cada n-grama a partir de code points (21 bits por carácter)."""
+    m = cps.shape[-1] - n + 1
+    return sum(cps[..., k:k + m].astype(np.int64) << (21 * (n - 1 - k)) for k in range(n))
+
+def _ngramas(texto: pd.Series, n: int = INDICE_N) -> tuple[dict, np.ndarray]:
+    """
+    Índice invertido: código de n-grama -> posiciones (ordenadas, sin repetir) de las filas que lo
+    contienen. Devuelve también las posiciones de los textos demasiado largos para indexarlos.
+    """
+    largo = texto.str.len().fillna(0).to_numpy(dtype=np.int64)
+    largos = np.flatnonzero(largo > INDICE_MAX_LARGO)
+    ok = np.flatnonzero((largo >= n) & (largo <= INDICE_MAX_LARGO))
+    if not len(ok): return {}, largos
+    ancho = int(largo[ok].max())
+    cps = np.array(texto.iloc[ok].tolist(), dtype=f"U{ancho}").view(np.uint32).reshape(len(ok), ancho)
+    codigos = _codigo_ngramas(cps, n)
+    validos = (np.arange(ancho - n + 1)[None, :] + n) <= largo[ok][:, None]
+    c = codigos[validos]
+    p = ok[np.nonzero(validos)[0]]
+    orden = np.lexsort((p, c))
+    c, p = c[orden], p[orden]
+    unicos = np.r_[True, (c[1:] != c[:-1]) | (p[1:] != p[:-1])]
+    c, p = c[unicos], p[unicos]
+    cortes = np.flatnonzero(c[1:] != c[:-1]) + 1
+    return dict(zip(c[np.r_[0, cortes]].tolist(), np.split(p, cortes))), largos
+
+def _indice_hash(clave: pd.Series) -> dict:
+    """valor -> posiciones (ordenadas) con ese valor."""
+    codigos, unicos = pd.factorize(clave.to_numpy(dtype=object))
+    orden = np.argsort(codigos, kind="stable")
+    cortes = np.flatnonzero(np.diff(codigos[orden])) + 1
+    return dict(zip(unicos.tolist(), np.split(orden, cortes))) if len(orden) else {}
+
+def _indexar_campo(s: pd.Series) -> dict:
+    clave = _clave_factura(s).reset_index(drop=True)
+    texto = clave.str.lower()
+    ngram, largos = _ngramas(texto)
+    return {
+        "exacto": _indice_hash(clave),
+        "texto": texto,
+        "texto_obj": texto.to_numpy(dtype=object),
+        "ngram": ngram,
+        "largos": largos,
+    }
+
+def indice_busqueda() -> dict:
+    """
+    Índice hash (valor exacto, sin espacios) + n-gramas (contiene, sin mayúsculas) sobre
+    NumeroFactura, Documento y Paciente de load_data(). Se reconstruye con cada versión del
+    inventario entregado (una copia anterior no pisa el índice de una versión más nueva).
+    """
+    v, df = load_data_version()
+    est = _estado_indice()
+    with est["lock"]:
+        idx = est["indice"]
+        if idx is None or est["version"] != v or idx["filas"] != len(df):
+            t0 = time.perf_counter()
+            idx = {"filas": len(df), "etiquetas": df.index.to_numpy()}
+            for campo in INDICE_CAMPOS:
+                idx[campo] = _indexar_campo(df[campo] if campo in df.columns else pd.Series("", index=df.index))
+            if v >= est["version"]: est["indice"], est["version"] = idx, v
+            registrar_metrica("indice", version=v, filas=len(df),
+                              ngramas=sum(len(idx[c]["ngram"]) for c in INDICE_CAMPOS),
+                              ms=round((time.perf_counter() - t0) * 1000, 1))
+        return idx
+
+def buscar_exacto(campo: str, valor) -> np.ndarray:
+    """Etiquetas de load_data() cuyo campo (sin espacios) es exactamente valor."""
+    idx = indice_busqueda()
+    pos = idx[campo]["exacto"].get(str(valor).strip(), np.array([], dtype=int))
+    return idx["etiquetas"][pos]
+
+def buscar_contiene(campo: str, texto) -> np.ndarray:
+    """Etiquetas de load_data() cuyo campo contiene texto (sin distinguir mayúsculas)."""
+    idx = indice_busqueda()
+    q = str(texto).strip().lower()
+    ic = idx[campo]
+    if not q: return idx["etiquetas"]
+    vacio = np.array([], dtype=np.int64)
+    listas = []
+    if len(q) >= INDICE_N:
+        cod = _codigo_ngramas(np.array([ord(ch) for ch in q], dtype=np.uint32))
+        listas = sorted((ic["ngram"].get(k, vacio) for k in set(cod.tolist())), key=len)
+    if not listas or len(listas[0]) > idx["filas"] // 8:
+        # consulta corta o n-gramas muy comunes: recorrer el texto ya normalizado es más barato
+        pos = np.flatnonzero(ic["texto"].str.contains(q, regex=False).to_numpy(dtype=bool))
+    else:
+        pos = listas[0]
+        for otra in listas[1:3]:
+            pos = np.intersect1d(pos, otra, assume_unique=True)
+        pos = np.union1d(pos, ic["largos"])
+        cand = ic["texto_obj"][pos]
+        pos = pos[np.fromiter((q in t for t in cand), dtype=bool, count=len(cand))]
+    return idx["etiquetas"][pos]
+
+# ====== Motor de bandejas (particiones por estado ya ordenadas + máscaras de filtro) ======
+@st.cache_resource
+def _estado_bandejas() -> dict:
+    return {"motor": None, "version": -1, "lock": threading.Lock()}
+
+def _mascaras(valores: pd.Series) -> dict:
+    """valor (texto) -> máscara booleana de filas con ese valor."""
+    codigos, unicos = pd.factorize(valores.to_numpy(dtype=object))
+    return {str(u): codigos == i for i, u in enumerate(unicos)}
+
+def motor_bandejas() -> dict:
+    """
+    Para cada Estado, posiciones de load_data() ya ordenadas por FechaMovimiento desc y
+    NumeroFactura asc; máscaras por EPS y Vigencia. Se recalcula con cada versión del inventario
+    entregado (una copia anterior no pisa el motor de una versión más nueva).
+    """
+    v, df = load_data_version()
+    est = _estado_bandejas()
+    with est["lock"]:
+        motor = est["motor"]
+        if motor is None or est["version"] != v or motor["filas"] != len(df):
+            t0 = time.perf_counter()
+            fm = pd.to_datetime(df["FechaMovimiento"], errors="coerce")
+            k_fm = np.where(fm.isna().to_numpy(), np.iinfo(np.int64).max,
+                            -fm.to_numpy(dtype="datetime64[ns]").view(np.int64))
+            cod_nf, _ = pd.factorize(df["NumeroFactura"].to_numpy(dtype=object), sort=True)
+            k_nf = np.where(cod_nf < 0, np.iinfo(np.int64).max, cod_nf)
+            orden = np.lexsort((k_nf, k_fm))
+            estados = df["Estado"].astype(object).to_numpy()[orden]
+            eps = df["EPS"].astype(object)
+            vig = pd.to_numeric(df["Vigencia"], errors="coerce")
+            motor = {
+                "filas": len(df),
+                "etiquetas": df.index.to_numpy(),
+                "particiones": {e: orden[estados == e] for e in ESTADOS},
+                "EPS": _mascaras(df["EPS"].astype(str)),
+                "Vigencia": _mascaras(df["Vigencia"].astype(str)),
+                "eps_opciones": sorted(e for e in eps.dropna().astype(str).unique().tolist() if e),
+                "vig_opciones": sorted(str(int(x)) for x in vig.dropna().unique().tolist()),
+            }
+            if v >= est["version"]: est["motor"], est["version"] = motor, v
+            registrar_metrica("bandejas", version=v, filas=len(df),
+                              ms=round((time.perf_counter() - t0) * 1000, 1))
+        return motor
+
+def _posiciones_bandeja(motor: dict, estado: str, eps: str | None, vig: str | None,
+                        hits: np.ndarray | None) -> np.ndarray:
+    pos = motor["particiones"].get(estado, np.array([], dtype=np.int64))
+    filtro = None
+    for campo, valor in (("EPS", eps), ("Vigencia", vig)):
+        if valor and valor != "Todos":
+            m = motor[campo].get(str(valor))
+            if m is None: m = np.zeros(motor["filas"], dtype=bool)
+            filtro = m if filtro is None else (filtro & m)
+    if hits is not None:
+        m = np.zeros(motor["filas"], dtype=bool)
+        ix = pd.Index(motor["etiquetas"]).get_indexer(hits)
+        m[ix[ix >= 0]] = True
+        filtro = m if filtro is None else (filtro & m)
+    if filtro is not None:
+        pos = pos[filtro[pos]]
+    return pos
+
+def filas_bandeja(estado: str, eps: str | None, vig: str | None, hits: np.ndarray | None) -> np.ndarray:
+    """Etiquetas de todas las filas de la bandeja que cumplen el filtro (para mover en lote)."""
+    motor = motor_bandejas()
+    return motor["etiquetas"][_posiciones_bandeja(motor, estado, eps, vig, hits)]
+
+def pagina_bandeja(estado: str, eps: str | None, vig: str | None, hits: np.ndarray | None,
+                   page: int, per_page: int) -> tuple[np.ndarray, int, int, int]:
+    """
+    Etiquetas de la página pedida (ya ordenada), total filtrado, total de páginas y página efectiva.
+    Solo se tocan las posiciones de la partición; las filas se materializan fuera (df.loc).
+    """
+    motor = motor_bandejas()
+    pos = _posiciones_bandeja(motor, estado, eps, vig, hits)
+    total = len(pos); total_pages = max((total-1)//per_page+1, 1)
+    page = max(1, min(page, total_pages)); a = (page-1)*per_page
+    return motor["etiquetas"][pos[a:a+per_page]], total, total_pages, page
+
+# ====== Agregaciones por EPS / Vigencia / Estado (Postgres RPC, pandas o SQLite) ======
+AGG_DIMENSIONES = {"EPS": "eps", "Vigencia": "vigencia", "Estado": "estado"}
+AGG_RPC = "inventario_agregado"  # ver supabase/agregados.sql
+
+# Mismo GROUP BY que la función de Postgres; sirve tal cual en SQLite
+SQL_AGREGADO = """
+SELECT {col} AS clave,
+       COUNT(numero_factura) AS cuentas,
+       COALESCE(SUM(valor_factura), 0) AS valor_facturado,
+       COALESCE(SUM(valor_radicado), 0) AS valor_radicado,
+       SUM(CASE WHEN estado = 'Radicada' THEN 1 ELSE 0 END) AS radicadas,
+       SUM(CASE WHEN lower(trim(estado)) IN ('radicada','radicadas') THEN 1 ELSE 0 END) AS cuentas_radicadas,
+       COALESCE(SUM(CASE WHEN lower(trim(estado)) IN ('radicada','radicadas') THEN valor_radicado END), 0)
+           AS valor_radicado_radicadas
+FROM {tabla}
+GROUP BY {col}
+"""
+
+def _forma_agregado(g: pd.DataFrame, dim: str) -> pd.DataFrame:
+    """Columnas, tipos y orden comunes a todos los backends (los gráficos no notan la diferencia)."""
+    clave = g["clave"]
+    if dim == "Vigencia":
+        clave = pd.to_numeric(clave, errors="coerce").round().astype("Int16")
+    else:
+        clave = clave.astype(object).where(clave.notna()).astype(TEXTO_DTYPE)
+    num = lambda c: pd.to_numeric(g[c], errors="coerce").fillna(0)
+    out = pd.DataFrame({
+        dim: clave.reset_index(drop=True),
+        "Cuentas": num("cuentas").astype("int64").to_numpy(),
+        "Valor_Facturado": num("valor_facturado").astype("float64").round(2).to_numpy(),
+        "Valor_Radicado": num("valor_radicado").astype("float64").round(2).to_numpy(),
+        "Radicadas": num("radicadas").astype("int64").to_numpy(),
+        "Cuentas_Radicadas": num("cuentas_radicadas").astype("int64").to_numpy(),
+        "Valor_Radicado_Radicadas": num("valor_radicado_radicadas").astype("float64").round(2).to_numpy(),
+    })
+    out = out.sort_values(dim, na_position="last", kind="stable")
+    return out.sort_values("Cuentas", ascending=False, kind="stable").reset_index(drop=True)
+
+def _agg_pandas(df: pd.DataFrame, dim: str) -> pd.DataFrame:
+    canon = df["EstadoCanon"] if "EstadoCanon" in df.columns else estado_canonico(df["Estado"])
+    rad_canon = (canon.astype(object) == "Radicada")
+    d = pd.DataFrame({
+        "clave": df[dim],
+        "numero_factura": df["NumeroFactura"],
+        "valor_factura": pd.to_numeric(df["Valor Factura"], errors="coerce"),
+        "valor_radicado": pd.to_numeric(df["Valor Radicado"], errors="coerce"),
+        "radicada": (df["Estado"].astype(object) == "Radicada"),
+        "radicada_canon": rad_canon,
+        "valor_rr": pd.to_numeric(df["Valor Radicado"], errors="coerce").where(rad_canon),
+    })
+    g = d.groupby("clave", dropna=False, observed=True).agg(
+        cuentas=("numero_factura","count"),
+        valor_facturado=("valor_factura","sum"),
+        valor_radicado=("valor_radicado","sum"),
+        radicadas=("radicada","sum"),
+        cuentas_radicadas=("radicada_canon","sum"),
+        valor_radicado_radicadas=("valor_rr","sum"),
+    ).reset_index()
+    return _forma_agregado(g, dim)
+
+def _agg_sql(con, dim: str, tabla: str = DB_TABLE) -> pd.DataFrame:
+    """Ejecuta SQL_AGREGADO en cualquier conexión DB-API (Postgres local, SQLite...)."""
+    col = AGG_DIMENSIONES[dim]
+    return _forma_agregado(pd.read_sql_query(SQL_AGREGADO.format(col=col, tabla=tabla), con), dim)
+
+def agregado_sqlite(df: pd.DataFrame, dim: str) -> pd.DataFrame:
+    """Emulación en proceso del backend SQL: carga el inventario en SQLite en memoria y agrega ahí."""
+    import sqlite3
+    t = pd.DataFrame({
+        "numero_factura": df["NumeroFactura"].astype(object),
+        "valor_factura": pd.to_numeric(df["Valor Factura"], errors="coerce").astype("float64"),
+        "valor_radicado": pd.to_numeric(df["Valor Radicado"], errors="coerce").astype("float64"),
+        "eps": df["EPS"].astype(object),
+        "vigencia": pd.to_numeric(df["Vigencia"], errors="coerce").astype("float64"),
+        "estado": df["Estado"].astype(object),
+    })
+    with sqlite3.connect(":memory:") as con:
+        t.to_sql(DB_TABLE, con, index=False)
+        return _agg_sql(con, dim)
+
+def _agg_cubo(dim: str) -> pd.DataFrame:
+    c = cubo_agregado()
+    rad = (c["EstadoCanon"] == "Radicada")
+    g = pd.DataFrame({
+        "clave": c[dim],
+        "cuentas": c["Cuentas"],
+        "valor_facturado": c["Valor_Facturado"],
+        "valor_radicado": c["Valor_Radicado"],
+        "radicadas": c["Filas"].where(c["Estado"] == "Radicada", 0),
+        "cuentas_radicadas": c["Filas"].where(rad, 0),
+        "valor_radicado_radicadas": c["Valor_Radicado"].where(rad, 0),
+    })
+    return _forma_agregado(g.groupby("clave", dropna=False, sort=False).sum().reset_index(), dim)
+
+@st.cache_data(max_entries=16)
+def _agg_supabase(dim: str, version: int) -> pd.DataFrame:
+    """RPC de agregación; `version` (version_datos) la renueva tras cada guardado."""
+    sb = _get_supabase()
+    t0 = time.perf_counter()
+    res = ejecutar_supabase(sb.rpc(AGG_RPC, {"dim": AGG_DIMENSIONES[dim]}), "rpc")
+    g = pd.DataFrame(res.data or [], columns=["clave","cuentas","valor_facturado","valor_radicado",
+                                               "radicadas","cuentas_radicadas","valor_radicado_radicadas"])
+    registrar_metrica("agregado", backend="supabase", dim=dim, grupos=len(g),
+                      ms=round((time.perf_counter() - t0) * 1000, 1))
+    return _forma_agregado(g, dim)
+
+def agregado(dim: str, df: pd.DataFrame | None = None) -> pd.DataFrame:
+    """
+    GROUP BY dim (EPS / Vigencia / Estado) con Cuentas, valores y radicadas.
+    Con Supabase lo calcula Postgres (RPC inventario_agregado); si no está o falla, se re-agrupa
+    el cubo compartido (o pandas directo sobre df, si se pasa).
+    """
+    if _get_supabase():
+        try:
+            return _agg_supabase(dim, version_datos())
+        except Exception as e:
+            registrar_metrica("agregado", backend="pandas (fallback)", dim=dim, error=str(e)[:120])
+    return _agg_pandas(df, dim) if df is not None else _agg_cubo(dim)
+
+# ====== Exportaciones bajo demanda (bytes cacheados por tipo + formato + versión de datos) ======
+EXPORT_MIME = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+EXPORT_FORMATOS = ["xlsx", "csv"] + (["parquet"] if PARQUET_OK else [])
+EXPORT_CACHE_MAX = 16
+# st.download_button acepta un callable (se genera al hacer clic) en Streamlit reciente
+_DESCARGA_DIFERIDA = "callable" in (st.download_button.__doc__ or "")
+
+@st.cache_resource
+def _cache_exportes() -> dict:
+    return {"items": {}, "lock": threading.Lock()}
+
+def _columnas_python(df: pd.DataFrame) -> list[list]:
+    """Columnas como listas de valores nativos (None en vacíos) para xlsxwriter."""
+    cols = []
+    for c in df.columns:
+        s = df[c]
+        if pd.api.types.is_datetime64_any_dtype(s):
+            vals = [None if pd.isna(x) else x.to_pydatetime() for x in s]
+        elif pd.api.types.is_bool_dtype(s) or pd.api.types.is_numeric_dtype(s):
+            vals = s.astype(object).where(s.notna(), None).tolist()
+        else:
+            vals = s.astype(object).where(s.notna(), None).map(lambda x: x if x is None else str(x)).tolist()
+        cols.append(vals)
+    return cols
+
+def _escribir_xlsx(destino, hojas: dict[str, pd.DataFrame], progreso=None):
+    """
+    Excel escrito fila a fila con xlsxwriter en modo constant_memory (memoria ~ una fila).
+    destino: ruta o BytesIO; progreso(fracción) se llama cada pocos miles de filas.
+    """
+    import xlsxwriter
+    total = max(sum(len(df) for df in hojas.values()), 1); hechas = 0
+    wb = xlsxwriter.Workbook(destino, {"constant_memory": True, "nan_inf_to_errors": True,
+                                       "default_date_format": "yyyy-mm-dd", "remove_timezone": True})
+    for nombre, df in hojas.items():
+        ws = wb.add_worksheet(str(nombre)[:31])
+        ws.write_row(0, 0, [str(c) for c in df.columns])
+        for i, fila in enumerate(zip(*_columnas_python(df)), start=1):
+            ws.write_row(i, 0, fila)
+            if progreso and i % 5000 == 0: progreso((hechas + i) / total)
+        hechas += len(df)
+    wb.close()
+
+def _xlsx_bytes(hojas: dict[str, pd.DataFrame]) -> bytes:
+    out = io.BytesIO()
+    _escribir_xlsx(out, hojas)
+    return out.getvalue()
+
+def _serializar(hojas: dict[str, pd.DataFrame], formato: str, destino=None, progreso=None) -> bytes | None:
+    """Bytes del archivo; si se da destino (ruta), lo escribe ahí y devuelve None."""
+    if formato == "xlsx":
+        if destino is None: return _xlsx_bytes(hojas)
+        return _escribir_xlsx(destino, hojas, progreso)
+    df = next(iter(hojas.values()))   # CSV / Parquet: una sola tabla
+    if formato == "csv":
+        if destino is None: return df.to_csv(index=False).encode("utf-8-sig")
+        return df.to_csv(destino, index=False, encoding="utf-8-sig")
+    if formato == "parquet":
+        buf = destino if destino is not None else io.BytesIO()
+        _tipar_parquet(df).to_parquet(buf, index=False)
+        return None if destino is not None else buf.getvalue()
+    raise ValueError(f"Formato de exportación no soportado: {formato}")
+
+def exportar(tipo: str, formato: str, construir) -> bytes:
+    """
+    Bytes del archivo `tipo` en `formato`. construir() devuelve un DataFrame o {hoja: DataFrame}
+    y solo se llama si no hay copia para la versión de datos actual. La copia se guarda con la
+    versión de los datos que usó construir() (ver versiones_servidas).
+    """
+    cache = _cache_exportes()
+    clave = (tipo, formato, version_datos())
+    with cache["lock"]:
+        if clave in cache["items"]:
+            return cache["items"][clave]
+    t0 = time.perf_counter()
+    with versiones_servidas() as usadas:
+        hojas = construir()
+    clave = (tipo, formato, min(usadas))
+    if isinstance(hojas, pd.DataFrame): hojas = {tipo: hojas}
+    data = _serializar(hojas, formato)
+    with cache["lock"]:
+        items = cache["items"]
+        items[clave] = data
+        for viejo in [k for k in items if k[2] < clave[2]] + list(items)[:-EXPORT_CACHE_MAX]:
+            items.pop(viejo, None)
+    registrar_metrica("exportacion", tipo=tipo, formato=formato, kb=round(len(data) / 1024, 1),
+                      ms=round((time.perf_counter() - t0) * 1000, 1))
+    return data
+
+def boton_descarga(label: str, tipo: str, key: str, formato: str = "xlsx"):
+    """
+    download_button de una exportación estándar (EXPORTES) que genera el archivo solo al pedirlo
+    y lo reutiliza mientras no cambien los datos.
+    """
+    _, file_base, construir = EXPORTES[tipo]
+    generar = lambda: exportar(tipo, formato, construir)
+    nombre = f"{file_base}.{formato}"
+    if _DESCARGA_DIFERIDA:
+        return st.download_button(label, data=generar, file_name=nombre, mime=EXPORT_MIME[formato],
+                                  use_container_width=True, key=key)
+    # Streamlit sin datos diferidos: primero "Preparar", luego el botón con los bytes ya cacheados
+    marca = f"_{key}_listo"
+    if st.session_state.get(marca) != (formato, version_datos()):
+        if st.button(f"{label} — preparar", use_container_width=True, key=f"{key}_preparar"):
+            st.session_state[marca] = (formato, version_datos())
+            st.rerun()
+        return False
+    return st.download_button(label, data=generar(), file_name=nombre, mime=EXPORT_MIME[formato],
+                              use_container_width=True, key=key)
+
+# ====== Contenido estándar de exportaciones (mismas tablas que en pantalla) ======
+def tabla_reporte(dim: str) -> pd.DataFrame:
+    """Tabla de Reportes por EPS / Vigencia (con % Avance) o por Estado."""
+    g = agregado(dim)
+    if dim == "Estado":
+        return g[["Estado","Cuentas","Valor_Facturado","Valor_Radicado"]]
+    g = g[[dim,"Cuentas","Valor_Facturado","Valor_Radicado","Radicadas"]].copy()
+    g["% Avance"] = (g["Radicadas"] / g["Cuentas"].where(g["Cuentas"]!=0, pd.NA) * 100).fillna(0).round(2)
+    return g
+
+def totales_inventario() -> dict:
+    cubo = cubo_agregado()
+    total = int(cubo["Filas"].sum())
+    radicadas = int(cubo.loc[cubo["EstadoCanon"]=="Radicada", "Filas"].sum())
+    return {
+        "total": total,
+        "radicadas": radicadas,
+        "valor_facturado": float(cubo["Valor_Facturado"].sum()),
+        "valor_radicado": float(cubo["Valor_Radicado"].sum()),
+        "avance": round((radicadas/total*100),2) if total else 0.0,
+    }
+
+def hojas_dashboard() -> dict:
+    t = totales_inventario()
+    hojas = {"Resumen": pd.DataFrame({
+        "Métrica":["Total facturas","Total facturado","Total radicado","% Avance (radicadas)"],
+        "Valor":[t["total"],t["valor_facturado"],t["valor_radicado"],t["avance"]]
+    })}
+    for dim, hoja in [("EPS","Por_EPS"), ("Vigencia","Por_Vigencia")]:
+        hojas[hoja] = agregado(dim)[[dim,"Cuentas","Valor_Facturado","Valor_Radicado"]].rename(
+            columns={"Cuentas":"N_Facturas"})
+    return hojas
+
+# tipo -> (etiqueta, nombre de archivo, construir)
+EXPORTES = {
+    "inventario_cuentas": ("Inventario completo", "inventario_cuentas", lambda: {"inventario_cuentas": load_data()}),
+    "Por_EPS": ("Reporte por EPS", "reporte_por_eps", lambda: {"Por_EPS": tabla_reporte("EPS")}),
+    "Por_Vigencia": ("Reporte por Vigencia", "reporte_por_vigencia", lambda: {"Por_Vigencia": tabla_reporte("Vigencia")}),
+    "Por_Estado": ("Reporte por Estado", "reporte_por_estado", lambda: {"Por_Estado": tabla_reporte("Estado")}),
+    "dashboard": ("Dashboard (varias hojas)", "dashboard_radicacion", hojas_dashboard),
+    "Movimientos": ("Movimientos por día", "movimientos_por_dia", lambda: {"Movimientos": flujo_movimientos("Día")}),
+}
+
+# ====== Datos de gráficos (pre-agregados + figuras cacheadas por versión de datos) ======
+# Ningún gráfico se arma sobre filas de facturas: se re-agrupa el cubo (o agregado()) y la figura
+# queda en memoria hasta que cambien los datos. El JSON que va al navegador depende del número de
+# categorías, no del tamaño del inventario.
+GRAFICO_MAX_CATEGORIAS = 40   # valores del eje; los menores se juntan en "Otros"
+GRAFICO_CACHE_MAX = 32
+MEDIDAS_GRAFICO = {"Cuentas": "Cuentas", "Valor Factura": "Valor_Facturado", "Valor Radicado": "Valor_Radicado"}
+
+@st.cache_resource
+def _cache_graficos() -> dict:
+    return {"items": {}, "lock": threading.Lock()}
+
+def tope_categorias(g: pd.DataFrame, eje: str, medida: str, maximo: int = GRAFICO_MAX_CATEGORIAS) -> pd.DataFrame:
+    """Si `eje` tiene más de `maximo` valores, los de menor total de `medida` pasan a 'Otros'."""
+    totales = g.groupby(eje, sort=False)[medida].sum()
+    if len(totales) <= maximo: return g
+    otras = totales.nsmallest(len(totales) - maximo + 1).index
+    g = g.assign(**{eje: g[eje].astype(object).where(~g[eje].isin(otras), "Otros")})
+    return g.groupby([c for c in g.columns if c != medida], sort=False, dropna=False)[medida].sum().reset_index()
+
+def datos_grafico(dims: list[str], medida: str) -> pd.DataFrame:
+    """Suma de `medida` (Cuentas / Valor Factura / Valor Radicado) por `dims`, desde el cubo."""
+    col = MEDIDAS_GRAFICO[medida]
+    g = cubo_agregado().groupby(dims, sort=True)[col].sum().reset_index().rename(columns={col: medida})
+    return tope_categorias(g, dims[0], medida)
+
+def grafico(clave: str, construir) -> go.Figure:
+    """
+    Figura `clave` de la versión de datos actual; construir() solo corre si no está en cache.
+    La figura se comparte entre sesiones: no modificarla después de obtenerla.
+    """
+    cache = _cache_graficos()
+    k = (clave, version_datos())
+    with cache["lock"]:
+        fig = cache["items"].get(k)
+    if fig is not None: return fig
+    t0 = time.perf_counter()
+    with versiones_servidas() as usadas:
+        fig = construir()
+    k = (clave, min(usadas))   # armada con una copia anterior: no queda como la de la versión nueva
+    kb = round(len(fig.to_json()) / 1024, 1)   # lo que viajará al navegador en cada render
+    with cache["lock"]:
+        items = cache["items"]
+        items[k] = fig
+        for viejo in [c for c in items if c[1] < k[1]] + list(items)[:-GRAFICO_CACHE_MAX]:
+            items.pop(viejo, None)
+    registrar_metrica("grafico", clave=clave, kb=kb, ms=round((time.perf_counter() - t0) * 1000, 1))
+    return fig
+
+def fig_estado_pie() -> go.Figure:
+    g = agregado("Estado")[["Estado","Cuentas"]].rename(columns={"Cuentas":"Cantidad"})
+    fig = px.pie(g, names="Estado", values="Cantidad", hole=0.5, title="Distribución por Estado",
+                 color="Estado", color_discrete_map=ESTADO_COLORES)
+    fig.update_traces(textposition="inside", textinfo="percent+value")
+    return fig
+
+def fig_estado_barras() -> go.Figure:
+    return px.bar(agregado("Estado"), x="Estado", y="Cuentas", title="Cuentas por Estado", text_auto=True,
+                  color="Estado", color_discrete_map=ESTADO_COLORES)
+
+def fig_eps_funnel() -> go.Figure:
+    g = tope_categorias(agregado("EPS")[["EPS","Cuentas"]], "EPS", "Cuentas").rename(columns={"Cuentas":"Cantidad"})
+    total_cnt = g["Cantidad"].sum() if not g.empty else 0
+    g["%"] = (g["Cantidad"]/total_cnt*100).round(1) if total_cnt else 0
+    fig = px.funnel(g, x="Cantidad", y="EPS", title="Cantidad y % por EPS")
+    fig.update_traces(text=g.apply(lambda r: f"{int(r['Cantidad'])} ({r['%']}%)", axis=1), textposition="inside")
+    return fig
+
+def fig_eps_valor(titulo: str) -> go.Figure:
+    g = agregado("EPS")
+    g = g[g["Cuentas_Radicadas"] > 0][["EPS","Valor_Radicado_Radicadas"]].rename(columns={"Valor_Radicado_Radicadas":"Valor Radicado"})
+    g = tope_categorias(g, "EPS", "Valor Radicado").sort_values("Valor Radicado", ascending=False)
+    fig = px.bar(g, x="EPS", y="Valor Radicado", title=titulo, text_auto=".2s")
+    fig.update_layout(xaxis={'categoryorder':'total descending'})
+    return fig
+
+def fig_vigencia_valor() -> go.Figure:
+    """Valor Factura por Vigencia × Estado: una barra por celda, no por factura."""
+    g = datos_grafico(["Vigencia","Estado"], "Valor Factura")
+    return px.bar(g, x="Vigencia", y="Valor Factura", color="Estado",
+                  title="Valor Factura por Vigencia (por Estado)", barmode="group",
+                  category_orders={"Estado": ESTADOS}, color_discrete_map=ESTADO_COLORES, text_auto=".2s")
+
+def fig_vigencia_pie(titulo: str, hole: float) -> go.Figure:
+    g = tope_categorias(agregado("Vigencia")[["Vigencia","Cuentas"]], "Vigencia", "Cuentas")
+    fig = px.pie(g, names="Vigencia", values="Cuentas", hole=hole, title=titulo)
+    fig.update_traces(textposition="inside", textinfo="percent+value")
+    return fig
+
+# ====== Exportaciones en segundo plano (cola de trabajos + caché en disco con TTL) ======
+EXPORT_WORKERS = 2
+EXPORT_TTL_S = 6 * 3600
+EXPORT_TRABAJO_TTL_S = 3600   # trabajo terminado que nadie descargó sale de la lista tras 1 h
+EXPORT_DISCO_MAX_MB = 512
+
+@st.cache_resource
+def _cola_exportes() -> dict:
+    """Pool de hilos y trabajos del proceso (compartidos entre sesiones)."""
+    return {"pool": ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export"),
+            "trabajos": {}, "escribiendo": {}, "lock": threading.Lock()}
+
+def _podar_trabajos(cola: dict):
+    """
+    Quita de la cola los trabajos terminados ya descargados o con más de EXPORT_TRABAJO_TTL_S
+    (el llamador tiene el lock). El archivo queda en disco: volver a encolarlo lo reutiliza.
+    """
+    ahora = time.time()
+    for tid, t in list(cola["trabajos"].items()):
+        if t["estado"] in ("en cola","en curso"): continue
+        if t.get("descargada") or ahora - (t["fin"] or t["inicio"]) > EXPORT_TRABAJO_TTL_S:
+            del cola["trabajos"][tid]
+
+def marcar_descargada(tid: str):
+    """on_click del botón de descarga: el trabajo sale de la lista en la próxima poda."""
+    cola = _cola_exportes()
+    with cola["lock"]:
+        t = cola["trabajos"].get(tid)
+        if t is not None: t["descargada"] = time.time()
+
+def _ruta_exporte(tipo: str, formato: str, version: int) -> str:
+    return os.path.join(EXPORTES_DIR, f"{tipo}__v{version}.{formato}")
+
+def limpiar_cache_exportes():
+    """Borra archivos vencidos (TTL) y, si se pasa del tope, los más viejos primero."""
+    if not os.path.isdir(EXPORTES_DIR): return
+    ahora = time.time()
+    archivos = []
+    for nombre in os.listdir(EXPORTES_DIR):
+        ruta = os.path.join(EXPORTES_DIR, nombre)
+        try:
+            stt = os.stat(ruta)
+        except OSError:
+            continue
+        if nombre.endswith(".tmp"):
+            if ahora - stt.st_mtime > EXPORT_TTL_S: _borrar_silencioso(ruta)
+            continue
+        if ahora - stt.st_mtime > EXPORT_TTL_S: _borrar_silencioso(ruta)
+        else: archivos.append((stt.st_mtime, stt.st_size, ruta))
+    total = sum(a[1] for a in archivos)
+    for _, tam, ruta in sorted(archivos):
+        if total <= EXPORT_DISCO_MAX_MB * 1024 * 1024: break
+        _borrar_silencioso(ruta); total -= tam
+
+def _leer_bytes(ruta: str) -> bytes:
+    with open(ruta, "rb") as f:
+        return f.read()
+
+def _borrar_silencioso(ruta: str):
+    try: os.remove(ruta)
+    except OSError: pass
+
+def _ejecutar_exporte(trabajo: dict):
+    """
+    Corre en el pool: arma las tablas (lo pesado) y escribe el archivo. Si las tablas salieron de
+    una copia anterior, el archivo es el de esa versión; si ya existe, o si otro trabajo lo está
+    escribiendo ("escribiendo": ruta -> Event), se reutiliza en lugar de escribirlo dos veces.
+    """
+    cola = _cola_exportes()
+    def progreso(f): trabajo["progreso"] = min(0.99, max(trabajo["progreso"], f))
+    tmp = None
+    try:
+        trabajo["estado"] = "en curso"
+        with versiones_servidas() as usadas:
+            hojas = EXPORTES[trabajo["tipo"]][2]()
+        if min(usadas) != trabajo["version"]:
+            trabajo["version"] = min(usadas)
+            trabajo["ruta"] = _ruta_exporte(trabajo["tipo"], trabajo["formato"], trabajo["version"])
+        ruta = trabajo["ruta"]
+        with cola["lock"]:
+            otro, propio = cola["escribiendo"].get(ruta), None
+            if otro is None and not os.path.exists(ruta):
+                propio = cola["escribiendo"][ruta] = threading.Event()
+        if propio is not None:
+            try:
+                tmp = ruta + f".{trabajo['id']}.tmp"
+                _serializar(hojas, trabajo["formato"], destino=tmp, progreso=progreso)
+                os.replace(tmp, ruta)
+            finally:
+                with cola["lock"]: cola["escribiendo"].pop(ruta, None)
+                propio.set()
+        else:
+            if otro is not None: otro.wait()
+            if not os.path.exists(ruta):
+                raise RuntimeError("falló el trabajo que escribía este archivo; vuelve a encolarlo")
+            os.utime(ruta)  # sigue vigente para el TTL
+        trabajo["estado"], trabajo["progreso"] = "lista", 1.0
+    except Exception as e:
+        if tmp: _borrar_silencioso(tmp)
+        trabajo["estado"], trabajo["error"] = "error", str(e)
+    finally:
+        trabajo["fin"] = time.time()
+        registrar_metrica("exportacion_job", tipo=trabajo["tipo"], formato=trabajo["formato"],
+                          estado=trabajo["estado"], s=round(trabajo["fin"] - trabajo["inicio"], 2))
+        limpiar_cache_exportes()
+
+def encolar_exportacion(tipo: str, formato: str, usuario: str = "") -> str:
+    """
+    Encola la exportación `tipo` (ver EXPORTES) y devuelve el id del trabajo. Armar las tablas y
+    escribir el archivo corren en el pool, no en el script. Si ya hay archivo para la versión de
+    datos actual, o un trabajo igual en curso, se reutiliza (el pool vuelve a revisarlo con la
+    versión con la que quedaron las tablas).
+    """
+    cola = _cola_exportes()
+    version = version_datos()
+    ruta = _ruta_exporte(tipo, formato, version)
+    os.makedirs(EXPORTES_DIR, exist_ok=True)
+    with cola["lock"]:
+        _podar_trabajos(cola)
+        for t in cola["trabajos"].values():
+            if t["ruta"] == ruta and t["usuario"] == usuario and t["estado"] in ("en cola","en curso"):
+                return t["id"]
+        tid = uuid.uuid4().hex[:12]
+        trabajo = {"id": tid, "tipo": tipo, "formato": formato, "version": version, "ruta": ruta,
+                   "usuario": usuario, "estado": "en cola", "progreso": 0.0, "error": "",
+                   "inicio": time.time(), "fin": None}
+        cola["trabajos"][tid] = trabajo
+        if os.path.exists(ruta) and ruta not in cola["escribiendo"]:
+            os.utime(ruta)  # sigue vigente para el TTL
+            trabajo["estado"], trabajo["progreso"], trabajo["fin"] = "lista", 1.0, time.time()
+            return tid
+    cola["pool"].submit(_ejecutar_exporte, trabajo)
+    return tid
+
+def trabajos_exportacion(usuario: str = "") -> list[dict]:
+    """Trabajos del usuario (más recientes primero); marca 'vencida' si el archivo ya no está."""
+    cola = _cola_exportes()
+    with cola["lock"]:
+        _podar_trabajos(cola)
+        lista = [t for t in cola["trabajos"].values() if t["usuario"] == usuario]
+    for t in lista:
+        if t["estado"] == "lista" and not os.path.exists(t["ruta"]): t["estado"] = "vencida"
+    return sorted(lista, key=lambda t: t["inicio"], reverse=True)
+
+def panel_exportaciones():
+    """Formulario para encolar exportaciones grandes y lista de trabajos con progreso/descarga."""
+    usuario = str(st.session_state.get("usuario", ""))
+    e1, e2, e3 = st.columns([2,1,1])
+    tipo = e1.selectbox("Qué exportar", list(EXPORTES), format_func=lambda k: EXPORTES[k][0], key="job_tipo")
+    formatos = EXPORT_FORMATOS if tipo != "dashboard" else ["xlsx"]
+    formato = e2.selectbox("Formato", formatos, key="job_formato")
+    if e3.button("📦 Encolar", use_container_width=True, key="job_encolar"):
+        encolar_exportacion(tipo, formato, usuario)
+    trabajos = trabajos_exportacion(usuario)
+    if not trabajos:
+        st.caption("Sin exportaciones en esta sesión.")
+        return
+    st.button("🔄 Actualizar estado", key="job_refrescar")
+    for t in trabajos[:10]:
+        etiqueta = f"{EXPORTES[t['tipo']][0]} · .{t['formato']} · datos v{t['version']}"
+        if t["estado"] == "lista":
+            ruta = t["ruta"]
+            st.download_button(f"⬇️ {etiqueta}", data=(lambda r=ruta: _leer_bytes(r)) if _DESCARGA_DIFERIDA
+                               else _leer_bytes(ruta),
+                               file_name=f"{EXPORTES[t['tipo']][1]}.{t['formato']}", mime=EXPORT_MIME[t["formato"]],
+                               use_container_width=True, key=f"job_dl_{t['id']}",
+                               on_click=marcar_descargada, args=(t["id"],))
+        elif t["estado"] in ("en cola","en curso"):
+            st.progress(t["progreso"], text=f"{etiqueta} — {t['estado']} ({t['progreso']*100:.0f}%)")
+        elif t["estado"] == "error":
+            st.error(f"{etiqueta} — error: {t['error']}")
+        else:
+            st.caption(f"{etiqueta} — archivo vencido; vuelve a encolarlo.")
+
+# ====== Usuarios (login): caché en memoria + contraseñas con hash ======
+HASH_ALGORITMO = "pbkdf2_sha256"
+HASH_ITERACIONES = 200_000
+USUARIOS_TTL_S = 300   # tabla Supabase: no hay mtime, se relee cada 5 min
+
+def hash_contrasena(contrasena: str, iteraciones: int = HASH_ITERACIONES) -> str:
+    """'pbkdf2_sha256$iteraciones$sal$hash' (sal aleatoria, base64)."""
+    sal = os.urandom(16)
+    dk = hashlib.pbkdf2_hmac("sha256", contrasena.encode("utf-8"), sal, iteraciones)
+    return f"{HASH_ALGORITMO}${iteraciones}${base64.b64encode(sal).decode()}${base64.b64encode(dk).decode()}"
+
+def verificar_contrasena(contrasena: str, guardado: str) -> bool:
+    try:
+        algoritmo, iteraciones, sal, esperado = guardado.split("$")
+        if algoritmo != HASH_ALGORITMO: return False
+        dk = hashlib.pbkdf2_hmac("sha256", contrasena.encode("utf-8"), base64.b64decode(sal), int(iteraciones))
+        return hmac.compare_digest(dk, base64.b64decode(esperado))
+    except Exception:
+        return False
+
+def _tabla_usuarios() -> str:
+    """Tabla Supabase de usuarios (secrets supabase.usuarios_tabla); vacío = usar usuarios.xlsx."""
+    try:
+        return (st.secrets.get("supabase", {}).get("usuarios_tabla") or "").strip()
+    except Exception:
+        return ""
+
+def _usuarios_de_frame(df: pd.DataFrame) -> dict:
+    """Cédula -> {'hash', 'plano' (legado sin migrar), 'rol'}."""
+    df = df.rename(columns={"cedula":"Cedula", "contrasena":"Contrasena",
+                            "contrasena_hash":"ContrasenaHash", "rol":"Rol"})
+    for c in ("Cedula","Contrasena","ContrasenaHash","Rol"):
+        if c not in df.columns: df[c] = ""
+    df = df.astype(object).where(df.notna(), "")
+    return {
+        str(r.Cedula).strip(): {"hash": str(r.ContrasenaHash).strip(), "plano": str(r.Contrasena), "rol": str(r.Rol).strip()}
+        for r in df.itertuples(index=False) if str(r.Cedula).strip()
+    }
+
+@st.cache_resource
+def _estado_usuarios() -> dict:
+    return {"usuarios": None, "origen": None, "marca": None, "lock": threading.Lock()}
+
+def usuarios() -> dict:
+    """
+    Usuarios en memoria (dict por Cédula). usuarios.xlsx se relee solo si cambió su mtime;
+    la tabla de Supabase (si está configurada) cada USUARIOS_TTL_S. La tabla solo la lee el
+    rol service_role (supabase.service_key): con la anon_key los hashes no son públicos.
+    """
+    est = _estado_usuarios()
+    tabla = _tabla_usuarios()
+    sb = _get_supabase(servicio=True) if tabla else None
+    if tabla and not sb:
+        st.sidebar.warning(f"usuarios_tabla requiere supabase.service_key en secrets; uso {os.path.basename(USUARIOS_FILE)}.")
+    with est["lock"]:
+        if sb:
+            marca = int(time.time() // USUARIOS_TTL_S)
+            if est["origen"] != "supabase" or est["marca"] != marca:
+                try:
+                    res = ejecutar_supabase(sb.table(tabla).select("cedula,contrasena_hash,rol"), "usuarios")
+                    est["usuarios"], est["origen"], est["marca"] = _usuarios_de_frame(pd.DataFrame(res.data or [])), "supabase", marca
+                    return est["usuarios"]
+                except Exception as e:
+                    st.sidebar.warning(f"No pude leer usuarios de Supabase, uso {os.path.basename(USUARIOS_FILE)}: {e}")
+            else:
+                return est["usuarios"]
+        marca = os.stat(USUARIOS_FILE).st_mtime_ns
+        if est["origen"] != "local" or est["marca"] != marca:
+            est["usuarios"] = _usuarios_de_frame(pd.read_excel(USUARIOS_FILE, dtype=str))
+            est["origen"], est["marca"] = "local", marca
+        return est["usuarios"]
+
+def autenticar(cedula: str, contrasena: str) -> dict | None:
+    """Búsqueda O(1) por Cédula; acepta hash o, mientras no se migre, la contraseña en claro."""
+    u = usuarios().get(str(cedula).strip())
+    if not u: return None
+    if u["hash"]:
+        ok = verificar_contrasena(contrasena, u["hash"])
+    else:
+        ok = bool(u["plano"]) and hmac.compare_digest(u["plano"].encode("utf-8"), str(contrasena).encode("utf-8"))
+    return {"cedula": str(cedula).strip(), "rol": u["rol"]} if ok else None
+
+def migrar_contrasenas() -> tuple[bool, str]:
+    """Reemplaza en usuarios.xlsx las contraseñas en claro por su hash (columna ContrasenaHash)."""
+    try:
+        with FileLock(USUARIOS_FILE + ".lock", timeout=10):
+            df = pd.read_excel(USUARIOS_FILE, dtype=str)
+            if "ContrasenaHash" not in df.columns: df["ContrasenaHash"] = ""
+            df = df.astype(object).where(df.notna(), "")
+            pendientes = (df["Contrasena"].astype(str) != "") & (df["ContrasenaHash"].astype(str) == "")
+            if not pendientes.any():
+                return True, "No hay contraseñas en claro."
+            df.loc[pendientes, "ContrasenaHash"] = df.loc[pendientes, "Contrasena"].map(hash_contrasena)
+            df.loc[pendientes, "Contrasena"] = ""
+            _escribir_excel_atomico(df, USUARIOS_FILE, sheet_name="usuarios")
+        return True, f"{int(pendientes.sum())} contraseñas migradas a {HASH_ALGORITMO}."
+    except Timeout:
+        return False, "Otro proceso está modificando los usuarios. Intenta de nuevo."
+    except Exception as e:
+        return False, f"Error migrando usuarios: {e}"
+
+def panel_usuarios():
+    """Solo administradores: estado del almacén de usuarios y migración a hash."""
+    if st.session_state.get("rol") != "Administrador": return
+    with st.sidebar.expander("👥 Usuarios"):
+        try:
+            us = usuarios()
+        except Exception as e:
+            st.error(f"Error cargando usuarios: {e}"); return
+        en_claro = sum(1 for u in us.values() if not u["hash"])
+        st.caption(f"{len(us)} usuarios · origen: {_estado_usuarios()['origen']} · {en_claro} sin hash")
+        if _estado_usuarios()["origen"] == "local" and en_claro:
+            if st.button("🔒 Migrar contraseñas a hash", key="btn_migrar_usuarios"):
+                ok, msg = migrar_contrasenas()
+                (st.success if ok else st.error)(msg)
 
 # ====== Login opcional ======
 def login():
@@ -296,632 +3135,692 @@ def login():
         submitted = form_submit_button_compat("Ingresar", key="login_submit")
     if submitted:
         try:
-            users = pd.read_excel(USUARIOS_FILE, dtype=str)
-            ok = users[(users["Cedula"] == cedula) & (users["Contrasena"] == contrasena)]
-            if not ok.empty:
+            ok = autenticar(cedula, contrasena)
+            if ok:
                 st.session_state["autenticado"] = True
-                st.session_state["usuario"] = ok.iloc[0]["Cedula"]
-                st.session_state["rol"] = ok.iloc[0]["Rol"]
+                st.session_state["usuario"] = ok["cedula"]
+                st.session_state["rol"] = ok["rol"]
                 st.rerun()
             else:
                 st.sidebar.warning("Datos incorrectos")
         except Exception as e:
             st.sidebar.error(f"Error cargando usuarios: {e}\n\nSi no usas login, comenta esta sección y deja `autenticado=True`.")
 
-# ====== App principal ======
-def main_app():
-    st.caption(f"🆔 Versión: {APP_VERSION}")
-    st.title("📊 AIPAD • Control de Radicación")
-    if "usuario" in st.session_state and "rol" in st.session_state:
-        st.markdown(f"👤 Usuario: `{st.session_state['usuario']}`  |  🔐 Rol: `{st.session_state['rol']}`")
-
-    # Tabs
-    tab_tabla, tab_dash, tab_bandejas, tab_gestion, tab_reportes, tab_avance = st.tabs(
-        ["📄 Tabla","📋 Dashboard","🗂️ Bandejas","📝 Gestión","📑 Reportes","📈 Avance"]
-    )
-
-    # ===== 📄 TABLA =====
-    with tab_tabla:
-        show_flash()
-        st.subheader("📄 Tabla (inventario base)")
+# ====== Unidades de render (pestañas perezosas + fragmentos) ======
+# Con st.tabs clásico cada rerun ejecuta las seis pestañas aunque solo se vea una. Aquí cada
+# sección es un fragmento: lo que se toca dentro re-ejecuta solo esa sección, y al cambiar de
+# pestaña el rerun completo ejecuta únicamente la pestaña abierta.
+def tabs_perezosas(etiquetas: list[str], key: str) -> list[tuple]:
+    """
+    [(contenedor, abierta)] de st.tabs. Con on_change="rerun" Streamlit sabe cuál está abierta;
+    en versiones que no lo soportan todas cuentan como abiertas (comportamiento anterior).
+    """
+    try:
+        tabs = st.tabs(etiquetas, key=key, on_change="rerun")
+    except TypeError:
+        return [(t, True) for t in st.tabs(etiquetas)]
+    return [(t, getattr(t, "open", None) is not False) for t in tabs]
 
-        up = st.file_uploader("Sube un Excel (.xlsx) con el inventario", type=["xlsx"], accept_multiple_files=False, key="uploader_tabla")
-        c1, c2, c3 = st.columns([1,1,1])
-        if c1.button("📥 Cargar Excel (reemplazar)", use_container_width=True, type="secondary", disabled=(up is None), key="btn_cargar_excel"):
+def _alcance_rerun() -> str:
+    """'fragmento' si este rerun lo disparó un widget dentro de un fragmento, si no 'app'."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        return "fragmento" if ctx and getattr(ctx, "fragment_ids_this_run", None) else "app"
+    except Exception:
+        return "app"
+
+def unidad_render(nombre: str):
+    """Decorador: la sección pasa a ser un fragmento y su tiempo queda en la métrica 'render'."""
+    def decorador(fn):
+        @functools.wraps(fn)
+        def medida(*args, **kwargs):
+            t0 = time.perf_counter()
             try:
-                df_up = pd.read_excel(up)
-                ok, msg = _write_excel_local(df_up, INVENTARIO_LOCAL)
-                if ok:
-                    st.cache_data.clear()
-                    st.success(f"✅ Inventario reemplazado desde archivo '{up.name}'.")
-                    st.rerun()
-                else:
-                    st.error(f"❌ No se pudo guardar: {msg}")
-            except Exception as e:
-                st.error(f"❌ Error leyendo el archivo subido: {e}")
-
-        df_live = load_data().copy()
-        st.caption(f"Registros actuales: **{len(df_live)}**")
-        st.info("Puedes editar directamente en la tabla. Luego pulsa **Guardar cambios en Excel/DB**.")
-        edited = st.data_editor(
-            df_live,
-            use_container_width=True,
-            hide_index=True,
-            num_rows="dynamic",
-            key="tabla_editor_main",
-        )
-
-        c4, c5, c6 = st.columns([1,1,1])
-        if c4.button("💾 Guardar cambios en Excel/DB", type="primary", use_container_width=True, key="btn_guardar_tabla"):
-            ok, msg = guardar_inventario(edited)
+                return fn(*args, **kwargs)
+            finally:
+                registrar_metrica("render", unidad=nombre, alcance=_alcance_rerun(),
+                                  ms=round((time.perf_counter() - t0) * 1000, 1))
+        return st.fragment(medida) if hasattr(st, "fragment") else medida
+    return decorador
+
+# ====== App principal ======
+# ===== 📄 TABLA =====
+@unidad_render("Tabla")
+def seccion_tabla():
+    """Inventario editable, carga de Excel y descargas."""
+    show_flash()
+    st.subheader("📄 Tabla (inventario base)")
+
+    up = st.file_uploader("Sube un Excel (.xlsx) o CSV con el inventario", type=["xlsx","csv"], accept_multiple_files=False, key="uploader_tabla")
+    c1, c2 = st.columns([2,1])
+    modo = c1.radio("Modo de importación", list(IMPORT_MODOS), format_func=IMPORT_MODOS.get,
+                    horizontal=True, key="import_modo")
+    if c2.button("📥 Importar archivo", use_container_width=True, type="secondary", disabled=(up is None), key="btn_cargar_excel"):
+        barra = st.progress(0.0, text="Leyendo archivo…")
+        try:
+            ok, msg, rechazadas = importar_inventario(up, up.name, modo, progreso=lambda a, t: barra.progress(a, text=t))
+            st.session_state["_import_rechazos"] = (up.name, rechazadas)
             if ok:
-                tag = "(Supabase)" if msg=="OK_SUPABASE" else "(Excel local)"
-                st.success(f"✅ Cambios guardados {tag}.")
+                _soltar_base_tabla()
+                destino = "Supabase" if msg == "OK_SUPABASE" else "almacén local"
+                flash_success(f"✅ '{up.name}' importado en {destino} — {resumen_guardado()}.")
                 st.rerun()
             else:
-                st.error(f"❌ Error guardando: {msg}")
+                st.error(f"❌ No se pudo importar: {msg}")
+        except Exception as e:
+            st.error(f"❌ Error leyendo el archivo subido: {e}")
+    if "_import_rechazos" in st.session_state:
+        nombre, rechazadas = st.session_state["_import_rechazos"]
+        total = rechazadas.attrs.get("total", len(rechazadas))
+        if total:
+            with st.expander(f"⚠️ {total} fila(s) rechazadas de '{nombre}'", expanded=True):
+                if total > len(rechazadas): st.caption(f"Se muestran las primeras {len(rechazadas)}.")
+                st.dataframe(rechazadas, use_container_width=True, hide_index=True, key="tabla_rechazos")
+                d1, d2 = st.columns(2)
+                d1.download_button("⬇️ Descargar rechazadas (CSV)", rechazadas.to_csv(index=False).encode("utf-8-sig"),
+                                   file_name="filas_rechazadas.csv", mime="text/csv", key="btn_rechazos_csv")
+                if d2.button("Cerrar reporte", key="btn_cerrar_rechazos"):
+                    st.session_state.pop("_import_rechazos", None)
+                    st.rerun()
 
-        if c5.button("🔄 Recargar desde origen", use_container_width=True, key="btn_recargar_tabla"):
-            st.cache_data.clear()
-            st.rerun()
+    # El editor trabaja sobre el snapshot con el que se abrió: al guardar solo viajan tus
+    # ediciones y las filas que otro cambió entre tanto quedan como conflicto.
+    panel_conflictos("tabla")
+    version_base, df_live = st.session_state.setdefault("_tabla_base", load_data_version())
+    st.caption(f"Registros actuales: **{len(df_live)}**")
+    if version_base != version_datos():
+        st.caption("ℹ️ Hay cambios más recientes guardados por otros usuarios; al guardar solo se aplican tus ediciones. "
+                   "Usa **Recargar desde origen** para verlos.")
+    st.info("Puedes editar directamente en la tabla. Luego pulsa **Guardar cambios en Excel/DB**.")
+
+    # Filtro / orden / página se resuelven aquí; al editor solo llega la página visible
+    f1, f2, f3, f4, f5 = st.columns([1.6,1,1,1.2,0.8])
+    q = f1.text_input("🔎 Factura, paciente o documento (contiene)", key="tabla_q")
+    estado_f = f2.selectbox("Estado", ["Todos"] + ESTADOS, key="tabla_estado")
+    eps_col = df_live["EPS"]
+    eps_vals = eps_col.cat.categories if isinstance(eps_col.dtype, pd.CategoricalDtype) else eps_col.dropna().unique()
+    eps_f = f3.selectbox("EPS", ["Todos"] + sorted(map(str, eps_vals)), key="tabla_eps")
+    orden = f4.selectbox("Ordenar por", [TABLA_ORIGINAL] + list(df_live.columns), key="tabla_orden")
+    asc = f5.radio("Orden", ["↑","↓"], horizontal=True, key="tabla_asc") == "↑"
+    per_page = st.session_state.get("tabla_pp", TABLA_FILAS_POR_PAGINA[1])
+    firma = (q, estado_f, eps_f, orden, asc, per_page, st.session_state.get("tabla_page", 1))
+
+    pend = tabla_pendientes()
+    ventana = st.session_state.setdefault("_tabla_ventana", {"gen": 0, "firma": None, "filtro": None})
+    if ventana["firma"] is not None and ventana["firma"] != firma:
+        # Otra página o filtro: lo editado en la ventana anterior pasa a pendientes y el editor arranca limpio
+        if _acumular_editor(f"tabla_editor_{ventana['gen']}", ventana["etiquetas"]):
+            ventana["gen"] += 1
+    filtro = (q, estado_f, eps_f, orden, asc, len(pend["borradas"]))
+    page = firma[-1]
+    if ventana["filtro"] != filtro:
+        if ventana["filtro"] is not None and ventana["filtro"][:-1] != filtro[:-1]: page = 1   # filtro u orden nuevo
+        ventana["filas"], ventana["filtro"] = filas_tabla(df_live, q, estado_f, eps_f, orden, asc, pend["borradas"]), filtro
+    filas = ventana["filas"]
+    total_pages = max((len(filas)-1)//per_page+1, 1)
+    page = max(1, min(page, total_pages))
+    st.session_state["tabla_page"] = page
+    ventana["etiquetas"], ventana["firma"] = filas[(page-1)*per_page: page*per_page], firma[:-1] + (page,)
+    key_editor = f"tabla_editor_{ventana['gen']}"
+
+    n_pend = len(pend["editadas"]) + len(pend["nuevas"]) + len(pend["borradas"])
+    p1, p2, p3, p4 = st.columns([1,2,1,1])
+    p1.button("⬅️ Anterior", disabled=(page<=1), key="tabla_prev", on_click=_ir_a_pagina, args=("tabla_page", page-1))
+    p2.markdown(f"**Página {page} / {total_pages}** &nbsp; (**{len(filas)}** filas)"
+                + (f" · ✏️ {n_pend} filas con cambios sin guardar" if n_pend else ""))
+    p3.button("Siguiente ➡️", disabled=(page>=total_pages), key="tabla_next", on_click=_ir_a_pagina, args=("tabla_page", page+1))
+    p4.selectbox("Filas por página", TABLA_FILAS_POR_PAGINA, index=1, key="tabla_pp", label_visibility="collapsed")
+
+    st.data_editor(
+        _con_pendientes(_para_editor(df_live.loc[ventana["etiquetas"]]), pend["editadas"]).reset_index(drop=True),
+        use_container_width=True,
+        hide_index=True,
+        num_rows="dynamic",
+        disabled=["Version"],
+        key=key_editor,
+    )
 
-        def _export_bytes(df_export: pd.DataFrame) -> bytes:
-            buf = io.BytesIO()
-            with pd.ExcelWriter(buf, engine="openpyxl") as w:
-                df_export.to_excel(w, index=False, sheet_name="inventario_cuentas")
-            return buf.getvalue()
-
-        st.download_button(
-            "⬇️ Descargar inventario actual (.xlsx)",
-            data=_export_bytes(load_data()),
-            file_name="inventario_cuentas.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            use_container_width=True,
-            key="dl_inventario_actual"
-        )
-
-    # ===== Cargar para otras pestañas =====
+    c4, c5, c6 = st.columns([1,1,1])
+    if c4.button("💾 Guardar cambios en Excel/DB", type="primary", use_container_width=True, key="btn_guardar_tabla"):
+        if _acumular_editor(key_editor, ventana["etiquetas"]):
+            ventana["gen"] += 1   # lo ya acumulado no debe volver a aplicarse desde el editor
+        ok, msg = guardar_inventario(None, delta=delta_tabla(df_live, pend))
+        if ok or not conflictos_guardado().empty:
+            _soltar_base_tabla()
+            if ok:
+                tag = "(Supabase)" if msg=="OK_SUPABASE" else "(local)"
+                flash_success(f"✅ Cambios guardados {tag} — {resumen_guardado()}.")
+            st.rerun()
+        else:
+            st.error(f"❌ Error guardando: {msg}")
+
+    if c6.button("↩️ Descartar ediciones", use_container_width=True, key="btn_descartar_tabla"):
+        _descartar_ediciones_tabla()
+        st.rerun()
+
+    if c5.button("🔄 Recargar desde origen", use_container_width=True, key="btn_recargar_tabla"):
+        reiniciar_sync()
+        nueva_version_datos()
+        _soltar_base_tabla()
+        st.rerun()
+
+    d1, d2 = st.columns([1,3])
+    fmt_inv = d1.selectbox("Formato", EXPORT_FORMATOS, index=0, key="dl_inventario_fmt")
+    with d2:
+        boton_descarga(f"⬇️ Descargar inventario actual (.{fmt_inv})", "inventario_cuentas",
+                       key="dl_inventario_actual", formato=fmt_inv)
+
+    with st.expander("📦 Exportaciones grandes (en segundo plano)"):
+        panel_exportaciones()
+
+    with st.expander("🧠 Memoria del inventario (bytes por columna)"):
+        if st.toggle("Calcular reporte", key="mem_reporte"):
+            rep_mem = reporte_memoria(df_live)
+            st.dataframe(rep_mem, use_container_width=True)
+            tot, tot_antes = int(rep_mem["Bytes"].sum()), int(rep_mem["Bytes sin esquema"].sum())
+            st.caption(f"Total: **{tot/1e6:,.2f} MB** (sin esquema: {tot_antes/1e6:,.2f} MB)")
+
+# ===== 📋 DASHBOARD =====
+@unidad_render("Dashboard")
+def seccion_dashboard():
+    """Indicadores y gráficos del inventario."""
+    show_flash()
+    df_res = load_data(COLS_RESUMEN)
+    if df_res.empty:
+        st.info("No hay datos en el inventario.")
+    else:
+        t = totales_inventario()
+        total, avance = t["total"], t["avance"]
+        total_valor_fact, total_valor_radic = t["valor_facturado"], t["valor_radicado"]
+
+        c1,c2,c3,c4 = st.columns(4)
+        c1.metric("📦 Total facturas", total)
+        c2.metric("💰 Total facturado", f"${total_valor_fact:,.0f}")
+        c3.metric("🏦 Total radicado", f"${total_valor_radic:,.0f}")
+        c4.metric("📊 Avance (radicadas)", f"{avance}%")
+
+        # Figuras sobre datos agregados, cacheadas por versión de datos
+        if {"Estado","NumeroFactura"}.issubset(df_res.columns):
+            st.plotly_chart(grafico("estado_pie", fig_estado_pie), use_container_width=True, key="dash_estado_donut")
+
+        # EPS
+        st.markdown("## 🏥 Por EPS")
+        e1,e2 = st.columns(2)
+        if {"EPS","NumeroFactura"}.issubset(df_res.columns):
+            with e1:
+                st.plotly_chart(grafico("eps_funnel", fig_eps_funnel), use_container_width=True, key="dash_eps_funnel")
+            with e2:
+                fig_eps_val = grafico("eps_valor_dash", lambda: fig_eps_valor("Valor radicado por EPS (solo Radicadas)"))
+                st.plotly_chart(fig_eps_val, use_container_width=True, key="dash_eps_val")
+
+        # Vigencia
+        st.markdown("## 📆 Por Vigencia")
+        v1,v2 = st.columns(2)
+        if {"Vigencia","Estado","NumeroFactura"}.issubset(df_res.columns):
+            with v1:
+                st.plotly_chart(grafico("vigencia_valor", fig_vigencia_valor), use_container_width=True, key="dash_vig_valfact")
+            with v2:
+                fig_vig_donut = grafico("vigencia_pie_dash", lambda: fig_vigencia_pie("Distribución de Facturas por Vigencia", 0.4))
+                st.plotly_chart(fig_vig_donut, use_container_width=True, key="dash_vig_donut")
+
+        st.divider()
+        # Descargar dashboard a Excel
+        boton_descarga("⬇️ Descargar Dashboard a Excel", "dashboard", key="dl_dashboard")
+
+# ===== 🗂️ BANDEJAS =====
+@unidad_render("Bandejas")
+def seccion_bandejas():
+    """Filtros comunes y una bandeja por estado."""
+    show_flash()
+    st.subheader("🗂️ Bandejas por estado")
     df = load_data()
-    df_view = df.copy()
-
-    # ===== 📋 DASHBOARD =====
-    with tab_dash:
-        show_flash()
-        if df.empty:
-            st.info("No hay datos en el inventario.")
+    if df.empty:
+        st.info("No hay datos para mostrar.")
+    else:
+        c1,c2,c3,c4 = st.columns([1.4,1,1,1])
+        q = c1.text_input("🔎 Buscar factura (contiene)", key="ban_q")
+        motor = motor_bandejas()
+        eps_opts = ["Todos"] + motor["eps_opciones"]
+        eps_sel = c2.selectbox("EPS", eps_opts, index=0, key="ban_eps")
+        vig_opts = ["Todos"] + motor["vig_opciones"]
+        vig_sel = c3.selectbox("Vigencia", vig_opts, index=0, key="ban_vig")
+        per_page = c4.selectbox("Filas por página", [50,100,200], index=1, key="ban_pp")
+
+        # Búsqueda por índice (una vez por rerun, no por bandeja)
+        coincidencias = buscar_contiene("NumeroFactura", q) if str(q).strip() else None
+
+        # Solo la bandeja abierta se ejecuta; paginar o seleccionar re-ejecuta solo esa bandeja
+        for estado, (tab, abierta) in zip(ESTADOS, tabs_perezosas(ESTADOS, "tab_bandeja")):
+            if abierta:
+                with tab: seccion_bandeja(estado, eps_sel, vig_sel, coincidencias, per_page)
+
+def _ir_a_pagina(key_page: str, pagina: int):
+    # Callback: la página cambia antes del rerun del fragmento, sin st.rerun() extra
+    st.session_state[key_page] = max(1, pagina)
+
+@unidad_render("Bandeja")
+def seccion_bandeja(estado: str, eps_sel: str, vig_sel: str, coincidencias, per_page: int):
+    """Una bandeja: página actual, selección y movimiento de estado."""
+    key_page = f"page_{estado}"
+    if key_page not in st.session_state: st.session_state[key_page]=1
+    etiquetas, total_sub, total_pages, current_page = pagina_bandeja(
+        estado, eps_sel, vig_sel, coincidencias, st.session_state[key_page], per_page)
+    df = load_data()
+    page_df = df.loc[etiquetas]  # solo las filas visibles
+    st.session_state[key_page]=current_page
+
+    cpa, cpb, cpc = st.columns([1,2,1])
+    cpa.button("⬅️ Anterior", disabled=(current_page<=1), key=f"prev_{estado}_{current_page}",
+               on_click=_ir_a_pagina, args=(key_page, current_page-1))
+    cpb.markdown(f"**Página {current_page} / {total_pages}** &nbsp; (**{total_sub}** registros)")
+    cpc.button("Siguiente ➡️", disabled=(current_page>=total_pages), key=f"next_{estado}_{current_page}",
+               on_click=_ir_a_pagina, args=(key_page, current_page+1))
+
+    st.divider()
+    sel_all = st.checkbox("Seleccionar todo (esta página)", key=f"selall_{estado}_{current_page}", value=False)
+    cols = ["ID","NumeroFactura","EPS","Vigencia","Valor Factura","Valor Radicado","FechaRadicacion","FechaMovimiento","Observaciones"]
+    view = page_df.reindex(columns=[c for c in cols if c in page_df.columns])
+    view.insert(0,"Seleccionar", sel_all)
+    edited = st.data_editor(view, hide_index=True, use_container_width=True, num_rows="fixed",
+                            column_config={"Seleccionar": st.column_config.CheckboxColumn("Seleccionar", default=False)},
+                            key=f"editor_{estado}_{current_page}")
+    try:
+        mask = edited["Seleccionar"].fillna(False).tolist()
+    except Exception:
+        mask = [False]*len(page_df)
+    seleccionados = [idx for pos, idx in enumerate(page_df.index.tolist()) if pos < len(mask) and mask[pos]]
+    sel_filtro = st.checkbox(f"Seleccionar todas las que coinciden con el filtro ({total_sub})",
+                             key=f"selfiltro_{estado}", value=False, disabled=(total_sub==0))
+    if sel_filtro:
+        seleccionados = filas_bandeja(estado, eps_sel, vig_sel, coincidencias).tolist()
+
+    st.divider()
+    c7,c8 = st.columns([2,1])
+    nuevo_estado = c7.selectbox("Mover seleccionadas a:", sorted(TRANSICIONES.get(estado, set()), key=ESTADOS.index), key=f"move_{estado}_{current_page}")
+    mover = c8.button("Aplicar movimiento", type="primary", disabled=(len(seleccionados)==0), key=f"mover_{estado}_{current_page}")
+    if mover:
+        facturas = df.loc[seleccionados, "NumeroFactura"]
+        ok, msg, resultado = mover_facturas(facturas, nuevo_estado)
+        if ok and msg == "OK_NOOP":
+            st.warning("Ninguna factura seleccionada admite ese movimiento.")
+            st.dataframe(resultado, use_container_width=True, key=f"mov_res_{estado}")
+        elif ok:
+            tag = "(Supabase)" if msg=="OK_SUPABASE" else "(local)"
+            n_ok = int((resultado["Resultado"]=="movida").sum())
+            rechazadas = resultado[resultado["Resultado"]!="movida"]
+            extra = f" · {len(rechazadas)} sin mover ({', '.join(rechazadas['Resultado'].unique())})" if len(rechazadas) else ""
+            flash_success(f"✅ Cambios guardados — {n_ok} facturas movidas a {nuevo_estado} {tag} · {resumen_guardado()}{extra}")
+            st.rerun()
         else:
-            total = len(df)
-            radicadas = int((df.get("EstadoCanon", pd.Series(dtype=str))=="Radicada").sum())
-            total_valor_fact = float(df.get("Valor Factura", pd.Series(dtype=float)).fillna(0).sum())
-            total_valor_radic = float(df.get("Valor Radicado", pd.Series(dtype=float)).fillna(0).sum())
-            avance = round((radicadas/total*100),2) if total else 0.0
-
-            c1,c2,c3,c4 = st.columns(4)
-            c1.metric("📦 Total facturas", total)
-            c2.metric("💰 Total facturado", f"${total_valor_fact:,.0f}")
-            c3.metric("🏦 Total radicado", f"${total_valor_radic:,.0f}")
-            c4.metric("📊 Avance (radicadas)", f"{avance}%")
-
-            # Torta por Estado
-            if {"Estado","NumeroFactura"}.issubset(df.columns):
-                g_estado = df.groupby("Estado", dropna=False)["NumeroFactura"].count().reset_index(name="Cantidad")
-                fig_estado = px.pie(g_estado, names="Estado", values="Cantidad",
-                                    hole=0.5, title="Distribución por Estado",
-                                    color="Estado", color_discrete_map=ESTADO_COLORES)
-                fig_estado.update_traces(textposition="inside", textinfo="percent+value")
-                st.plotly_chart(fig_estado, use_container_width=True, key="dash_estado_donut")
-
-            # EPS
-            st.markdown("## 🏥 Por EPS")
-            e1,e2 = st.columns(2)
-            if {"EPS","NumeroFactura"}.issubset(df.columns):
-                g_cnt = df.groupby("EPS", dropna=False)["NumeroFactura"].count().reset_index(name="Cantidad")
-                g_cnt = g_cnt.sort_values("Cantidad", ascending=False)
-                total_cnt = g_cnt["Cantidad"].sum() if not g_cnt.empty else 0
-                g_cnt["%"] = (g_cnt["Cantidad"]/total_cnt*100).round(1) if total_cnt else 0
-                with e1:
-                    fig_funnel = px.funnel(g_cnt, x="Cantidad", y="EPS", title="Cantidad y % por EPS")
-                    fig_funnel.update_traces(
-                        text=g_cnt.apply(lambda r: f"{int(r['Cantidad'])} ({r['%']}%)", axis=1),
-                        textposition="inside"
-                    )
-                    st.plotly_chart(fig_funnel, use_container_width=True, key="dash_eps_funnel")
-                with e2:
-                    df_rad = df[df.get("EstadoCanon","")=="Radicada"].copy()
-                    g_val = df_rad.groupby("EPS", dropna=False)["Valor Radicado"].sum().reset_index(name="ValorRadicado")
-                    g_val = g_val.sort_values("ValorRadicado", ascending=False)
-                    fig_eps_val = px.bar(g_val, x="EPS", y="ValorRadicado",
-                                         title="Valor radicado por EPS (solo Radicadas)",
-                                         text_auto=".2s")
-                    fig_eps_val.update_layout(xaxis={'categoryorder':'total descending'})
-                    st.plotly_chart(fig_eps_val, use_container_width=True, key="dash_eps_val")
-
-            # Vigencia
-            st.markdown("## 📆 Por Vigencia")
-            v1,v2 = st.columns(2)
-            if {"Vigencia","Estado","NumeroFactura"}.issubset(df.columns):
-                with v1:
-                    fig_vig_val = px.bar(
-                        df, x="Vigencia", y="Valor Factura", color="Estado",
-                        title="Valor Factura por Vigencia (por Estado)",
-                        barmode="group", color_discrete_map=ESTADO_COLORES, text_auto=".2s"
-                    )
-                    st.plotly_chart(fig_vig_val, use_container_width=True, key="dash_vig_valfact")
-                with v2:
-                    g_vig_cnt = df.groupby("Vigencia", dropna=False)["NumeroFactura"].count().reset_index(name="Cantidad")
-                    fig_vig_donut = px.pie(g_vig_cnt, names="Vigencia", values="Cantidad",
-                                           hole=0.4, title="Distribución de Facturas por Vigencia")
-                    fig_vig_donut.update_traces(textposition="inside", textinfo="percent+value")
-                    st.plotly_chart(fig_vig_donut, use_container_width=True, key="dash_vig_donut")
-
-            st.divider()
-            # Descargar dashboard a Excel
-            def exportar_dashboard_excel(df):
-                out = io.BytesIO()
-                total = len(df)
-                rad = int((df.get("EstadoCanon", pd.Series(dtype=str))=="Radicada").sum())
-                total_fact = float(df["Valor Factura"].fillna(0).sum())
-                total_radic = float(df["Valor Radicado"].fillna(0).sum())
-                avance = round((rad/total*100),2) if total else 0.0
-                with pd.ExcelWriter(out, engine="openpyxl") as w:
-                    pd.DataFrame({
-                        "Métrica":["Total facturas","Total facturado","Total radicado","% Avance (radicadas)"],
-                        "Valor":[total,total_fact,total_radic,avance]
-                    }).to_excel(w, index=False, sheet_name="Resumen")
-                    if "EPS" in df.columns:
-                        df.groupby("EPS", dropna=False).agg(
-                            N_Facturas=("NumeroFactura","count"),
-                            Valor_Facturado=("Valor Factura","sum"),
-                            Valor_Radicado=("Valor Radicado","sum")
-                        ).reset_index().to_excel(w, index=False, sheet_name="Por_EPS")
-                    if "Vigencia" in df.columns:
-                        df.groupby("Vigencia", dropna=False).agg(
-                            N_Facturas=("NumeroFactura","count"),
-                            Valor_Facturado=("Valor Factura","sum"),
-                            Valor_Radicado=("Valor Radicado","sum")
-                        ).reset_index().to_excel(w, index=False, sheet_name="Por_Vigencia")
-                return out.getvalue()
-            st.download_button("⬇️ Descargar Dashboard a Excel",
-                               data=exportar_dashboard_excel(df),
-                               file_name="dashboard_radicacion.xlsx",
-                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                               use_container_width=True,
-                               key="dl_dashboard")
-
-    # ===== 🗂️ BANDEJAS =====
-    with tab_bandejas:
-        show_flash()
-        st.subheader("🗂️ Bandejas por estado")
-        if df.empty:
-            st.info("No hay datos para mostrar.")
+            st.error(f"❌ Error guardando: {msg}")
+            st.dataframe(resultado, use_container_width=True, key=f"mov_res_{estado}")
+
+# ===== 📝 GESTIÓN (con compat y keys únicas) =====
+@unidad_render("Gestión")
+def seccion_gestion():
+    """Búsqueda y edición/alta de una factura."""
+    show_flash()
+    st.subheader("📝 Gestión")
+
+    def safe_date(x, default=date.today()):
+        """Convierte valores varios a date para date_input sin romper si es NaT/None."""
+        try:
+            if x is None or x is pd.NaT or (not isinstance(x, str) and pd.isna(x)): return default
+            if isinstance(x, pd.Timestamp) and pd.notna(x): return x.date()
+            if isinstance(x, (datetime, )): return x.date()
+            if isinstance(x, date): return x
+            if isinstance(x, str) and x.strip():
+                t = pd.to_datetime(x, errors="coerce")
+                if pd.notna(t): return t.date()
+        except Exception:
+            pass
+        return default
+
+    df = load_data()
+    if df.empty:
+        st.info("Ingresa o busca una factura para editar/crear.")
+    else:
+        c1,c2 = st.columns([2,1])
+        q_factura = c1.text_input("🔎 Buscar por Número de factura", key="buscar_factura_input")
+        buscar = c2.button("Buscar / Cargar", type="primary", key="btn_buscar_gestion")
+        if buscar and q_factura.strip():
+            st.session_state["factura_activa"] = q_factura.strip()
+
+        with st.expander("🔎 Buscar por paciente o documento"):
+            p1, p2 = st.columns([1,2])
+            campo_q = p1.selectbox("Campo", ["Paciente","Documento"], key="buscar_persona_campo")
+            q_persona = p2.text_input("Contiene", key="buscar_persona_input")
+            if str(q_persona).strip():
+                hallados = df.loc[buscar_contiene(campo_q, q_persona)]
+                hallados = hallados[_clave_factura(hallados["NumeroFactura"]) != ""]
+                if hallados.empty:
+                    st.info("Sin coincidencias.")
+                else:
+                    etiquetas = (hallados["NumeroFactura"].astype(str) + " — " + hallados["Paciente"].astype(str)
+                                 + " (" + hallados["Documento"].astype(str) + ") · " + hallados["Estado"].astype(str))
+                    opciones = dict(zip(etiquetas.head(200), hallados["NumeroFactura"].astype(str).str.strip().head(200)))
+                    st.caption(f"{len(hallados)} coincidencias" + (" (se muestran 200)" if len(hallados) > 200 else ""))
+                    elegida = st.selectbox("Factura", list(opciones), key="buscar_persona_res")
+                    if st.button("Cargar factura", key="btn_cargar_persona"):
+                        st.session_state["factura_activa"] = opciones[elegida]
+                        st.rerun()
+        numero_activo = st.session_state.get("factura_activa","")
+
+        if not numero_activo:
+            st.info("Ingresa un número de factura y presiona **Buscar / Cargar** para editar o crear.")
         else:
-            c1,c2,c3,c4 = st.columns([1.4,1,1,1])
-            q = c1.text_input("🔎 Buscar factura (contiene)", key="ban_q")
-            eps_opts = ["Todos"] + sorted([e for e in df.get("EPS", pd.Series(dtype=str)).dropna().astype(str).unique().tolist() if e])
-            eps_sel = c2.selectbox("EPS", eps_opts, index=0, key="ban_eps")
-            vig_opts = ["Todos"] + sorted([str(int(v)) for v in pd.to_numeric(df.get("Vigencia", pd.Series(dtype=float)), errors="coerce").dropna().unique().tolist()])
-            vig_sel = c3.selectbox("Vigencia", vig_opts, index=0, key="ban_vig")
-            per_page = c4.selectbox("Filas por página", [50,100,200], index=1, key="ban_pp")
-
-            def _filtrar(df_, estado, eps, vig, qtext):
-                sub = df_[df_["Estado"]==estado].copy()
-                if eps and eps!="Todos": sub = sub[sub["EPS"].astype(str)==eps]
-                if vig and vig!="Todos": sub = sub[sub["Vigencia"].astype(str)==str(vig)]
-                if qtext:
-                    qn = str(qtext).strip().lower()
-                    sub = sub[sub["NumeroFactura"].astype(str).str.lower().str.contains(qn)]
-                return sub
-
-            def _paginar(df_, page, per_page_):
-                total = len(df_); total_pages = max((total-1)//per_page_+1,1)
-                page = max(1, min(page, total_pages)); a=(page-1)*per_page_; b=a+per_page_
-                return df_.iloc[a:b], total_pages, page
-
-            estado_tabs = st.tabs(ESTADOS)
-            for estado, tab in zip(ESTADOS, estado_tabs):
-                with tab:
-                    sub = _filtrar(df, estado, eps_sel, vig_sel, q)
-                    sub = sub.sort_values(by=["FechaMovimiento","NumeroFactura"], ascending=[False, True])
-                    key_page = f"page_{estado}"
-                    if key_page not in st.session_state: st.session_state[key_page]=1
-                    page_df, total_pages, current_page = _paginar(sub, st.session_state[key_page], per_page)
-                    st.session_state[key_page]=current_page
-
-                    cpa, cpb, cpc = st.columns([1,2,1])
-                    prevb = cpa.button("⬅️ Anterior", disabled=(current_page<=1), key=f"prev_{estado}_{current_page}")
-                    cpb.markdown(f"**Página {current_page} / {total_pages}** &nbsp; (**{len(sub)}** registros)")
-                    nextb = cpc.button("Siguiente ➡️", disabled=(current_page>=total_pages), key=f"next_{estado}_{current_page}")
-                    if prevb: st.session_state[key_page]=max(1,current_page-1); st.rerun()
-                    if nextb: st.session_state[key_page]=min(total_pages,current_page+1); st.rerun()
-
-                    st.divider()
-                    sel_all = st.checkbox("Seleccionar todo (esta página)", key=f"selall_{estado}_{current_page}", value=False)
-                    cols = ["ID","NumeroFactura","EPS","Vigencia","Valor Factura","Valor Radicado","FechaRadicacion","FechaMovimiento","Observaciones"]
-                    view = page_df.reindex(columns=[c for c in cols if c in page_df.columns]).copy()
-                    view.insert(0,"Seleccionar", sel_all)
-                    edited = st.data_editor(view, hide_index=True, use_container_width=True, num_rows="fixed",
-                                            column_config={"Seleccionar": st.column_config.CheckboxColumn("Seleccionar", default=False)},
-                                            key=f"editor_{estado}_{current_page}")
-                    try:
-                        mask = edited["Seleccionar"].fillna(False).tolist()
-                    except Exception:
-                        mask = [False]*len(page_df)
-                    seleccionados = [idx for pos, idx in enumerate(page_df.index.tolist()) if pos < len(mask) and mask[pos]]
-
-                    st.divider()
-                    c7,c8 = st.columns([2,1])
-                    nuevo_estado = c7.selectbox("Mover seleccionadas a:", [e for e in ESTADOS if e != estado], key=f"move_{estado}_{current_page}")
-                    mover = c8.button("Aplicar movimiento", type="primary", disabled=(len(seleccionados)==0), key=f"mover_{estado}_{current_page}")
-                    if mover:
+            key_ns = f"gestion_{numero_activo}"
+            panel_conflictos("gestion")
+
+            encontradas = buscar_exacto("NumeroFactura", numero_activo)
+            existe = len(encontradas) > 0
+            idx = encontradas[0] if existe else None
+            fila = df.loc[idx] if existe else pd.Series(dtype=object)
+            # Versión con la que se abrió la factura (se conserva entre reruns hasta guardar)
+            vistas = st.session_state.setdefault("_versiones_vistas", {})
+            version_vista = vistas.setdefault(numero_activo, _version_fila(fila.get("Version")) if existe else 0)
+
+            def getv(s, k, default=None):
+                try:
+                    v = s.get(k, default) if isinstance(s, pd.Series) else default
+                    if pd.isna(v): return default
+                    return v
+                except Exception:
+                    return default
+
+            def_val = {
+                "ID": getv(fila,"ID",""),
+                "NumeroFactura": str(getv(fila,"NumeroFactura", numero_activo) or numero_activo),
+                "EPS": str(getv(fila,"EPS","") or ""),
+                "Vigencia": getv(fila,"Vigencia",""),
+                "Estado": str(getv(fila,"Estado","Pendiente") or "Pendiente"),
+                "FechaRadicacion": getv(fila,"FechaRadicacion", pd.NaT),
+                "FechaMovimiento": getv(fila,"FechaMovimiento", pd.NaT),
+                "Observaciones": str(getv(fila,"Observaciones","") or ""),
+                "Mes": str(getv(fila,"Mes","") or ""),
+                # Extras
+                "Fecha factura": getv(fila,"Fecha factura", pd.NaT),
+                "Documento": str(getv(fila,"Documento","") or ""),
+                "Paciente": str(getv(fila,"Paciente","") or ""),
+                "No Radicado": str(getv(fila,"No Radicado","") or ""),
+                "Valor Factura": getv(fila,"Valor Factura", pd.NA),
+                "Valor Radicado": getv(fila,"Valor Radicado", pd.NA),
+            }
+
+            # Top controls (con llaves únicas)
+            ctop1, ctop2, ctop3 = st.columns(3)
+            ctop1.text_input("ID (automático)", value=def_val["ID"], disabled=True, key=f"{key_ns}_id_display")
+            est_val = ctop2.selectbox("Estado", options=ESTADOS,
+                                      index=ESTADOS.index(def_val["Estado"]) if def_val["Estado"] in ESTADOS else 0,
+                                      key=f"{key_ns}_estado_val")
+            frad_disabled = (est_val != "Radicada")
+            frad_val = ctop3.date_input(
+                "Fecha de Radicación",
+                value=safe_date(def_val["FechaRadicacion"]),
+                disabled=frad_disabled,
+                key=f"{key_ns}_frad_val"
+            )
+
+            with st.form(f"{key_ns}_form_factura", clear_on_submit=False):
+                f1, f2 = st.columns(2)
+                # Básicos
+                num_val = f1.text_input("Número de factura", value=def_val["NumeroFactura"], key=f"{key_ns}_num_factura")
+                eps_val = f1.text_input("EPS", value=def_val["EPS"], key=f"{key_ns}_eps")
+
+                # Valores y extras izquierda
+                valor_fact = f1.text_input("Valor Factura",
+                                           value=(str(def_val["Valor Factura"]) if pd.notna(def_val["Valor Factura"]) else ""),
+                                           key=f"{key_ns}_valor_factura")
+                valor_radic = f1.text_input("Valor Radicado",
+                                            value=(str(def_val["Valor Radicado"]) if pd.notna(def_val["Valor Radicado"]) else ""),
+                                            key=f"{key_ns}_valor_radicado")
+
+                fecha_fact = f1.date_input(
+                    "Fecha factura",
+                    value=safe_date(def_val["Fecha factura"]),
+                    key=f"{key_ns}_fecha_factura"
+                )
+
+                # Derecha
+                vig_val = f2.text_input("Vigencia", value=str(def_val["Vigencia"]), key=f"{key_ns}_vigencia")
+                obs_val = f2.text_area("Observaciones", value=def_val["Observaciones"], height=100, key=f"{key_ns}_obs")
+                doc_val = f2.text_input("Documento", value=str(def_val["Documento"]), key=f"{key_ns}_documento")
+                pac_val = f2.text_input("Paciente", value=str(def_val["Paciente"]), key=f"{key_ns}_paciente")
+                no_radicado = f2.text_input("No Radicado", value=str(def_val["No Radicado"]), key=f"{key_ns}_no_radicado")
+
+                submit = form_submit_button_compat("💾 Guardar cambios", key=f"{key_ns}_submit")
+
+            if submit:
+                try:
+                    if not str(num_val).strip():
+                        st.error("El **Número de factura** es obligatorio.")
+                    else:
                         ahora = pd.Timestamp(datetime.now())
-                        for idx in seleccionados:
-                            df.at[idx, "Estado"] = nuevo_estado
-                            df.at[idx, "FechaMovimiento"] = ahora
-                        ok, msg = guardar_inventario(df)
-                        if ok:
-                            tag = "(Supabase)" if msg=="OK_SUPABASE" else "(Excel local)"
-                            flash_success(f"✅ Cambios guardados — {len(seleccionados)} facturas movidas a {nuevo_estado} {tag}")
-                            st.rerun()
-                        else:
-                            st.error(f"❌ Error guardando: {msg}")
+                        encontradas2 = buscar_exacto("NumeroFactura", num_val)
+                        existe2 = len(encontradas2) > 0; idx2 = encontradas2[0] if existe2 else None
 
-    # ===== 📝 GESTIÓN (con compat y keys únicas) =====
-    with tab_gestion:
-        show_flash()
-        st.subheader("📝 Gestión")
+                        estado_anterior = (str(df.loc[idx2,"Estado"]) if existe2 and "Estado" in df.columns else "").strip()
+                        estado_actual = st.session_state.get(f"{key_ns}_estado_val", estado_anterior or "Pendiente")
 
-        def safe_date(x, default=date.today()):
-            """Convierte valores varios a date para date_input sin romper si es NaT/None."""
-            try:
-                if isinstance(x, pd.Timestamp) and pd.notna(x): return x.date()
-                if isinstance(x, (datetime, )): return x.date()
-                if isinstance(x, date): return x
-                if isinstance(x, str) and x.strip():
-                    t = pd.to_datetime(x, errors="coerce")
-                    if pd.notna(t): return t.date()
-            except Exception:
-                pass
-            return default
-
-        if df.empty:
-            st.info("Ingresa o busca una factura para editar/crear.")
-        else:
-            c1,c2 = st.columns([2,1])
-            q_factura = c1.text_input("🔎 Buscar por Número de factura", key="buscar_factura_input")
-            buscar = c2.button("Buscar / Cargar", type="primary", key="btn_buscar_gestion")
-            if buscar and q_factura.strip():
-                st.session_state["factura_activa"] = q_factura.strip()
-            numero_activo = st.session_state.get("factura_activa","")
-
-            if not numero_activo:
-                st.info("Ingresa un número de factura y presiona **Buscar / Cargar** para editar o crear.")
-            else:
-                key_ns = f"gestion_{numero_activo}"
-
-                mask = df.get("NumeroFactura", pd.Series(dtype=str)).astype(str).str.strip() == str(numero_activo).strip()
-                existe = bool(mask.any())
-                idx = df[mask].index[0] if existe else None
-                fila = df.loc[idx] if existe else pd.Series(dtype=object)
-
-                def getv(s, k, default=None):
-                    try:
-                        v = s.get(k, default) if isinstance(s, pd.Series) else default
-                        if pd.isna(v): return default
-                        return v
-                    except Exception:
-                        return default
-
-                def_val = {
-                    "ID": getv(fila,"ID",""),
-                    "NumeroFactura": str(getv(fila,"NumeroFactura", numero_activo) or numero_activo),
-                    "EPS": str(getv(fila,"EPS","") or ""),
-                    "Vigencia": getv(fila,"Vigencia",""),
-                    "Estado": str(getv(fila,"Estado","Pendiente") or "Pendiente"),
-                    "FechaRadicacion": getv(fila,"FechaRadicacion", pd.NaT),
-                    "FechaMovimiento": getv(fila,"FechaMovimiento", pd.NaT),
-                    "Observaciones": str(getv(fila,"Observaciones","") or ""),
-                    "Mes": str(getv(fila,"Mes","") or ""),
-                    # Extras
-                    "Fecha factura": getv(fila,"Fecha factura", pd.NaT),
-                    "Documento": str(getv(fila,"Documento","") or ""),
-                    "Paciente": str(getv(fila,"Paciente","") or ""),
-                    "No Radicado": str(getv(fila,"No Radicado","") or ""),
-                    "Valor Factura": getv(fila,"Valor Factura", pd.NA),
-                    "Valor Radicado": getv(fila,"Valor Radicado", pd.NA),
-                }
-
-                # Top controls (con llaves únicas)
-                ctop1, ctop2, ctop3 = st.columns(3)
-                ctop1.text_input("ID (automático)", value=def_val["ID"], disabled=True, key=f"{key_ns}_id_display")
-                est_val = ctop2.selectbox("Estado", options=ESTADOS,
-                                          index=ESTADOS.index(def_val["Estado"]) if def_val["Estado"] in ESTADOS else 0,
-                                          key=f"{key_ns}_estado_val")
-                frad_disabled = (est_val != "Radicada")
-                frad_val = ctop3.date_input(
-                    "Fecha de Radicación",
-                    value=safe_date(def_val["FechaRadicacion"]),
-                    disabled=frad_disabled,
-                    key=f"{key_ns}_frad_val"
-                )
+                        frad_widget = st.session_state.get(f"{key_ns}_frad_val", safe_date(def_val["FechaRadicacion"]))
+                        frad_ts = pd.to_datetime(frad_widget) if estado_actual == "Radicada" else (pd.to_datetime(df.loc[idx2,"FechaRadicacion"]) if existe2 and "FechaRadicacion" in df.columns else pd.NaT)
 
-                with st.form(f"{key_ns}_form_factura", clear_on_submit=False):
-                    f1, f2 = st.columns(2)
-                    # Básicos
-                    num_val = f1.text_input("Número de factura", value=def_val["NumeroFactura"], key=f"{key_ns}_num_factura")
-                    eps_val = f1.text_input("EPS", value=def_val["EPS"], key=f"{key_ns}_eps")
-
-                    # Valores y extras izquierda
-                    valor_fact = f1.text_input("Valor Factura",
-                                               value=(str(def_val["Valor Factura"]) if pd.notna(def_val["Valor Factura"]) else ""),
-                                               key=f"{key_ns}_valor_factura")
-                    valor_radic = f1.text_input("Valor Radicado",
-                                                value=(str(def_val["Valor Radicado"]) if pd.notna(def_val["Valor Radicado"]) else ""),
-                                                key=f"{key_ns}_valor_radicado")
-
-                    fecha_fact = f1.date_input(
-                        "Fecha factura",
-                        value=safe_date(def_val["Fecha factura"]),
-                        key=f"{key_ns}_fecha_factura"
-                    )
-
-                    # Derecha
-                    vig_val = f2.text_input("Vigencia", value=str(def_val["Vigencia"]), key=f"{key_ns}_vigencia")
-                    obs_val = f2.text_area("Observaciones", value=def_val["Observaciones"], height=100, key=f"{key_ns}_obs")
-                    doc_val = f2.text_input("Documento", value=str(def_val["Documento"]), key=f"{key_ns}_documento")
-                    pac_val = f2.text_input("Paciente", value=str(def_val["Paciente"]), key=f"{key_ns}_paciente")
-                    no_radicado = f2.text_input("No Radicado", value=str(def_val["No Radicado"]), key=f"{key_ns}_no_radicado")
-
-                    submit = form_submit_button_compat("💾 Guardar cambios", key=f"{key_ns}_submit")
-
-                if submit:
-                    try:
-                        if not str(num_val).strip():
-                            st.error("El **Número de factura** es obligatorio.")
+                        mes_nuevo = (df.loc[idx2,"Mes"] if existe2 and "Mes" in df.columns else "")
+                        if pd.notna(frad_ts): mes_nuevo = MES_NOMBRE[int(frad_ts.month)]
+
+                        estado_cambio = (estado_actual != estado_anterior) or (not existe2)
+                        fecha_mov = (ahora if estado_cambio else (pd.to_datetime(df.loc[idx2,"FechaMovimiento"]) if existe2 and "FechaMovimiento" in df.columns else pd.NaT))
+
+                        # ID
+                        if existe2 and "ID" in df.columns and pd.notna(df.loc[idx2,"ID"]) and str(df.loc[idx2,"ID"]).strip():
+                            new_id = str(df.loc[idx2,"ID"]).strip()
                         else:
-                            ahora = pd.Timestamp(datetime.now())
-                            mask2 = df.get("NumeroFactura", pd.Series(dtype=str)).astype(str).str.strip() == str(num_val).strip()
-                            existe2 = bool(mask2.any()); idx2 = df[mask2].index[0] if existe2 else None
-
-                            estado_anterior = (str(df.loc[idx2,"Estado"]) if existe2 and "Estado" in df.columns else "").strip()
-                            estado_actual = st.session_state.get(f"{key_ns}_estado_val", estado_anterior or "Pendiente")
-
-                            frad_widget = st.session_state.get(f"{key_ns}_frad_val", safe_date(def_val["FechaRadicacion"]))
-                            frad_ts = pd.to_datetime(frad_widget) if estado_actual == "Radicada" else (pd.to_datetime(df.loc[idx2,"FechaRadicacion"]) if existe2 and "FechaRadicacion" in df.columns else pd.NaT)
-
-                            mes_nuevo = (df.loc[idx2,"Mes"] if existe2 and "Mes" in df.columns else "")
-                            if pd.notna(frad_ts): mes_nuevo = MES_NOMBRE[int(frad_ts.month)]
-
-                            estado_cambio = (estado_actual != estado_anterior) or (not existe2)
-                            fecha_mov = (ahora if estado_cambio else (pd.to_datetime(df.loc[idx2,"FechaMovimiento"]) if existe2 and "FechaMovimiento" in df.columns else pd.NaT))
-
-                            # ID
-                            if existe2 and "ID" in df.columns and pd.notna(df.loc[idx2,"ID"]) and str(df.loc[idx2,"ID"]).strip():
-                                new_id = str(df.loc[idx2,"ID"]).strip()
-                            else:
-                                try:
-                                    nums = pd.to_numeric(df.get("ID", pd.Series(dtype=str)).astype(str).str.extract(r"(\d+)$")[0], errors="coerce")
-                                    nextn = int(nums.max()) + 1 if nums.notna().any() else 1
-                                except Exception:
-                                    nextn = 1
-                                new_id = f"CHIA-{nextn:04d}"
-
-                            # Normalizar valores monetarios
-                            def _norm_val(x):
-                                v = _parse_currency(x)
-                                return float(v) if v is not pd.NA and v is not None else None
-                            v_fact = _norm_val(valor_fact)
-                            v_radic = _norm_val(valor_radic)
-
-                            registro = {
-                                "ID": new_id,
-                                "NumeroFactura": str(num_val).strip(),
-                                "EPS": str(eps_val).strip(),
-                                "Vigencia": int(vig_val) if str(vig_val).isdigit() else (None if not str(vig_val).strip() else vig_val),
-                                "Estado": estado_actual,
-                                "FechaRadicacion": frad_ts,
-                                "FechaMovimiento": fecha_mov,
-                                "Observaciones": str(obs_val).strip(),
-                                "Mes": mes_nuevo,
-                                "Fecha factura": pd.to_datetime(safe_date(fecha_fact)) if fecha_fact else pd.NaT,
-                                "Documento": str(doc_val).strip() if doc_val is not None else "",
-                                "Paciente": str(pac_val).strip() if pac_val is not None else "",
-                                "No Radicado": str(no_radicado).strip() if no_radicado is not None else "",
-                                "Valor Factura": v_fact,
-                                "Valor Radicado": v_radic,
-                            }
-
-                            if existe2:
-                                for k,v in registro.items(): df.at[idx2, k] = v
-                            else:
-                                df = pd.concat([df, pd.DataFrame([registro])], ignore_index=True)
-
-                            ok, msg = guardar_inventario(df, factura_verificar=registro["NumeroFactura"])
-                            if ok:
-                                tag = "(Supabase)" if msg=="OK_SUPABASE" else "(Excel local)"
-                                flash_success(f"✅ Cambios guardados — Factura {registro['NumeroFactura']} {tag}")
-                                st.session_state["factura_activa"] = ""
-                                st.rerun()
-                            else:
-                                st.error(f"❌ No pude confirmar el guardado: {msg}")
-                    except Exception as e:
-                        st.error("❌ Ocurrió un error al guardar en Gestión.")
-                        st.exception(e)
-
-    # ===== 📑 REPORTES =====
-    with tab_reportes:
-        show_flash()
-        st.subheader("📑 Reportes")
-        if df.empty:
-            st.info("No hay datos para reportar.")
-        else:
-            tipo = st.selectbox("Elige el reporte", ["Por EPS", "Por Vigencia", "Por Estado"], index=0, key="rep_tipo")
-
-            def agg_eps(data: pd.DataFrame) -> pd.DataFrame:
-                g = data.groupby("EPS", dropna=False).agg(
-                    Cuentas=("NumeroFactura","count"),
-                    Valor_Facturado=("Valor Factura","sum"),
-                    Valor_Radicado=("Valor Radicado","sum"),
-                    Radicadas=("Estado", lambda x: (x=="Radicada").sum())
-                ).reset_index().fillna(0)
-                g["% Avance"] = (g["Radicadas"] / g["Cuentas"].where(g["Cuentas"]!=0, pd.NA) * 100).fillna(0).round(2)
-                return g.sort_values("Cuentas", ascending=False)
-
-            def agg_vig(data: pd.DataFrame) -> pd.DataFrame:
-                g = data.groupby("Vigencia", dropna=False).agg(
-                    Cuentas=("NumeroFactura","count"),
-                    Valor_Facturado=("Valor Factura","sum"),
-                    Valor_Radicado=("Valor Radicado","sum"),
-                    Radicadas=("Estado", lambda x: (x=="Radicada").sum())
-                ).reset_index().fillna(0)
-                g["% Avance"] = (g["Radicadas"] / g["Cuentas"].where(g["Cuentas"]!=0, pd.NA) * 100).fillna(0).round(2)
-                return g.sort_values("Cuentas", ascending=False)
-
-            def agg_estado(data: pd.DataFrame) -> pd.DataFrame:
-                g = data.groupby("Estado", dropna=False).agg(
-                    Cuentas=("NumeroFactura","count"),
-                    Valor_Facturado=("Valor Factura","sum"),
-                    Valor_Radicado=("Valor Radicado","sum")
-                ).reset_index().fillna(0)
-                return g.sort_values("Cuentas", ascending=False)
-
-            def exportar_excel(df_tab: pd.DataFrame, sheet_name: str) -> bytes:
-                out = io.BytesIO()
-                with pd.ExcelWriter(out, engine="openpyxl") as w:
-                    df_tab.to_excel(w, index=False, sheet_name=sheet_name)
-                return out.getvalue()
-
-            if tipo == "Por EPS":
-                tabla = agg_eps(df)
-                st.markdown("### 🏥 Tabla por EPS")
-                st.dataframe(tabla, use_container_width=True, key="tabla_por_eps")
-
-                c1, c2 = st.columns(2)
-                total_cnt = int(tabla["Cuentas"].sum()) if not tabla.empty else 0
-                tabla_plot = tabla.copy()
-                tabla_plot["%"] = (tabla_plot["Cuentas"]/total_cnt*100).round(1) if total_cnt else 0
-                with c1:
-                    fig_funnel = px.funnel(tabla_plot, x="Cuentas", y="EPS", title="Cantidad y % por EPS")
-                    fig_funnel.update_traces(
-                        text=tabla_plot.apply(lambda r: f"{int(r['Cuentas'])} ({r['%']}%)", axis=1),
-                        textposition="inside"
-                    )
-                    st.plotly_chart(fig_funnel, use_container_width=True, key="rep_eps_funnel")
-                with c2:
-                    df_rad = df[df.get("EstadoCanon","")=="Radicada"].copy()
-                    g_val = df_rad.groupby("EPS", dropna=False)["Valor Radicado"].sum().reset_index(name="Valor Radicado")
-                    g_val = g_val.sort_values("Valor Radicado", ascending=False)
-                    fig_val = px.bar(g_val, x="EPS", y="Valor Radicado", title="Valor radicado por EPS", text_auto=".2s")
-                    fig_val.update_layout(xaxis={'categoryorder':'total descending'})
-                    st.plotly_chart(fig_val, use_container_width=True, key="rep_eps_val")
-
-                st.download_button("⬇️ Descargar reporte EPS (Excel)",
-                                   data=exportar_excel(tabla, "Por_EPS"),
-                                   file_name="reporte_por_eps.xlsx",
-                                   mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                   use_container_width=True, key="dl_rep_eps")
-
-            elif tipo == "Por Vigencia":
-                tabla = agg_vig(df)
-                st.markdown("### 📆 Tabla por Vigencia")
-                st.dataframe(tabla, use_container_width=True, key="tabla_por_vigencia")
-
-                c1, c2 = st.columns(2)
-                with c1:
-                    fig_vig_val = px.bar(df, x="Vigencia", y="Valor Factura", color="Estado",
-                                         title="Valor Factura por Vigencia (por Estado)",
-                                         barmode="group", color_discrete_map=ESTADO_COLORES, text_auto=".2s")
-                    st.plotly_chart(fig_vig_val, use_container_width=True, key="rep_vig_valfact")
-                with c2:
-                    g_cnt = df.groupby("Vigencia", dropna=False)["NumeroFactura"].count().reset_index(name="Cuentas")
-                    fig_vig_donut = px.pie(g_cnt, names="Vigencia", values="Cuentas",
-                                           hole=0.45, title="Distribución de Cuentas por Vigencia")
-                    fig_vig_donut.update_traces(textposition="inside", textinfo="percent+value")
-                    st.plotly_chart(fig_vig_donut, use_container_width=True, key="rep_vig_donut")
-
-                st.download_button("⬇️ Descargar reporte Vigencia (Excel)",
-                                   data=exportar_excel(tabla, "Por_Vigencia"),
-                                   file_name="reporte_por_vigencia.xlsx",
-                                   mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                   use_container_width=True, key="dl_rep_vig")
+                            new_id = reservar_ids(1)[0]
 
+                        # Normalizar valores monetarios
+                        def _norm_val(x):
+                            v = _parse_currency(x)
+                            return float(v) if v is not pd.NA and v is not None else None
+                        v_fact = _norm_val(valor_fact)
+                        v_radic = _norm_val(valor_radic)
+
+                        if str(num_val).strip() == numero_activo:
+                            version_reg = version_vista
+                        else:
+                            version_reg = _version_fila(df.loc[idx2, "Version"]) if existe2 else 0
+                        registro = {
+                            "ID": new_id,
+                            "NumeroFactura": str(num_val).strip(),
+                            "EPS": str(eps_val).strip(),
+                            "Vigencia": int(vig_val) if str(vig_val).isdigit() else (None if not str(vig_val).strip() else vig_val),
+                            "Estado": estado_actual,
+                            "FechaRadicacion": frad_ts,
+                            "FechaMovimiento": fecha_mov,
+                            "Observaciones": str(obs_val).strip(),
+                            "Mes": mes_nuevo,
+                            "Fecha factura": pd.to_datetime(safe_date(fecha_fact)) if fecha_fact else pd.NaT,
+                            "Documento": str(doc_val).strip() if doc_val is not None else "",
+                            "Paciente": str(pac_val).strip() if pac_val is not None else "",
+                            "No Radicado": str(no_radicado).strip() if no_radicado is not None else "",
+                            "Valor Factura": v_fact,
+                            "Valor Radicado": v_radic,
+                            "Version": version_reg,
+                        }
+
+                        # Solo la fila editada/nueva: el delta se calcula contra el snapshot
+                        ok, msg = guardar_inventario(pd.DataFrame([registro]), factura_verificar=registro["NumeroFactura"], origen="Gestión")
+                        if ok:
+                            tag = "(Supabase)" if msg=="OK_SUPABASE" else "(local)"
+                            flash_success(f"✅ Cambios guardados — Factura {registro['NumeroFactura']} {tag} · {resumen_guardado()}")
+                            vistas.pop(numero_activo, None)
+                            st.session_state["factura_activa"] = ""
+                            st.rerun()
+                        elif not conflictos_guardado().empty:
+                            st.rerun()
+                        else:
+                            st.error(f"❌ No pude confirmar el guardado: {msg}")
+                except Exception as e:
+                    st.error("❌ Ocurrió un error al guardar en Gestión.")
+                    st.exception(e)
+
+# ===== 📑 REPORTES =====
+@unidad_render("Reportes")
+def seccion_reportes():
+    """Reportes por EPS / Vigencia / Estado / movimientos."""
+    show_flash()
+    df_res = load_data(COLS_RESUMEN)
+    st.subheader("📑 Reportes")
+    if df_res.empty:
+        st.info("No hay datos para reportar.")
+    else:
+        tipo = st.selectbox("Elige el reporte", ["Por EPS", "Por Vigencia", "Por Estado", "Movimientos por período"],
+                            index=0, key="rep_tipo")
+
+        fmt_rep = st.radio("Formato de descarga", ["xlsx","csv"], horizontal=True, key="rep_fmt")
+
+        if tipo == "Por EPS":
+            tabla = tabla_reporte("EPS")
+            st.markdown("### 🏥 Tabla por EPS")
+            st.dataframe(tabla, use_container_width=True, key="tabla_por_eps")
+
+            c1, c2 = st.columns(2)
+            with c1:
+                st.plotly_chart(grafico("eps_funnel", fig_eps_funnel), use_container_width=True, key="rep_eps_funnel")
+            with c2:
+                fig_val = grafico("eps_valor_rep", lambda: fig_eps_valor("Valor radicado por EPS"))
+                st.plotly_chart(fig_val, use_container_width=True, key="rep_eps_val")
+
+            boton_descarga(f"⬇️ Descargar reporte EPS (.{fmt_rep})", "Por_EPS", key="dl_rep_eps", formato=fmt_rep)
+
+        elif tipo == "Por Vigencia":
+            tabla = tabla_reporte("Vigencia")
+            st.markdown("### 📆 Tabla por Vigencia")
+            st.dataframe(tabla, use_container_width=True, key="tabla_por_vigencia")
+
+            c1, c2 = st.columns(2)
+            with c1:
+                st.plotly_chart(grafico("vigencia_valor", fig_vigencia_valor), use_container_width=True, key="rep_vig_valfact")
+            with c2:
+                fig_vig_donut = grafico("vigencia_pie_rep", lambda: fig_vigencia_pie("Distribución de Cuentas por Vigencia", 0.45))
+                st.plotly_chart(fig_vig_donut, use_container_width=True, key="rep_vig_donut")
+
+            boton_descarga(f"⬇️ Descargar reporte Vigencia (.{fmt_rep})", "Por_Vigencia", key="dl_rep_vig", formato=fmt_rep)
+
+        elif tipo == "Movimientos por período":
+            periodo = st.radio("Período", ["Día","Semana","Mes"], horizontal=True, key="rep_mov_periodo")
+            flujo = flujo_movimientos(periodo)
+            st.markdown("### 🔁 Movimientos por período (bitácora)")
+            if flujo.empty:
+                st.info("La bitácora aún no tiene movimientos de estado.")
             else:
-                tabla = agg_estado(df)
-                st.markdown("### 🧩 Tabla por Estado")
-                st.dataframe(tabla, use_container_width=True, key="tabla_por_estado")
-
-                c1, c2 = st.columns(2)
-                with c1:
-                    fig_estado = px.pie(tabla, names="Estado", values="Cuentas",
-                                        hole=0.5, title="Distribución por Estado",
-                                        color="Estado", color_discrete_map=ESTADO_COLORES)
-                    fig_estado.update_traces(textposition="inside", textinfo="percent+value")
-                    st.plotly_chart(fig_estado, use_container_width=True, key="rep_estado_pie")
-                with c2:
-                    fig_bar = px.bar(tabla, x="Estado", y="Cuentas",
-                                     title="Cuentas por Estado", text_auto=True,
-                                     color="Estado", color_discrete_map=ESTADO_COLORES)
-                    st.plotly_chart(fig_bar, use_container_width=True, key="rep_estado_bar")
-
-                st.download_button("⬇️ Descargar reporte Estado (Excel)",
-                                   data=exportar_excel(tabla, "Por_Estado"),
-                                   file_name="reporte_por_estado.xlsx",
-                                   mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                   use_container_width=True, key="dl_rep_estado")
-
-    # ===== 📈 AVANCE =====
-    with tab_avance:
-        show_flash()
-        st.subheader("📈 Avance (Real vs Proyectado — Acumulado)")
-        base = pd.DataFrame({
-            "Mes": ["Agosto 2025","Septiembre 2025","Octubre 2025","Noviembre 2025"],
-            "Cuentas estimadas": [515, 1489, 1797, 1738],
-        })
-        base["Cuentas estimadas acumuladas"] = base["Cuentas estimadas"].cumsum()
-        total_meta = int(base["Cuentas estimadas"].sum())
-        base["% proyectado acumulado"] = (base["Cuentas estimadas acumuladas"]/total_meta*100).round(2) if total_meta else 0.0
-
-        def _etq_mes(row):
-            fr = row.get("FechaRadicacion")
-            if pd.notna(fr):
-                fr = pd.to_datetime(fr, errors="coerce")
-                if pd.notna(fr): return f"{MES_NOMBRE[int(fr.month)]} {int(fr.year)}"
-            m = str(row.get("Mes","")).strip()
-            if re.search(r"\b20\d{2}\b", m): return m
-            vig = str(row.get("Vigencia","")).strip()
-            if m and vig.isdigit(): return f"{m} {vig}"
-            return m or "Sin Mes"
-
-        df_v = df.copy()
-        if "EstadoCanon" not in df_v.columns and "Estado" in df_v.columns:
-            df_v["EstadoCanon"] = df_v["Estado"].astype(str).str.strip().str.lower().map({
-                "radicada":"Radicada","radicadas":"Radicada",
-                "pendiente":"Pendiente","auditada":"Auditada","subsanada":"Subsanada"
-            }).fillna(df_v["Estado"])
-
-        df_rad = df_v[df_v["EstadoCanon"]=="Radicada"].copy()
-        if df_rad.empty:
-            st.info("Aún no hay cuentas radicadas para comparar.")
+                tabla = flujo.pivot_table(index="Periodo", columns="Hacia", values="Movimientos",
+                                          aggfunc="sum", fill_value=0).reset_index()
+                st.dataframe(tabla, use_container_width=True, hide_index=True, key="tabla_movimientos")
+                fig_mov = px.bar(flujo, x="Periodo", y="Movimientos", color="Hacia",
+                                 title=f"Facturas movidas por {periodo.lower()} (estado destino)",
+                                 color_discrete_map=ESTADO_COLORES)
+                st.plotly_chart(fig_mov, use_container_width=True, key="rep_mov_bar")
+                boton_descarga(f"⬇️ Descargar movimientos por día (.{fmt_rep})", "Movimientos", key="dl_rep_mov", formato=fmt_rep)
+
         else:
-            df_rad["MesClave"] = df_rad.apply(_etq_mes, axis=1)
-            reales = df_rad.groupby("MesClave")["NumeroFactura"].nunique().reset_index(name="Cuentas reales")
-            comp = base.merge(reales, left_on="Mes", right_on="MesClave", how="left").drop(columns=["MesClave"]).fillna(0)
-            comp["Cuentas reales"] = comp["Cuentas reales"].astype(int)
-            comp["Cuentas reales acumuladas"] = comp["Cuentas reales"].cumsum()
-            comp["% real acumulado"] = (comp["Cuentas reales acumuladas"]/total_meta*100).round(2) if total_meta else 0.0
-            comp["Diferencia % (Real - Proy)"] = (comp["% real acumulado"] - base["% proyectado acumulado"]).round(2)
-
-            st.dataframe(comp, use_container_width=True, key="avance_tabla")
-
-            fig = go.Figure()
-            fig.add_trace(go.Scatter(x=base["Mes"], y=base["% proyectado acumulado"], mode='lines+markers', name='Proyectado'))
-            fig.add_trace(go.Scatter(x=comp["Mes"], y=comp["% real acumulado"], mode='lines+markers', name='Real'))
-            fig.update_layout(title="Avance acumulado (%) — Real vs Proyectado", yaxis_title="% acumulado", xaxis_title="Mes")
-            st.plotly_chart(fig, use_container_width=True, key="avance_lineas")
-
-            k1,k2,k3 = st.columns(3)
-            k1.metric("Meta total (cuentas)", f"{total_meta:,}")
-            k2.metric("Reales acumuladas", f"{int(comp['Cuentas reales'].sum()):,}")
-            k3.metric("Avance total vs meta", f"{(comp['Cuentas reales'].sum()/total_meta*100 if total_meta else 0):.1f}%")
+            tabla = tabla_reporte("Estado")
+            st.markdown("### 🧩 Tabla por Estado")
+            st.dataframe(tabla, use_container_width=True, key="tabla_por_estado")
+
+            c1, c2 = st.columns(2)
+            with c1:
+                st.plotly_chart(grafico("estado_pie", fig_estado_pie), use_container_width=True, key="rep_estado_pie")
+            with c2:
+                st.plotly_chart(grafico("estado_barras", fig_estado_barras), use_container_width=True, key="rep_estado_bar")
+
+            boton_descarga(f"⬇️ Descargar reporte Estado (.{fmt_rep})", "Por_Estado", key="dl_rep_estado", formato=fmt_rep)
+
+# ===== 📈 AVANCE =====
+@unidad_render("Avance")
+def seccion_avance():
+    """Real vs proyectado y ritmo de radicación."""
+    show_flash()
+    st.subheader("📈 Avance (Real vs Proyectado — Acumulado)")
+    metas = proyecciones()
+    eps_metas = sorted(e for e in metas["EPS"].unique() if e)
+    eps_sel = st.selectbox("EPS", ["Todas"] + eps_metas, key="avance_eps") if eps_metas else "Todas"
+    comp = avance_series(None if eps_sel == "Todas" else eps_sel)
+    total_meta = int(comp["Cuentas estimadas"].sum())
+
+    if comp.empty:
+        st.info("No hay metas de proyección cargadas.")
+    elif comp["Cuentas reales"].sum() == 0:
+        st.info("Aún no hay cuentas radicadas para comparar.")
+    else:
+        st.dataframe(comp.drop(columns=["Periodo"]), use_container_width=True, hide_index=True, key="avance_tabla")
+
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=comp["Mes"], y=comp["% proyectado acumulado"], mode='lines+markers', name='Proyectado'))
+        fig.add_trace(go.Scatter(x=comp["Mes"], y=comp["% real acumulado"], mode='lines+markers', name='Real'))
+        fig.update_layout(title="Avance acumulado (%) — Real vs Proyectado", yaxis_title="% acumulado", xaxis_title="Mes")
+        st.plotly_chart(fig, use_container_width=True, key="avance_lineas")
+
+        k1,k2,k3 = st.columns(3)
+        k1.metric("Meta total (cuentas)", f"{total_meta:,}")
+        k2.metric("Reales acumuladas", f"{int(comp['Cuentas reales'].sum()):,}")
+        k3.metric("Avance total vs meta", f"{(comp['Cuentas reales'].sum()/total_meta*100 if total_meta else 0):.1f}%")
+
+    with st.expander("🎯 Metas de proyección (por mes y EPS)"):
+        st.caption("Periodo en formato AAAA-MM; EPS vacía = meta total. Con metas por EPS y sin total, "
+                   "'Todas' suma las de cada EPS.")
+        vista = metas.assign(Periodo=metas["Periodo"].dt.strftime("%Y-%m"))
+        if st.session_state.get("rol") == "Administrador":
+            editadas = st.data_editor(vista, num_rows="dynamic", use_container_width=True,
+                                      hide_index=True, key="avance_metas_editor")
+            if st.button("💾 Guardar metas", key="btn_guardar_metas"):
+                ok, msg = guardar_proyecciones(editadas)
+                if ok:
+                    flash_success("✅ Metas de proyección guardadas.")
+                    st.rerun()
+                else:
+                    st.error(f"❌ {msg}")
+        else:
+            st.dataframe(vista, use_container_width=True, hide_index=True, key="avance_metas_tabla")
+
+    st.markdown("#### Ritmo de radicación (bitácora de movimientos)")
+    semanal = flujo_movimientos("Semana")
+    semanal = semanal[semanal["Hacia"] == "Radicada"]
+    if semanal.empty:
+        st.caption("La bitácora aún no registra movimientos a Radicada.")
+    else:
+        fig_ritmo = px.bar(semanal, x="Periodo", y="Movimientos", title="Facturas radicadas por semana",
+                           color_discrete_sequence=[ESTADO_COLORES["Radicada"]])
+        st.plotly_chart(fig_ritmo, use_container_width=True, key="avance_ritmo")
+        desde_4 = pd.Timestamp(datetime.now()).to_period("W").start_time - pd.Timedelta(weeks=3)
+        st.metric("Promedio semanal (últimas 4 semanas)",
+                  f"{semanal.loc[semanal['Periodo'] >= desde_4, 'Movimientos'].sum() / 4:,.1f}")
+
+
+# (etiqueta, sección) en el orden de las pestañas
+SECCIONES = [
+    ("📄 Tabla", seccion_tabla),
+    ("📋 Dashboard", seccion_dashboard),
+    ("🗂️ Bandejas", seccion_bandejas),
+    ("📝 Gestión", seccion_gestion),
+    ("📑 Reportes", seccion_reportes),
+    ("📈 Avance", seccion_avance),
+]
+
+def main_app():
+    t0 = time.perf_counter()
+    st.caption(f"🆔 Versión: {APP_VERSION}")
+    st.title("📊 AIPAD • Control de Radicación")
+    panel_metricas()
+    panel_usuarios()
+    if "usuario" in st.session_state and "rol" in st.session_state:
+        st.markdown(f"👤 Usuario: `{st.session_state['usuario']}`  |  🔐 Rol: `{st.session_state['rol']}`")
+
+    # Tabs: solo se ejecuta la abierta; cada sección es un fragmento
+    for (tab, abierta), (_, seccion) in zip(tabs_perezosas([e for e, _ in SECCIONES], "tab_principal"), SECCIONES):
+        if abierta:
+            with tab: seccion()
+    registrar_metrica("render", unidad="App", alcance="app", ms=round((time.perf_counter() - t0) * 1000, 1))
 
 # ====== Arranque ======
 if st.session_state.get("autenticado", False):
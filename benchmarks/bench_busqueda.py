@@ -0,0 +1,39 @@
+"""
+Índice de búsqueda contra los filtros que reemplazó (recorrer la columna en cada rerun):
+    contiene:  df["NumeroFactura"].astype(str).str.lower().str.contains(q)
+    exacto:    df["NumeroFactura"].astype(str).str.strip() == valor
+La construcción del índice se paga una vez por versión del inventario.
+Uso:  python benchmarks/bench_busqueda.py [filas ...]     (por defecto 10000 100000)
+"""
+import sys
+import time
+
+from comun import cargar_app, inventario_sintetico, medir
+
+
+def main(tamanos: list[int]):
+    app = cargar_app()
+    print(f"{'filas':>8} {'consulta':>24} {'antes':>9} {'índice':>9} {'x':>7}")
+    for n in tamanos:
+        assert app._write_local(app.normalize_dataframe(inventario_sintetico(app, n)))[0]
+        app.nueva_version_datos()
+        df = app.load_data(fresco=True)
+        t = time.perf_counter()
+        app.indice_busqueda()
+        print(f"{n:>8} {'(construir índice)':>24} {'':>9} {(time.perf_counter() - t)*1000:>7.1f}ms")
+        num = df["NumeroFactura"]
+        casos = [
+            ("contiene", "Paciente", "paciente 12", lambda: df[df["Paciente"].astype(str).str.lower().str.contains("paciente 12")]),
+            ("contiene", "NumeroFactura", "0012", lambda: df[num.astype(str).str.lower().str.contains("0012")]),
+            ("contiene", "NumeroFactura", "fe", lambda: df[num.astype(str).str.lower().str.contains("fe")]),
+            ("exacto", "NumeroFactura", f"FE{n // 2:07d}", lambda: df[num.astype(str).str.strip() == f"FE{n // 2:07d}"]),
+        ]
+        for tipo, campo, q, antes in casos:
+            buscar = app.buscar_contiene if tipo == "contiene" else app.buscar_exacto
+            t_antes = medir(antes)
+            t_idx = medir(lambda: df.loc[buscar(campo, q)])
+            print(f"{n:>8} {tipo + ' ' + repr(q):>24} {t_antes*1000:>7.1f}ms {t_idx*1000:>7.1f}ms {t_antes/t_idx:>7.1f}")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [10_000, 100_000])
@@ -0,0 +1,29 @@
+"""
+MesClave de Avance y del cubo: la versión por fila (df.apply(_etq_mes, axis=1), copiada de
+tests/test_mes_clave.py) contra mes_clave vectorizado, sobre un inventario normalizado.
+Uso:  python benchmarks/bench_mes_clave.py [filas ...]     (por defecto 10000 50000 200000)
+"""
+import os
+import sys
+
+import pandas as pd
+
+from comun import RAIZ, cargar_app, inventario_sintetico, medir
+
+sys.path.insert(0, os.path.join(RAIZ, "tests"))
+from test_mes_clave import _referencia  # noqa: E402
+
+
+def main(tamanos: list[int]):
+    app = cargar_app()
+    print(f"{'filas':>8} {'por fila':>10} {'vector':>9} {'x':>6}")
+    for n in tamanos:
+        df = app.normalize_dataframe(inventario_sintetico(app, n))
+        t_fila = medir(lambda: _referencia(app, df), 1)
+        t_vec = medir(lambda: app.mes_clave(df))
+        pd.testing.assert_series_equal(app.mes_clave(df), _referencia(app, df), check_dtype=False)
+        print(f"{n:>8} {t_fila*1000:>8.0f}ms {t_vec*1000:>7.1f}ms {t_fila/t_vec:>6.0f}")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [10_000, 50_000, 200_000])
@@ -0,0 +1,27 @@
+"""
+_parse_currency por fila (s.apply) contra _parse_currency_series, con valores "$ 1.234.567,89".
+Uso:  python benchmarks/bench_moneda.py [filas ...]     (por defecto 100000)
+"""
+import random
+import sys
+
+import pandas as pd
+
+from comun import cargar_app, medir
+
+
+def main(tamanos: list[int]):
+    app = cargar_app()
+    r = random.Random(0)
+    print(f"{'filas':>9} {'dtype':>6} {'por fila':>10} {'vector':>10} {'x':>6}")
+    for n in tamanos:
+        valores = [f"$ {r.randint(0, 10**9):,}".replace(",", ".") + ",00" for _ in range(n)]
+        for dtype in (object, "str"):
+            s = pd.Series(valores, dtype=dtype)
+            t_fila = medir(lambda: s.apply(app._parse_currency), 1)
+            t_vec = medir(lambda: app._parse_currency_series(s))
+            print(f"{n:>9} {str(s.dtype):>6} {t_fila*1000:>8.0f}ms {t_vec*1000:>8.0f}ms {t_fila/t_vec:>6.1f}")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [100_000])
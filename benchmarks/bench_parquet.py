@@ -0,0 +1,31 @@
+"""
+Almacén local: guardar / cargar el inventario en Parquet contra el xlsx anterior, con los mismos
+_escribir_local_atomico / _read_local que usa la app. "carga+normalizar" es un fallo de cache
+de load_data completo. El xlsx pasa por openpyxl: a 500k filas tarda varios minutos.
+Uso:  python benchmarks/bench_parquet.py [filas ...]     (por defecto 5000 50000; el commit usó 500000)
+"""
+import os
+import sys
+import tempfile
+
+from comun import cargar_app, inventario_sintetico, medir
+
+
+def main(tamanos: list[int]):
+    app = cargar_app()
+    carpeta = tempfile.mkdtemp(prefix="bench_store_")
+    print(f"{'filas':>8} {'formato':>8} {'guardar':>9} {'cargar':>9} {'carga+normalizar':>17} {'MB':>7}")
+    for n in tamanos:
+        df = inventario_sintetico(app, n)
+        for formato in ("parquet", "xlsx"):
+            ruta = os.path.join(carpeta, f"inventario_{n}.{formato}")
+            rep = 3 if formato == "parquet" else 1
+            t_guardar = medir(lambda: app._escribir_local_atomico(df, ruta), rep)
+            t_cargar = medir(lambda: app._read_local(ruta), rep)
+            t_total = medir(lambda: app.normalize_dataframe(app._read_local(ruta)), rep)
+            print(f"{n:>8} {formato:>8} {t_guardar:>8.2f}s {t_cargar:>8.2f}s {t_total:>16.2f}s "
+                  f"{os.path.getsize(ruta) / 1e6:>7.1f}", flush=True)
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [5_000, 50_000])
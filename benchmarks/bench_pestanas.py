@@ -0,0 +1,66 @@
+"""
+Latencia por interacción con streamlit.testing (AppTest): abre Bandejas y pulsa "Siguiente" en
+la bandeja Pendiente varias veces. AppTest siempre re-ejecuta el script completo, así que mide el
+rerun de app (solo la pestaña abierta); el rerun de un fragmento en el navegador es aún menor y
+sale en la métrica 'render' (alcance 'fragmento').
+Uso:  python benchmarks/bench_pestanas.py [filas] [--rev REV]
+      --rev mide otra versión de app_streamlit.py (p.ej. --rev b214f22~1, antes de los fragmentos)
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from streamlit.testing.v1 import AppTest
+
+from comun import RAIZ, cargar_app, inventario_sintetico
+
+
+def preparar(filas: int, rev: str | None) -> str:
+    carpeta = tempfile.mkdtemp(prefix="bench_ui_")
+    app = cargar_app(carpeta)
+    assert app._write_local(app.normalize_dataframe(inventario_sintetico(app, filas)))[0]
+    if os.path.exists(os.path.join(RAIZ, "usuarios.xlsx")):
+        shutil.copy(os.path.join(RAIZ, "usuarios.xlsx"), carpeta)
+    if rev:
+        src = subprocess.check_output(["git", "-C", RAIZ, "show", f"{rev}:app_streamlit.py"], text=True)
+        with open(os.path.join(carpeta, "app_streamlit.py"), "w", encoding="utf-8") as f:
+            f.write(src)
+    return os.path.join(carpeta, "app_streamlit.py")
+
+
+def main(filas: int, rev: str | None, clics: int):
+    at = AppTest.from_file(preparar(filas, rev), default_timeout=120)
+    at.session_state["autenticado"] = True
+    at.session_state["usuario"] = "bench"
+    at.session_state["rol"] = "Administrador"
+    at.session_state["tab_principal"] = "🗂️ Bandejas"
+    t = time.perf_counter()
+    at.run()
+    print(f"{rev or 'actual'}: {filas} filas, primera carga {time.perf_counter() - t:.2f}s")
+    assert not at.exception, [e.value for e in at.exception]
+    tiempos = []
+    for _ in range(clics):
+        siguiente = next(b for b in at.button if b.key and b.key.startswith("next_Pendiente"))
+        t = time.perf_counter()
+        siguiente.click().run()
+        tiempos.append(time.perf_counter() - t)
+        assert not at.exception, [e.value for e in at.exception]
+    print(f"'Siguiente' ida y vuelta (ms): {[round(x * 1000) for x in tiempos]}, "
+          f"mediana {statistics.median(tiempos[1:] or tiempos) * 1000:.0f}")
+    for d in at.sidebar.dataframe:
+        if "unidad" in d.value.columns:
+            print("métrica 'render' (ms, mediana por unidad y alcance):")
+            print(d.value.groupby(["unidad", "alcance"])["ms"].median().to_string())
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("filas", nargs="?", type=int, default=50_000)
+    p.add_argument("--rev", help="commit de app_streamlit.py a medir (por defecto el árbol actual)")
+    p.add_argument("--clics", type=int, default=6)
+    a = p.parse_args()
+    main(a.filas, a.rev, a.clics)
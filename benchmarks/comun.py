@@ -0,0 +1,65 @@
+"""
+Utilidades de los benchmarks: cargan la app como las pruebas (hasta "# ====== Arranque ======",
+sin pintar la UI) en un directorio temporal, para no tocar el almacén real.
+Se ejecutan desde la raíz del repo:  python benchmarks/bench_<tema>.py
+"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+import types
+
+import numpy as np
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(RAIZ, "app_streamlit.py")
+MARCA_ARRANQUE = "# ====== Arranque ======"
+
+
+def cargar_app(directorio: str | None = None) -> types.ModuleType:
+    logging.disable(logging.WARNING)  # avisos de Streamlit sin runtime
+    directorio = directorio or tempfile.mkdtemp(prefix="bench_")
+    destino = os.path.join(directorio, "app_streamlit.py")
+    shutil.copy(APP, destino)
+    with open(destino, encoding="utf-8") as f:
+        src = f.read()
+    mod = types.ModuleType("app_streamlit")
+    mod.__file__ = destino
+    exec(compile(src[:src.index(MARCA_ARRANQUE)], destino, "exec"), mod.__dict__)
+    return mod
+
+
+def medir(fn, repeticiones: int = 3) -> float:
+    """Mejor tiempo (s) de `repeticiones` llamadas."""
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        t = time.perf_counter()
+        fn()
+        mejor = min(mejor, time.perf_counter() - t)
+    return mejor
+
+
+def inventario_sintetico(app: types.ModuleType, n: int, semilla: int = 0):
+    """Inventario crudo de n facturas con la forma del real (sin normalizar)."""
+    r = np.random.default_rng(semilla)
+    fechas = pd.Timestamp("2024-01-01") + pd.to_timedelta(r.integers(0, 600, n), unit="D")
+    radicada = r.random(n) < 0.6
+    return pd.DataFrame({
+        "ID": [f"CHIA-{i:06d}" for i in range(n)],
+        "NumeroFactura": [f"FE{i:07d}" for i in range(n)],
+        "Valor Factura": r.uniform(1e4, 1e7, n).round(2),
+        "Valor Radicado": r.uniform(1e4, 1e7, n).round(2),
+        "Fecha factura": fechas,
+        "EPS": r.choice(["Sura", "Sanitas", "Nueva EPS", "Compensar"], n),
+        "Documento": r.integers(10**6, 10**9, n).astype(str),
+        "Paciente": [f"Paciente {i}" for i in r.integers(0, n, n)],
+        "Vigencia": r.choice([2023, 2024, 2025], n),
+        "Estado": r.choice(app.ESTADOS, n),
+        "FechaMovimiento": pd.Timestamp("2025-08-01") + pd.to_timedelta(r.integers(0, 90, n), unit="D"),
+        "FechaRadicacion": pd.Series(fechas + pd.to_timedelta(r.integers(0, 60, n), unit="D")).where(radicada),
+        "No Radicado": "",
+        "Mes": r.choice(list(app.MES_NOMBRE.values()) + [""], n),
+        "Observaciones": "ok",
+    })
@@ -0,0 +1,32 @@
+-- Agregaciones del Dashboard / Reportes calculadas en Postgres.
+-- La app llama:  select * from inventario_agregado('eps' | 'vigencia' | 'estado')
+-- y, si la función no existe, agrega en pandas (mismas columnas y resultados).
+
+create or replace function inventario_agregado(dim text)
+returns table (
+    clave                    text,
+    cuentas                  bigint,
+    valor_facturado          double precision,
+    valor_radicado           double precision,
+    radicadas                bigint,
+    cuentas_radicadas        bigint,
+    valor_radicado_radicadas double precision
+)
+language sql stable as $$
+    select
+        case dim when 'eps' then eps
+                 when 'estado' then estado
+                 else vigencia::text end                                         as clave,
+        count(numero_factura)                                                    as cuentas,
+        coalesce(sum(valor_factura), 0)::double precision                        as valor_facturado,
+        coalesce(sum(valor_radicado), 0)::double precision                       as valor_radicado,
+        sum(case when estado = 'Radicada' then 1 else 0 end)                     as radicadas,
+        sum(case when lower(trim(estado)) in ('radicada','radicadas')
+                 then 1 else 0 end)                                              as cuentas_radicadas,
+        coalesce(sum(case when lower(trim(estado)) in ('radicada','radicadas')
+                          then valor_radicado end), 0)::double precision         as valor_radicado_radicadas
+    from inventario
+    group by 1
+$$;
+
+grant execute on function inventario_agregado(text) to anon, authenticated;
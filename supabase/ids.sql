@@ -0,0 +1,61 @@
+-- Asignación de IDs (CHIA-NNNN) sin choques entre usuarios ni escaneo del inventario.
+-- La app llama con la service_key (secrets supabase.service_key, solo en el servidor):
+--   select reservar_ids(n)        -- primer número del rango reservado [primero, primero + n - 1]
+--   select adelantar_ids(minimo)  -- solo la importación: el contador pasa a los IDs que trae el archivo
+-- Sin la función o sin service_key usa un contador local con lock (solo seguro con un único servidor).
+-- Un reintento tras un timeout puede dejar un hueco en la numeración, nunca un ID repetido.
+-- Ninguna de las dos se puede llamar con la anon_key (pública): cualquiera podría agotar o
+-- adelantar la numeración para siempre.
+
+create table if not exists id_contador (
+    nombre text primary key,
+    ultimo bigint not null
+);
+
+-- Arranca en el mayor sufijo numérico que ya existe en el inventario
+insert into id_contador (nombre, ultimo)
+select 'inventario', coalesce(max((substring(id from '(\d+)$'))::bigint), 0) from inventario
+on conflict (nombre) do nothing;
+
+-- Versión anterior: reservar_ids(n, minimo) abierta a anon
+drop function if exists reservar_ids(integer, bigint);
+
+-- n entre 1 y 5000 (un lote de importación, IMPORT_LOTE en la app)
+create or replace function reservar_ids(n integer default 1)
+returns bigint
+language plpgsql volatile security definer set search_path = public as $$
+declare
+    hasta bigint;
+begin
+    if n is null or n < 1 or n > 5000 then raise exception 'n debe estar entre 1 y 5000'; end if;
+    -- UPDATE sobre una sola fila: las reservas concurrentes se serializan por el lock de la fila
+    insert into id_contador as c (nombre, ultimo) values ('inventario', n)
+    on conflict (nombre) do update set ultimo = c.ultimo + n
+    returning c.ultimo into hasta;
+    return hasta - n + 1;
+end;
+$$;
+
+-- Adelanta el contador a `minimo` (nunca lo retrocede); devuelve el último ID entregado
+create or replace function adelantar_ids(minimo bigint)
+returns bigint
+language plpgsql volatile security definer set search_path = public as $$
+declare
+    ultimo_ bigint;
+begin
+    if minimo is null or minimo < 0 then raise exception 'minimo debe ser >= 0'; end if;
+    insert into id_contador as c (nombre, ultimo) values ('inventario', minimo)
+    on conflict (nombre) do update set ultimo = greatest(c.ultimo, minimo)
+    returning c.ultimo into ultimo_;
+    return ultimo_;
+end;
+$$;
+
+-- Sin políticas: la tabla solo se toca a través de las funciones. Postgres da EXECUTE a public
+-- por defecto: se quita y se concede solo a quien corresponde.
+alter table id_contador enable row level security;
+revoke all on id_contador from anon, authenticated;
+revoke all on function reservar_ids(integer) from public, anon;
+grant execute on function reservar_ids(integer) to authenticated, service_role;
+revoke all on function adelantar_ids(bigint) from public, anon, authenticated;
+grant execute on function adelantar_ids(bigint) to service_role;
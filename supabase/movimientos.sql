@@ -0,0 +1,34 @@
+-- Bitácora de movimientos de estado (solo se agrega). Activar con secrets:
+--   [supabase] movimientos_tabla = "movimientos"
+--              service_key       = "<service_role key>"   -- solo en el servidor
+-- La app escribe y lee con la service_key: con la anon_key (pública) cualquiera podría falsear
+-- la auditoría o leerla entera.
+-- 'id' lo genera la app (un reintento no duplica); 'n' ordena la lectura incremental.
+
+create table if not exists movimientos (
+    n              bigint generated always as identity primary key,
+    id             text not null unique,
+    ts             timestamptz not null,
+    factura        text not null,
+    desde          text,
+    hacia          text not null,
+    usuario        text,
+    origen         text,
+    eps            text,
+    vigencia       numeric,
+    valor_factura  numeric,
+    valor_radicado numeric
+);
+
+create index if not exists movimientos_ts on movimientos (ts);
+create index if not exists movimientos_factura on movimientos (factura);
+
+-- Solo INSERT y SELECT, y solo para authenticated (service_role ignora RLS); anon no tiene acceso.
+-- Sin políticas de UPDATE/DELETE la bitácora no se reescribe.
+alter table movimientos enable row level security;
+drop policy if exists "leer movimientos" on movimientos;
+drop policy if exists "agregar movimientos" on movimientos;
+create policy "leer movimientos" on movimientos for select to authenticated using (true);
+create policy "agregar movimientos" on movimientos for insert to authenticated with check (true);
+revoke all on movimientos from anon;
+revoke update, delete, truncate on movimientos from authenticated;
@@ -0,0 +1,18 @@
+-- Metas de Avance por mes y EPS (opcional). Activar con secrets:
+--   [supabase] proyecciones_tabla = "proyecciones"
+--              service_key        = "<service_role key>"   -- para que el administrador las edite
+-- periodo 'AAAA-MM'; eps vacío = meta total del mes.
+
+create table if not exists proyecciones (
+    periodo text   not null,
+    eps     text   not null default '',
+    cuentas bigint not null,
+    primary key (periodo, eps)
+);
+
+alter table proyecciones enable row level security;
+-- Lectura pública (Avance); escritura solo service_role (la app la usa con la service_key,
+-- desde el editor del administrador). service_role ignora RLS.
+create policy "leer metas" on proyecciones for select using (true);
+drop policy if exists "editar metas" on proyecciones;
+revoke insert, update, delete, truncate on proyecciones from anon, authenticated;
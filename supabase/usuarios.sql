@@ -0,0 +1,18 @@
+-- Usuarios del login (opcional). Activar con secrets:
+--   [supabase] usuarios_tabla = "usuarios"
+--              service_key    = "<service_role key>"   -- solo en el servidor, nunca en el navegador
+-- contrasena_hash usa el formato de la app: pbkdf2_sha256$iteraciones$sal_b64$hash_b64
+-- (se puede generar con hash_contrasena() o con "Migrar contraseñas a hash" y copiar la columna).
+-- La app verifica la contraseña en el servidor; la tabla la lee con la service_key.
+
+create table if not exists usuarios (
+    cedula          text primary key,
+    contrasena_hash text not null,
+    rol             text not null default 'Usuario'
+);
+
+-- RLS sin políticas y sin permisos para anon / authenticated: con la anon_key (pública) no se
+-- puede leer ningún hash. service_role ignora RLS.
+alter table usuarios enable row level security;
+drop policy if exists "lectura login" on usuarios;
+revoke all on usuarios from anon, authenticated;
@@ -0,0 +1,71 @@
+-- Control optimista de concurrencia: cada fila del inventario lleva su versión.
+-- La app solo escribe las filas que siguen en la versión que vio el usuario (el resto se le
+-- muestra como conflicto). Guardar usa guardar_con_version (abajo); los movimientos en lote,
+-- UPDATE ... WHERE version = v. Ambos son atómicos por fila: dos guardados a la vez no se pisan.
+
+alter table inventario add column if not exists version bigint not null default 0;
+
+-- Cualquier UPDATE hecho fuera de la app (SQL, panel de Supabase) también sube la versión,
+-- para que la app lo detecte como cambio ajeno.
+create or replace function inventario_subir_version() returns trigger
+language plpgsql as $$
+begin
+    if new.version is not distinct from old.version then
+        new.version := coalesce(old.version, 0) + 1;
+    end if;
+    return new;
+end;
+$$;
+
+drop trigger if exists inventario_version on inventario;
+create trigger inventario_version before update on inventario
+    for each row execute function inventario_subir_version();
+
+-- Guardado con compare-and-set en una sola llamada. Cada elemento de `filas` trae columnas de
+-- inventario con version = la que vio el usuario + 1: se actualiza solo si la vigente sigue siendo
+-- esa (o se inserta si era nueva y nadie la creó). Cada {numero_factura, version} de `borrar` se
+-- elimina solo si sigue en esa versión. Devuelve las claves escritas o eliminadas; la app relee
+-- la versión de las demás y las muestra como conflicto. Sin esta función la app hace lo mismo
+-- fila a fila con UPDATE ... WHERE version = v.
+create or replace function guardar_con_version(filas jsonb default '[]', borrar jsonb default '[]')
+returns setof text
+language plpgsql volatile set search_path = public as $$
+declare
+    fila jsonb;
+    clave text;
+    esperada bigint;
+    cols text;
+    sel text;
+    n integer;
+begin
+    for fila in select * from jsonb_array_elements(filas) loop
+        clave := fila->>'numero_factura';
+        esperada := coalesce((fila->>'version')::bigint, 1) - 1;
+        select string_agg(quote_ident(c.column_name), ', '), string_agg('r.' || quote_ident(c.column_name), ', ')
+          into cols, sel
+          from information_schema.columns c
+         where c.table_schema = 'public' and c.table_name = 'inventario' and fila ? c.column_name;
+        -- version viene distinta de la vigente: el trigger no la vuelve a subir
+        execute format('update inventario set (%s) = (select %s from jsonb_populate_record(null::inventario, $1) r) '
+                       'where numero_factura = $2 and coalesce(version, 0) = $3', cols, sel)
+            using fila, clave, esperada;
+        get diagnostics n = row_count;
+        if n = 0 and esperada = 0 then
+            execute format('insert into inventario (%s) select %s from jsonb_populate_record(null::inventario, $1) r '
+                           'on conflict (numero_factura) do nothing', cols, sel)
+                using fila;
+            get diagnostics n = row_count;
+        end if;
+        if n > 0 then return next clave; end if;
+    end loop;
+    for fila in select * from jsonb_array_elements(borrar) loop
+        clave := fila->>'numero_factura';
+        delete from inventario
+         where numero_factura = clave and coalesce(version, 0) = coalesce((fila->>'version')::bigint, 0);
+        get diagnostics n = row_count;
+        if n > 0 then return next clave; end if;
+    end loop;
+end;
+$$;
+
+grant execute on function guardar_con_version(jsonb, jsonb) to anon, authenticated;
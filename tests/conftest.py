@@ -0,0 +1,52 @@
+"""
+La app es un único script de Streamlit: se ejecuta hasta "# ====== Arranque ======" (sin pintar
+la UI) en un directorio temporal, así cada prueba tiene su propio almacén local.
+"""
+import logging
+import os
+import shutil
+import types
+
+import pytest
+import streamlit as st
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(RAIZ, "app_streamlit.py")
+MARCA_ARRANQUE = "# ====== Arranque ======"
+
+
+def cargar_app(directorio: str) -> types.ModuleType:
+    destino = os.path.join(str(directorio), "app_streamlit.py")
+    shutil.copy(APP, destino)
+    with open(destino, encoding="utf-8") as f:
+        src = f.read()
+    mod = types.ModuleType("app_streamlit")
+    mod.__file__ = destino
+    exec(compile(src[:src.index(MARCA_ARRANQUE)], destino, "exec"), mod.__dict__)
+    return mod
+
+
+@pytest.fixture
+def app(tmp_path):
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    yield cargar_app(tmp_path)
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+
+@pytest.fixture
+def inventario(app):
+    """Almacén local con tres facturas (dos con ID)."""
+    df = app.normalize_dataframe(app.pd.DataFrame({
+        "ID": ["CHIA-0001", "CHIA-0007", None],
+        "NumeroFactura": ["FAC001", "FAC002", "FAC003"],
+        "EPS": ["EPS A", "EPS B", "EPS A"],
+        "Vigencia": ["2024", "2024", "2025"],
+        "Estado": ["Radicada", "Pendiente", "Auditada"],
+        "Valor Factura": [1000, 2500, 300],
+    }))
+    ok, msg = app._write_local(df)
+    assert ok, msg
+    return df
@@ -0,0 +1,244 @@
+"""
+Cliente Supabase en memoria con lo que usa la app (select / filtros / update / upsert / delete /
+rpc). Las tablas son listas de dicts; las funciones RPC se registran en `funciones`.
+"""
+import types
+
+
+class Respuesta:
+    def __init__(self, data, count=None):
+        self.data, self.count = data, count
+
+
+class ErrorPostgrest(Exception):
+    def __init__(self, mensaje, code="PGRST202"):
+        super().__init__(mensaje)
+        self.code = code
+
+
+def _orden(v):
+    """Números como números (n > 9 no es '10' < '9'); el resto como texto."""
+    if isinstance(v, (int, float)) and not isinstance(v, bool): return (0, v, "")
+    return (1, 0, str(v))
+
+
+class Consulta:
+    def __init__(self, cliente, tabla):
+        self.cliente, self.tabla = cliente, tabla
+        self.filtros, self.op, self.datos, self.cols, self.lim, self.contar = [], "select", None, None, None, False
+        self.opciones = {}
+
+    # --- lectura
+    def select(self, cols="*", count=None):
+        self.cols = None if cols == "*" else [c.strip() for c in cols.split(",")]
+        self.contar = bool(count)
+        return self
+
+    def order(self, col, desc=False):
+        self.orden = (col, desc)
+        return self
+
+    def limit(self, n):
+        self.lim = n
+        return self
+
+    # --- filtros
+    def eq(self, c, v):
+        self.filtros.append(lambda r: r.get(c) == v)
+        return self
+
+    def gt(self, c, v):
+        self.filtros.append(lambda r: r.get(c) is not None and _orden(r[c]) > _orden(v))
+        return self
+
+    def gte(self, c, v):
+        self.filtros.append(lambda r: r.get(c) is not None and _orden(r[c]) >= _orden(v))
+        return self
+
+    def in_(self, c, valores):
+        valores = set(valores)
+        self.filtros.append(lambda r: r.get(c) in valores)
+        return self
+
+    def or_(self, expr):
+        conds = [p.split(".", 2) for p in expr.split(",")]
+        self.filtros.append(lambda r: any(r.get(c) is None if op == "is" else str(r.get(c)) == v
+                                          for c, op, v in conds))
+        return self
+
+    # --- escritura
+    def update(self, valores):
+        self.op, self.datos = "update", valores
+        return self
+
+    def upsert(self, registros, on_conflict="", ignore_duplicates=False, **_):
+        self.op, self.datos = "upsert", registros if isinstance(registros, list) else [registros]
+        self.opciones = {"pk": on_conflict, "ignorar": ignore_duplicates}
+        return self
+
+    def insert(self, registros):
+        self.op, self.datos = "insert", registros if isinstance(registros, list) else [registros]
+        return self
+
+    def delete(self):
+        self.op = "delete"
+        return self
+
+    def execute(self):
+        cl, llamada = self.cliente, (self.tabla, self.op)
+        cl.fallar(llamada, "antes")
+        res = self._ejecutar()
+        cl.fallar(llamada, "despues")
+        cl.despues_de_llamada()
+        return res
+
+    def _ejecutar(self):
+        cl = self.cliente
+        cl.llamadas.append((self.tabla, self.op))
+        if self.tabla in cl.denegadas or (self.tabla, self.op) in cl.denegadas:
+            raise ErrorPostgrest(f"permiso denegado para {self.tabla}", code="42501")
+        filas = cl.tablas.setdefault(self.tabla, [])
+        pk = cl.pks.get(self.tabla, "numero_factura")
+        match = [r for r in sorted(filas, key=lambda r: _orden(r.get(pk))) if all(f(r) for f in self.filtros)]
+        if self.op == "select":
+            if getattr(self, "orden", None):
+                match.sort(key=lambda r: _orden(r.get(self.orden[0])), reverse=self.orden[1])
+            out = match[:self.lim] if self.lim else match
+            if self.cols: out = [{c: r.get(c) for c in self.cols} for r in out]
+            return Respuesta([dict(r) for r in out], len(match) if self.contar else None)
+        if self.op == "update":
+            for r in match:
+                nueva = self.datos.get("version", r.get("version"))
+                r.update(self.datos)
+                if "version" in r and nueva == r.get("version") and "version" not in self.datos:
+                    r["version"] = (r.get("version") or 0) + 1   # trigger inventario_subir_version
+            return Respuesta([dict(r) for r in match])
+        if self.op in ("upsert", "insert"):
+            cols = (self.opciones.get("pk") or pk).split(",")
+            clave = lambda r: tuple(r.get(c) for c in cols)
+            por_clave = {clave(r): r for r in filas}
+            hechas = []
+            for reg in self.datos:
+                actual = por_clave.get(clave(reg))
+                if actual is None:
+                    por_clave[clave(reg)] = fila = dict(reg)
+                    ident = cl.identidades.get(self.tabla)   # generated always as identity
+                    if ident: fila[ident] = max((r[ident] for r in filas), default=0) + 1
+                    filas.append(fila)
+                    hechas.append(dict(fila))
+                elif not self.opciones.get("ignorar"):
+                    actual.update(reg)
+                    hechas.append(dict(actual))
+            return Respuesta(hechas)
+        if self.op == "delete":
+            ids = {id(r) for r in match}
+            cl.tablas[self.tabla] = [r for r in filas if id(r) not in ids]
+            return Respuesta([dict(r) for r in match])
+        raise AssertionError(self.op)
+
+
+class Llamada:
+    def __init__(self, cliente, nombre, params):
+        self.cliente, self.nombre, self.params = cliente, nombre, params
+
+    def execute(self):
+        self.cliente.fallar(("rpc", self.nombre), "antes")
+        self.cliente.llamadas.append(("rpc", self.nombre))
+        if self.nombre in self.cliente.denegadas:
+            raise ErrorPostgrest(f"permiso denegado para la función {self.nombre}", code="42501")
+        f = self.cliente.funciones.get(self.nombre)
+        if f is None:
+            raise ErrorPostgrest(f"Could not find the function public.{self.nombre}")
+        res = Respuesta(f(self.cliente, **self.params))
+        self.cliente.fallar(("rpc", self.nombre), "despues")
+        self.cliente.despues_de_llamada()
+        return res
+
+
+class Cliente:
+    def __init__(self, tablas=None, rol="anon"):
+        self.tablas = tablas if tablas is not None else {}
+        self.pks = {"inventario": "numero_factura", "movimientos": "id"}
+        self.identidades = {"movimientos": "n"}
+        self.funciones, self.llamadas, self.rol = {}, [], rol
+        self.denegadas = set()   # tablas o (tabla, operación) sin permiso para este rol
+        self.intercalar = []   # acciones de "otro usuario" que corren tras las próximas llamadas
+        # timeouts simulados: (llamada, momento); "antes" no llega al servidor, "despues" sí se aplicó
+        self.fallos = []
+
+    def fallar(self, llamada, momento):
+        for i, f in enumerate(self.fallos):
+            if f == (llamada, momento):
+                del self.fallos[i]
+                raise TimeoutError(f"timeout simulado ({llamada}, {momento})")
+
+    def despues_de_llamada(self):
+        if self.intercalar: self.intercalar.pop(0)(self)
+
+    def table(self, nombre):
+        return Consulta(self, nombre)
+
+    def rpc(self, nombre, params=None):
+        return Llamada(self, nombre, params or {})
+
+
+def guardar_con_version(cliente, filas=(), borrar=()):
+    """Misma semántica que la función de supabase/version.sql."""
+    inv = cliente.tablas.setdefault("inventario", [])
+    hechas = []
+    for fila in filas:
+        esperada = (fila.get("version") or 1) - 1
+        actual = next((r for r in inv if r["numero_factura"] == fila["numero_factura"]), None)
+        if actual is not None and (actual.get("version") or 0) == esperada:
+            actual.update(fila)
+        elif actual is None and esperada == 0:
+            inv.append(dict(fila))
+        else:
+            continue
+        hechas.append(fila["numero_factura"])
+    for b in borrar:
+        actual = next((r for r in inv if r["numero_factura"] == b["numero_factura"]), None)
+        if actual is not None and (actual.get("version") or 0) == (b.get("version") or 0):
+            inv.remove(actual)
+            hechas.append(b["numero_factura"])
+    return hechas
+
+
+def _contador(cliente) -> dict:
+    filas = cliente.tablas.setdefault("id_contador", [])
+    if not filas: filas.append({"nombre": "inventario", "ultimo": 0})
+    return filas[0]
+
+
+def reservar_ids(cliente, n=1):
+    """Misma semántica que la función de supabase/ids.sql."""
+    if n is None or n < 1 or n > 5000:
+        raise ErrorPostgrest("n debe estar entre 1 y 5000", code="P0001")
+    c = _contador(cliente)
+    c["ultimo"] += n
+    return c["ultimo"] - n + 1
+
+
+def adelantar_ids(cliente, minimo):
+    """Misma semántica que la función de supabase/ids.sql."""
+    if minimo is None or minimo < 0:
+        raise ErrorPostgrest("minimo debe ser >= 0", code="P0001")
+    c = _contador(cliente)
+    c["ultimo"] = max(c["ultimo"], minimo)
+    return c["ultimo"]
+
+
+def secretos(**extra) -> dict:
+    return {"supabase": {"url": "https://prueba.supabase.co", "anon_key": "anon", "backoff_s": 0, **extra}}
+
+
+def conectar(app, monkeypatch, cliente, **extra):
+    """La app usa `cliente` (o, por clave, el de `clientes`) con secrets de prueba."""
+    import streamlit as st
+    proxy = types.SimpleNamespace(**{k: getattr(st, k) for k in dir(st) if not k.startswith("__")})
+    proxy.secrets = secretos(**extra)
+    monkeypatch.setattr(app, "st", proxy)
+    monkeypatch.setattr(app, "ClientOptions", None)
+    clientes = cliente if isinstance(cliente, dict) else None
+    monkeypatch.setattr(app, "create_client", lambda url, key, options=None: clientes[key] if clientes else cliente)
+    return proxy
@@ -0,0 +1,51 @@
+"""
+agregado (pandas sobre df y re-agrupando el cubo) frente a agregado_sqlite (el mismo SQL que la
+RPC de Postgres): mismas filas, tipos y orden para cada dimensión de AGG_DIMENSIONES.
+"""
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ESTADOS = ["Radicada", "radicada ", "RADICADAS", "Pendiente", "pendientes", "Auditada", "Subsanada",
+           "Otro", None]
+EPS = ["EPS A", "EPS B", "Nueva EPS", " eps a", None]
+VIGENCIAS = [2023, "2024", 2025.0, "", None, "n/a"]
+
+
+def _inventario(app, semilla: int, n: int = 1500) -> pd.DataFrame:
+    r = random.Random(semilla)
+    valor = lambda: r.choice([None, 0, round(r.uniform(1, 1e7), 2), "$ 1.234,56", "x"])
+    df = pd.DataFrame({
+        "NumeroFactura": [f"F{i}" if r.random() > 0.05 else None for i in range(n)],
+        "EPS": [r.choice(EPS) for _ in range(n)],
+        "Vigencia": [r.choice(VIGENCIAS) for _ in range(n)],
+        "Estado": [r.choice(ESTADOS) for _ in range(n)],
+        "Valor Factura": [valor() for _ in range(n)],
+        "Valor Radicado": [valor() for _ in range(n)],
+    })
+    assert app._write_local(app.normalize_dataframe(df))[0]
+    app.nueva_version_datos()
+    return app.load_data(fresco=True)
+
+
+@pytest.mark.parametrize("semilla", [1, 2])
+@pytest.mark.parametrize("dim", ["EPS", "Vigencia", "Estado"])
+def test_pandas_cubo_y_sqlite_coinciden(app, semilla, dim):
+    assert dim in app.AGG_DIMENSIONES
+    df = _inventario(app, semilla)
+    sql = app.agregado_sqlite(df, dim)
+    assert len(sql) > 1
+    pd.testing.assert_frame_equal(app.agregado(dim, df), sql)
+    pd.testing.assert_frame_equal(app.agregado(dim), sql)
+
+
+@pytest.mark.parametrize("dim", ["EPS", "Vigencia", "Estado"])
+def test_inventario_vacio(app, dim):
+    df = app.normalize_dataframe(pd.DataFrame({"NumeroFactura": pd.Series([], dtype=object)}))
+    for c in ["EPS", "Vigencia", "Estado", "Valor Factura", "Valor Radicado"]:
+        if c not in df.columns: df[c] = np.nan
+    sql = app.agregado_sqlite(df, dim)
+    assert sql.empty
+    pd.testing.assert_frame_equal(app.agregado(dim, df), sql)
@@ -0,0 +1,82 @@
+"""
+Motor de bandejas (particiones por estado ya ordenadas + máscaras) frente al filtro y la
+paginación por pandas que reemplazó: mismas filas y en el mismo orden.
+"""
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def _filtrar(df_, estado, eps, vig, hits):
+    """Referencia: el _filtrar anterior de la pestaña Bandejas, con su sort_values."""
+    sub = df_[df_["Estado"]==estado]
+    if eps and eps!="Todos": sub = sub[sub["EPS"].astype(str)==eps]
+    if vig and vig!="Todos": sub = sub[sub["Vigencia"].astype(str)==str(vig)]
+    if hits is not None:
+        sub = sub[sub.index.isin(hits)]
+    return sub.sort_values(by=["FechaMovimiento","NumeroFactura"], ascending=[False, True])
+
+
+def _paginar(df_, page, per_page_):
+    total = len(df_); total_pages = max((total-1)//per_page_+1,1)
+    page = max(1, min(page, total_pages)); a=(page-1)*per_page_; b=a+per_page_
+    return df_.iloc[a:b], total_pages, page
+
+
+def _inventario(app, semilla: int, n: int = 800) -> pd.DataFrame:
+    r = random.Random(semilla)
+    fechas = [pd.Timestamp("2025-08-01") + pd.Timedelta(hours=r.randint(0, 24 * 20)) for _ in range(30)]
+    def factura(i):
+        k = r.random()
+        if k < 0.05: return None
+        if k < 0.1: return f"FAC{r.randint(0, 50):03d}"       # repetidas
+        return f"FAC{i:04d}"
+    df = pd.DataFrame({
+        "NumeroFactura": [factura(i) for i in range(n)],
+        "EPS": [r.choice(["EPS A", "EPS B", "Nueva EPS", None]) for _ in range(n)],
+        "Vigencia": [r.choice([2023, "2024", 2025, None]) for _ in range(n)],
+        "Estado": [r.choice(app.ESTADOS) for _ in range(n)],
+        "FechaMovimiento": [r.choice(fechas + [None]) for _ in range(n)],
+    })
+    assert app._write_local(app.normalize_dataframe(df))[0]
+    app.nueva_version_datos()
+    return app.load_data(fresco=True)
+
+
+@pytest.mark.parametrize("semilla", [1, 2])
+def test_filas_iguales_al_filtro_anterior(app, semilla):
+    df = _inventario(app, semilla)
+    assert df["FechaMovimiento"].isna().any() and df["NumeroFactura"].isna().any()
+    busquedas = [None, np.array([], dtype=np.int64)] + [app.buscar_contiene("NumeroFactura", q)
+                                                         for q in ["fac0", "00", "1", "zzz"]]
+    for estado in app.ESTADOS:
+        for eps in [None, "Todos", "EPS A", "Nueva EPS", "No existe"]:
+            for vig in [None, "Todos", "2024", "2025", "1999"]:
+                for hits in busquedas:
+                    esperado = _filtrar(df, estado, eps, vig, hits).index.tolist()
+                    obtenido = app.filas_bandeja(estado, eps, vig, hits).tolist()
+                    assert obtenido == esperado, (estado, eps, vig)
+
+
+def test_paginas_iguales_a_la_paginacion_anterior(app):
+    df = _inventario(app, 3)
+    hits = app.buscar_contiene("NumeroFactura", "fac")
+    for estado in app.ESTADOS:
+        for eps, vig, h in [(None, None, None), ("EPS B", None, None), (None, "2023", hits)]:
+            sub = _filtrar(df, estado, eps, vig, h)
+            for per_page in [7, 50]:
+                for page in [0, 1, 2, 3, 99]:
+                    esperado, paginas, actual = _paginar(sub, page, per_page)
+                    etiquetas, total, total_pages, pagina = app.pagina_bandeja(estado, eps, vig, h, page, per_page)
+                    assert etiquetas.tolist() == esperado.index.tolist()
+                    assert (total, total_pages, pagina) == (len(sub), paginas, actual)
+
+
+def test_opciones_de_filtro(app):
+    df = _inventario(app, 4)
+    motor = app.motor_bandejas()
+    assert motor["eps_opciones"] == sorted(e for e in df["EPS"].dropna().astype(str).unique().tolist() if e)
+    vig = pd.to_numeric(df["Vigencia"], errors="coerce").dropna().unique().tolist()
+    assert motor["vig_opciones"] == sorted(str(int(v)) for v in vig)
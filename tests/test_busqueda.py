@@ -0,0 +1,85 @@
+"""
+Índice de búsqueda (buscar_exacto / buscar_contiene) frente a los filtros que reemplazó:
+    Gestión:   df["NumeroFactura"].astype(str).str.strip() == str(valor).strip()
+    Bandejas:  df["NumeroFactura"].astype(str).str.lower().str.contains(q)
+Diferencias deliberadas: la consulta es texto literal (no regex) y un valor faltante no
+coincide como 'nan'. Por eso la referencia usa regex=False y descarta los faltantes.
+"""
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+LETRAS = "abcAB01 -ñÑáÉ"
+NOMBRES = ["Ana", "ANDRÉS", "José", "María", "Ñeco", "Luz", "Pérez", "Gómez", "de la Cruz"]
+
+
+def _inventario(app, r: random.Random, n: int) -> pd.DataFrame:
+    def factura():
+        k = r.random()
+        if k < 0.1: return None
+        if k < 0.15: return "".join(r.choice(LETRAS) for _ in range(r.randint(60, 90)))  # fuera de los n-gramas
+        return r.choice(["FAC", "fac", "FE-", " Fv"]) + str(r.randint(0, 5000)) + r.choice(["", " ", "a"])
+    df = pd.DataFrame({
+        "NumeroFactura": [factura() for _ in range(n)],
+        "Documento": [str(r.randint(10**5, 10**6)) if r.random() > 0.1 else None for _ in range(n)],
+        "Paciente": [" ".join(r.sample(NOMBRES, r.randint(1, 3))) for _ in range(n)],
+        "Estado": [r.choice(["Radicada", "Pendiente"]) for _ in range(n)],
+    })
+    assert app._write_local(app.normalize_dataframe(df))[0]
+    app.nueva_version_datos()
+    return app.load_data(fresco=True)
+
+
+def _consultas(r: random.Random, df: pd.DataFrame, campo: str) -> list[str]:
+    valores = [str(v) for v in df[campo].dropna() if str(v).strip()]
+    qs = ["", "   ", "a", "1", "fa", "ñ", "É", "de la", "zzzz", "FAC1", "fac 1", ".", "a.c"]
+    for _ in range(40):
+        v = r.choice(valores)
+        i = r.randrange(len(v))
+        q = v[i:i + r.randint(1, 8)]
+        qs.append(r.choice([q, q.upper(), q.lower(), f"  {q} "]))
+    qs += ["".join(r.choice(LETRAS) for _ in range(r.randint(1, 5))) for _ in range(20)]
+    return qs
+
+
+def _contiene_antes(df: pd.DataFrame, campo: str, q: str) -> set:
+    qn = q.strip().lower()
+    if not qn: return set(df.index)
+    col = df[campo]
+    m = col.notna() & col.astype(str).str.lower().str.contains(qn, regex=False)
+    return set(df.index[m.to_numpy(dtype=bool)])
+
+
+def _exacto_antes(df: pd.DataFrame, campo: str, valor: str) -> set:
+    col = df[campo]
+    m = col.notna() & (col.astype(str).str.strip() == str(valor).strip())
+    return set(df.index[m.to_numpy(dtype=bool)])
+
+
+@pytest.mark.parametrize("semilla", [1, 2])
+@pytest.mark.parametrize("campo", ["NumeroFactura", "Documento", "Paciente"])
+def test_contiene_igual_al_filtro_anterior(app, semilla, campo):
+    r = random.Random(semilla)
+    df = _inventario(app, r, 3000)
+    for q in _consultas(r, df, campo):
+        assert set(app.buscar_contiene(campo, q).tolist()) == _contiene_antes(df, campo, q), repr(q)
+
+
+@pytest.mark.parametrize("campo", ["NumeroFactura", "Documento"])
+def test_exacto_igual_al_filtro_anterior(app, campo):
+    r = random.Random(3)
+    df = _inventario(app, r, 3000)
+    valores = [str(v) for v in df[campo].dropna()]
+    for v in r.sample(valores, 50) + ["no-existe", "FAC1 ", " fac1"]:
+        assert set(app.buscar_exacto(campo, v).tolist()) == _exacto_antes(df, campo, v), repr(v)
+
+
+def test_faltantes_no_coinciden_como_nan(app):
+    df = _inventario(app, random.Random(4), 200)
+    assert df["NumeroFactura"].isna().any()
+    esperado = set(df.index[df["NumeroFactura"].astype(object).fillna("").str.lower().str.contains("nan", regex=False)])
+    assert set(app.buscar_contiene("NumeroFactura", "nan").tolist()) == esperado
+    assert len(app.buscar_exacto("NumeroFactura", "nan")) == 0
+    assert isinstance(app.buscar_contiene("NumeroFactura", "fac"), np.ndarray)
@@ -0,0 +1,64 @@
+"""Caches derivados (bandejas, índice, cubo, exportaciones) frente a una carga en curso."""
+import contextlib
+
+
+@contextlib.contextmanager
+def carga_en_curso(app, columnas=()):
+    """Otra sesión está recargando esa proyección: load_data entrega la copia anterior."""
+    c = app._cache_inventario()
+    c["cargando"][tuple(columnas)] = app.version_datos()
+    try:
+        yield
+    finally:
+        c["cargando"].pop(tuple(columnas), None)
+
+
+def _bandeja(app, estado):
+    df = app.load_data()
+    return set(df.loc[app.filas_bandeja(estado, None, None, None), "NumeroFactura"].astype(str))
+
+
+def test_bandejas_no_quedan_con_la_copia_anterior(app, inventario):
+    assert "FAC001" in _bandeja(app, "Radicada")
+    ok, msg, _ = app.mover_facturas(["FAC001"], "Pendiente")
+    assert ok, msg
+    with carga_en_curso(app):
+        # Mientras tanto se sirve el inventario anterior y el motor es coherente con él
+        assert "FAC001" in _bandeja(app, "Radicada")
+    assert "FAC001" in _bandeja(app, "Pendiente")
+    assert "FAC001" not in _bandeja(app, "Radicada")
+
+
+def test_indice_no_queda_con_la_copia_anterior(app, inventario):
+    app.buscar_exacto("NumeroFactura", "FAC001")
+    nueva = app.normalize_dataframe(app.pd.concat([inventario, app.pd.DataFrame(
+        {"NumeroFactura": ["FAC099"], "Estado": ["Pendiente"]})], ignore_index=True))
+    assert app._write_local(nueva)[0]
+    app.nueva_version_datos()
+    with carga_en_curso(app):
+        assert len(app.buscar_exacto("NumeroFactura", "FAC099")) == 0
+    assert len(app.buscar_exacto("NumeroFactura", "FAC099")) == 1
+
+
+def test_cubo_y_exportacion_se_rearman_tras_la_carga(app, inventario):
+    total = lambda: int(app.cubo_agregado()["Filas"].sum())
+    assert total() == 3
+    llamadas = []
+
+    def construir():
+        llamadas.append(1)
+        return app.load_data()[["NumeroFactura"]]
+
+    app.exportar("prueba", "csv", construir)
+    nueva = app.normalize_dataframe(app.pd.concat([inventario, app.pd.DataFrame(
+        {"NumeroFactura": ["FAC099"], "Estado": ["Pendiente"]})], ignore_index=True))
+    assert app._write_local(nueva)[0]
+    app.nueva_version_datos()   # como una importación: sin delta, el cubo se descarta
+    with carga_en_curso(app), carga_en_curso(app, app.COLS_RESUMEN):
+        assert total() == 3
+        assert b"FAC099" not in app.exportar("prueba", "csv", construir)
+    assert total() == 4
+    assert b"FAC099" in app.exportar("prueba", "csv", construir)
+    assert len(llamadas) == 3
+    app.exportar("prueba", "csv", construir)
+    assert len(llamadas) == 3   # la versión nueva ya quedó en cache
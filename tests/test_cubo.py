@@ -0,0 +1,72 @@
+"""
+Cubo compartido: tras un guardado se actualiza en sitio con el delta (previos → upserts); el
+resultado tiene que ser el mismo cubo que se arma desde cero con el inventario guardado.
+"""
+import pandas as pd
+import pytest
+
+
+def _ordenado(app, cubo: pd.DataFrame) -> pd.DataFrame:
+    cubo = cubo[app.CUBO_DIMS + app.CUBO_MEDIDAS].astype({"Vigencia": "Int16"})
+    return cubo.sort_values(app.CUBO_DIMS, na_position="last", kind="stable").reset_index(drop=True)
+
+
+def _desde_cero(app) -> pd.DataFrame:
+    app._estado_cubo()["cubo"] = None
+    return app.cubo_agregado()
+
+
+@pytest.fixture
+def base(app):
+    df = app.normalize_dataframe(pd.DataFrame({
+        "NumeroFactura": [f"FAC{i:03d}" for i in range(1, 9)],
+        "EPS": ["EPS A", "EPS B", "EPS A", "EPS C", None, "EPS B", "EPS A", "EPS A"],
+        "Vigencia": ["2024", "2024", "2025", "2023", "2024", None, "2025", "2024"],
+        "Estado": ["Radicada", "Pendiente", "Auditada", "Radicada", "Pendiente", "Subsanada", "Radicada", "Pendiente"],
+        "Valor Factura": [1000, 2500, 300, 40, 55.5, None, 7, 8],
+        "Valor Radicado": [900, None, 300, 40, 0, None, 7, 8],
+        "FechaRadicacion": ["2025-08-03", None, "2025-09-10", "2025-08-20", None, None, "2025-10-01", None],
+        "Mes": [None, "Agosto", None, None, "Septiembre", "Octubre", None, "Agosto"],
+    }))
+    assert app._write_local(df)[0]
+    app.nueva_version_datos()
+    app.cubo_agregado()
+    return app.load_data(fresco=True)
+
+
+def test_delta_de_guardado_igual_a_cubo_desde_cero(app, base):
+    df = base.copy()
+    clave = df["NumeroFactura"].astype(str)
+    df.loc[clave == "FAC001", "Valor Factura"] = 1234.5                 # edición de valor
+    df.loc[clave == "FAC002", "Estado"] = "Radicada"                    # cambio de estado
+    df.loc[clave == "FAC002", "FechaRadicacion"] = pd.Timestamp("2025-11-05")
+    df.loc[clave == "FAC003", "Vigencia"] = 2023                        # cambio de vigencia
+    df.loc[clave == "FAC005", "EPS"] = "EPS B"
+    df = df[clave != "FAC004"]                                          # borrado
+    nueva = app.normalize_dataframe(pd.DataFrame({                      # alta
+        "NumeroFactura": ["FAC099"], "EPS": ["EPS C"], "Vigencia": ["2025"], "Estado": ["Auditada"],
+        "Valor Factura": [77], "Mes": ["Noviembre"],
+    }))
+    df = pd.concat([df, nueva[[c for c in df.columns if c in nueva.columns]]], ignore_index=True)
+
+    ok, msg = app.guardar_inventario(df, permitir_borrado=True)
+    assert ok, msg
+    est = app._estado_cubo()
+    assert est["cubo"] is not None and est["version"] == app.version_datos()   # se ajustó en sitio
+    incremental = _ordenado(app, app.cubo_agregado())
+    pd.testing.assert_frame_equal(incremental, _ordenado(app, _desde_cero(app)))
+    assert (incremental["Filas"] > 0).all()
+    assert incremental["Filas"].sum() == 8
+
+
+def test_mover_a_estado_y_volver_no_deja_celdas_vacias(app, base):
+    df = base.copy()
+    clave = df["NumeroFactura"].astype(str)
+    df.loc[clave == "FAC004", "Estado"] = "Pendiente"
+    assert app.guardar_inventario(df)[0]
+    df = app.load_data(fresco=True).copy()
+    df.loc[df["NumeroFactura"].astype(str) == "FAC004", "Estado"] = "Radicada"
+    assert app.guardar_inventario(df)[0]
+    assert app._estado_cubo()["version"] == app.version_datos()
+    incremental = _ordenado(app, app.cubo_agregado())
+    pd.testing.assert_frame_equal(incremental, _ordenado(app, _desde_cero(app)))
@@ -0,0 +1,101 @@
+"""Cola de exportaciones: las tablas se arman en el pool, un archivo se escribe una sola vez y
+los trabajos terminados no se acumulan en memoria."""
+import os
+import threading
+import time
+
+import pytest
+
+
+def _esperar(app, tid, usuario="ana"):
+    limite = time.time() + 20
+    while time.time() < limite:
+        t = next(t for t in app.trabajos_exportacion(usuario) if t["id"] == tid)
+        if t["estado"] not in ("en cola", "en curso"): return t
+        time.sleep(0.05)
+    pytest.fail(f"el trabajo {tid} no terminó")
+
+
+def _ids(app, usuario="ana"):
+    return [t["id"] for t in app.trabajos_exportacion(usuario)]
+
+
+def test_trabajo_descargado_sale_de_la_cola(app, inventario):
+    tid = app.encolar_exportacion("Por_EPS", "csv", "ana")
+    assert _esperar(app, tid)["estado"] == "lista"
+    app.marcar_descargada(tid)
+    assert tid not in _ids(app)
+    assert tid not in app._cola_exportes()["trabajos"]
+    # El archivo sigue en disco: volver a pedirlo lo reutiliza sin re-exportar
+    otro = app.encolar_exportacion("Por_EPS", "csv", "ana")
+    assert otro != tid
+    assert app._cola_exportes()["trabajos"][otro]["estado"] == "lista"
+
+
+def test_trabajo_terminado_vence_por_ttl(app, inventario):
+    tid = app.encolar_exportacion("Por_EPS", "csv", "ana")
+    _esperar(app, tid)
+    assert tid in _ids(app)
+    app._cola_exportes()["trabajos"][tid]["fin"] -= app.EXPORT_TRABAJO_TTL_S + 1
+    # La poda corre al listar los de cualquier usuario (y al encolar), no solo los del dueño
+    app.trabajos_exportacion("bruno")
+    assert tid not in app._cola_exportes()["trabajos"]
+    assert tid not in _ids(app)
+
+
+def test_trabajos_en_curso_no_se_podan(app, inventario):
+    cola = app._cola_exportes()
+    with cola["lock"]:
+        cola["trabajos"]["x"] = {"id": "x", "usuario": "ana", "estado": "en curso", "ruta": "",
+                                 "inicio": time.time() - 10 * app.EXPORT_TRABAJO_TTL_S, "fin": None}
+    assert "x" in _ids(app)
+
+
+def test_tablas_se_arman_en_el_pool(app, inventario, monkeypatch):
+    hilos = []
+    def armar():
+        hilos.append(threading.current_thread().name)
+        return {"x": app.load_data()}
+    monkeypatch.setitem(app.EXPORTES, "prueba", ("Prueba", "prueba", armar))
+    tid = app.encolar_exportacion("prueba", "csv", "ana")
+    assert _esperar(app, tid)["estado"] == "lista"
+    assert len(hilos) == 1 and hilos[0].startswith("export")
+
+
+def test_mismo_archivo_se_escribe_una_vez(app, inventario, monkeypatch):
+    escrituras, soltar = [], threading.Event()
+    original = app._serializar
+    def serializar(hojas, formato, destino=None, progreso=None):
+        escrituras.append(destino)
+        soltar.wait(5)
+        return original(hojas, formato, destino=destino, progreso=progreso)
+    monkeypatch.setattr(app, "_serializar", serializar)
+    # Dos usuarios, mismo archivo: el segundo espera al primero en lugar de sobrescribirlo
+    a = app.encolar_exportacion("Por_EPS", "csv", "ana")
+    b = app.encolar_exportacion("Por_EPS", "csv", "bruno")
+    limite = time.time() + 5
+    while app._cola_exportes()["trabajos"][b]["estado"] == "en cola" and time.time() < limite:
+        time.sleep(0.01)
+    soltar.set()
+    ta, tb = _esperar(app, a), _esperar(app, b, "bruno")
+    assert ta["estado"] == tb["estado"] == "lista"
+    assert ta["ruta"] == tb["ruta"] and os.path.exists(ta["ruta"])
+    assert len(escrituras) == 1
+
+
+def test_copia_anterior_reutiliza_su_archivo(app, inventario, monkeypatch):
+    from test_cache_versiones import carga_en_curso
+    app.load_data()
+    tid = app.encolar_exportacion("inventario_cuentas", "csv", "ana")
+    previo = _esperar(app, tid)
+    assert previo["estado"] == "lista"
+    escrituras = []
+    monkeypatch.setattr(app, "_serializar", lambda *a, **k: escrituras.append(k.get("destino")))
+    app.nueva_version_datos()
+    # Otra sesión recarga: las tablas salen de la copia anterior, cuyo archivo ya existe
+    with carga_en_curso(app):
+        otro = app.encolar_exportacion("inventario_cuentas", "csv", "ana")
+        t = _esperar(app, otro)
+    assert t["estado"] == "lista"
+    assert t["ruta"] == previo["ruta"] and t["version"] == previo["version"]
+    assert escrituras == []
@@ -0,0 +1,96 @@
+"""Guardado en Supabase con compare-and-set por versión (sin pisar guardados concurrentes)."""
+import pytest
+
+import fake_supabase as fake
+
+
+def _fila(nf, estado, version=1):
+    return {"numero_factura": nf, "estado": estado, "eps": "EPS A", "vigencia": 2024,
+            "valor_factura": 100.0, "version": version}
+
+
+@pytest.fixture(params=["rpc", "fila a fila"])
+def db(request, app, monkeypatch):
+    cliente = fake.Cliente({"inventario": [_fila("FAC001", "Pendiente"), _fila("FAC002", "Radicada")]})
+    if request.param == "rpc":
+        cliente.funciones["guardar_con_version"] = fake.guardar_con_version
+    fake.conectar(app, monkeypatch, cliente)
+    return cliente
+
+
+def _editar(app, base, nf, **cambios):
+    nuevo = base.copy()
+    m = nuevo["NumeroFactura"].astype(str) == nf
+    for col, v in cambios.items():
+        nuevo[col] = nuevo[col].astype(object)
+        nuevo.loc[m, col] = v
+    return nuevo
+
+
+def _fila_db(db, nf):
+    return next(r for r in db.tablas["inventario"] if r["numero_factura"] == nf)
+
+
+def test_dos_guardados_sobre_la_misma_version_no_se_pisan(app, db):
+    base = app.load_data(fresco=True)
+    ok, msg = app.guardar_inventario(_editar(app, base, "FAC001", Observaciones="de A"), base=base)
+    assert ok, msg
+    ok, msg = app.guardar_inventario(_editar(app, base, "FAC001", Observaciones="de B"), base=base)
+    assert not ok   # nada que escribir: todo en conflicto
+    assert _fila_db(db, "FAC001")["observaciones"] == "de A"
+    assert _fila_db(db, "FAC001")["version"] == 2
+    conf = app.conflictos_guardado()
+    assert conf["NumeroFactura"].tolist() == ["FAC001"]
+    assert conf["Motivo"].tolist() == ["modificada por otro usuario"]
+
+
+def test_cambio_ajeno_durante_el_guardado_no_se_pierde(app, db):
+    base = app.load_data(fresco=True)
+    nuevo = _editar(app, base, "FAC002", Estado="Auditada")
+    # Otro usuario guarda FAC002 justo después de la primera llamada de este guardado
+    db.intercalar.append(lambda cl: _fila_db(cl, "FAC002").update(estado="Subsanada", version=5))
+    app.guardar_inventario(nuevo, base=base)
+    assert _fila_db(db, "FAC002")["estado"] == "Subsanada"
+
+
+def test_cambio_ajeno_antes_de_escribir(app, db):
+    base = app.load_data(fresco=True)
+    nuevo = _editar(app, _editar(app, base, "FAC001", Estado="Radicada"), "FAC002", Estado="Auditada")
+    _fila_db(db, "FAC002").update(estado="Subsanada", version=5)
+    ok, msg = app.guardar_inventario(nuevo, base=base)
+    assert ok, msg
+    assert _fila_db(db, "FAC001")["estado"] == "Radicada"
+    assert _fila_db(db, "FAC002")["estado"] == "Subsanada"
+    assert app.conflictos_guardado()["NumeroFactura"].tolist() == ["FAC002"]
+
+
+def test_insertar_y_borrar_con_version(app, db):
+    base = app.load_data(fresco=True)
+    nuevo = app.pd.concat([base[base["NumeroFactura"].astype(str) != "FAC002"],
+                           app.pd.DataFrame({"NumeroFactura": ["FAC003"], "Estado": ["Pendiente"]})],
+                          ignore_index=True)
+    ok, msg = app.guardar_inventario(nuevo, base=base, permitir_borrado=True)
+    assert ok, msg
+    claves = sorted(r["numero_factura"] for r in db.tablas["inventario"])
+    assert claves == ["FAC001", "FAC003"]
+    assert _fila_db(db, "FAC003")["version"] == 1
+
+
+def test_no_borra_fila_cambiada_por_otro(app, db):
+    base = app.load_data(fresco=True)
+    _fila_db(db, "FAC002").update(version=4)
+    nuevo = base[base["NumeroFactura"].astype(str) != "FAC002"]
+    app.guardar_inventario(nuevo, base=base, permitir_borrado=True)
+    assert any(r["numero_factura"] == "FAC002" for r in db.tablas["inventario"])
+    conf = app.conflictos_guardado()
+    assert conf["Operación"].tolist() == ["eliminar"]
+
+
+def test_no_crea_factura_que_otro_creo(app, db):
+    base = app.load_data(fresco=True)
+    nuevo = app.pd.concat([base, app.pd.DataFrame({"NumeroFactura": ["FAC003"], "Estado": ["Pendiente"]})],
+                          ignore_index=True)
+    db.tablas["inventario"].append(_fila("FAC003", "Radicada"))
+    app.guardar_inventario(nuevo, base=base)
+    assert _fila_db(db, "FAC003")["estado"] == "Radicada"
+    assert app.conflictos_guardado()["Motivo"].tolist() == ["creada por otro usuario"]
@@ -0,0 +1,82 @@
+"""IDs desde el contador de Supabase (supabase/ids.sql): solo con la service_key, nunca con la anon_key."""
+import io
+
+import pytest
+
+import fake_supabase as fake
+
+
+def _fila(nf, id_, version=1):
+    return {"numero_factura": nf, "id": id_, "estado": "Pendiente", "eps": "EPS A", "vigencia": 2024,
+            "valor_factura": 100.0, "version": version}
+
+
+@pytest.fixture
+def clientes(app):
+    tablas = {"inventario": [_fila("FAC001", "CHIA-0001"), _fila("FAC002", "CHIA-0007")],
+              "id_contador": [{"nombre": "inventario", "ultimo": 7}]}
+    anon, servicio = fake.Cliente(tablas, rol="anon"), fake.Cliente(tablas, rol="service_role")
+    for cl in (anon, servicio):
+        cl.funciones.update(reservar_ids=fake.reservar_ids, adelantar_ids=fake.adelantar_ids)
+    # supabase/ids.sql: sin EXECUTE para anon
+    anon.denegadas.update({"reservar_ids", "adelantar_ids"})
+    return {"anon": anon, "servicio": servicio}
+
+
+def _contador(clientes):
+    return clientes["servicio"].tablas["id_contador"][0]["ultimo"]
+
+
+def _rpcs(cliente):
+    return [c for c in cliente.llamadas if c[0] == "rpc"]
+
+
+def test_reservar_usa_la_service_key(app, monkeypatch, clientes):
+    fake.conectar(app, monkeypatch, clientes, service_key="servicio")
+    assert app.reservar_ids(3) == ["CHIA-0008", "CHIA-0009", "CHIA-0010"]
+    assert _contador(clientes) == 10
+    assert not _rpcs(clientes["anon"])
+    assert not app.os.path.exists(app.ID_CONTADOR)
+
+
+def test_reserva_grande_va_por_tramos(app, monkeypatch, clientes):
+    fake.conectar(app, monkeypatch, clientes, service_key="servicio")
+    ids = app.reservar_ids(app.ID_RESERVA_MAX + 2)
+    assert len(set(ids)) == app.ID_RESERVA_MAX + 2
+    assert ids[0] == "CHIA-0008"
+    assert _contador(clientes) == 7 + app.ID_RESERVA_MAX + 2
+    assert len(_rpcs(clientes["servicio"])) == 2
+
+
+def test_importacion_adelanta_el_contador(app, monkeypatch, clientes):
+    fake.conectar(app, monkeypatch, clientes, service_key="servicio")
+    csv = "ID,NumeroFactura,Estado\nCHIA-0100,FAC010,Pendiente\n,FAC011,Radicada\n"
+    ok, msg, rech = app.importar_inventario(io.BytesIO(csv.encode()), "lote.csv", "combinar")
+    assert ok, msg
+    assert rech.empty
+    ids = {r["numero_factura"]: r["id"] for r in clientes["servicio"].tablas["inventario"]}
+    assert ids["FAC010"] == "CHIA-0100"
+    assert ids["FAC011"] == "CHIA-0101"
+    assert _contador(clientes) == 101
+    assert ("rpc", "adelantar_ids") in _rpcs(clientes["servicio"])
+    # Lo siguiente que se reserve (Gestión) no choca con lo importado
+    assert app.reservar_ids(1) == ["CHIA-0102"]
+    assert not _rpcs(clientes["anon"])
+
+
+def test_la_funcion_rechaza_rangos_fuera_de_tope(clientes):
+    with pytest.raises(fake.ErrorPostgrest):
+        fake.reservar_ids(clientes["servicio"], n=5001)
+    with pytest.raises(fake.ErrorPostgrest):
+        fake.reservar_ids(clientes["servicio"], n=0)
+    with pytest.raises(fake.ErrorPostgrest):
+        clientes["anon"].rpc("reservar_ids", {"n": 1}).execute()
+    assert _contador(clientes) == 7
+
+
+def test_sin_service_key_no_llama_con_la_anon_key(app, monkeypatch, clientes, inventario):
+    fake.conectar(app, monkeypatch, clientes)
+    ids = app.reservar_ids(1)
+    assert ids == ["CHIA-0008"]   # contador local, arranca en el mayor ID del inventario
+    assert not _rpcs(clientes["anon"])
+    assert _contador(clientes) == 7
@@ -0,0 +1,55 @@
+import io
+
+import openpyxl
+import pytest
+
+
+def _csv(texto: str) -> io.BytesIO:
+    return io.BytesIO(texto.encode("utf-8"))
+
+
+def _ids(app):
+    df = app.load_data(fresco=True)
+    return dict(zip(df["NumeroFactura"].astype(str), df["ID"].astype(object)))
+
+
+@pytest.mark.parametrize("texto", [
+    "NumeroFactura,EPS,Estado\nFAC010,EPS A,Pendiente\nFAC011,EPS B,Radicada\n",
+    "ID,NumeroFactura,EPS,Estado\n,FAC010,EPS A,Pendiente\n,FAC011,EPS B,Radicada\n",
+])
+def test_importar_sin_id_reserva_ids(app, inventario, texto):
+    ok, msg, rech = app.importar_inventario(_csv(texto), "nuevas.csv", "combinar")
+    assert ok, msg
+    assert rech.empty
+    ids = _ids(app)
+    # El contador arranca en el mayor ID existente (CHIA-0007)
+    assert {ids["FAC010"], ids["FAC011"]} == {"CHIA-0008", "CHIA-0009"}
+    assert ids["FAC001"] == "CHIA-0001"
+
+
+def test_importar_una_fila_sin_id(app, inventario):
+    ok, msg, _ = app.importar_inventario(_csv("NumeroFactura,Estado\nFAC020,Pendiente\n"), "una.csv")
+    assert ok, msg
+    assert _ids(app)["FAC020"] == "CHIA-0008"
+
+
+def test_importar_xlsx_conserva_id_de_factura_existente(app, inventario):
+    wb = openpyxl.Workbook()
+    wb.active.append(["NumeroFactura", "Estado"])
+    wb.active.append(["FAC002", "Radicada"])
+    wb.active.append(["FAC030", "Pendiente"])
+    buf = io.BytesIO()
+    wb.save(buf)
+    buf.seek(0)
+    ok, msg, _ = app.importar_inventario(buf, "lote.xlsx")
+    assert ok, msg
+    ids = _ids(app)
+    assert ids["FAC002"] == "CHIA-0007"
+    assert ids["FAC030"] == "CHIA-0008"
+
+
+def test_completar_ids_directo(app, inventario):
+    lote = app.pd.DataFrame({"ID": app.pd.Series(["", "CHIA-0100", None], dtype="str"),
+                             "NumeroFactura": ["FAC001", "FAC040", "FAC041"]})
+    out = app.completar_ids(lote, app._ids_vigentes(inventario))
+    assert list(out["ID"]) == ["CHIA-0001", "CHIA-0100", "CHIA-0101"]
@@ -0,0 +1,65 @@
+import random
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Fechas "dd/mm/aaaa" a propósito: la versión por fila también las leía
+pytestmark = pytest.mark.filterwarnings("ignore:Parsing dates:UserWarning")
+
+MESES = ["Enero", "Febrero", "Septiembre", "Diciembre", "enero ", "Septiembre 2025", "Mes 2024", ""]
+
+
+def _etq_mes(app, row) -> str:
+    """Referencia: la versión por fila que mes_clave reemplazó (df.apply(_etq_mes, axis=1))."""
+    fr = row.get("FechaRadicacion")
+    if pd.notna(fr):
+        fr = pd.to_datetime(fr, errors="coerce")
+        if pd.notna(fr): return f"{app.MES_NOMBRE[int(fr.month)]} {int(fr.year)}"
+    m = str(row.get("Mes", "")).strip()
+    if re.search(r"\b20\d{2}\b", m): return m
+    vig = str(row.get("Vigencia", "")).strip()
+    if m and vig.isdigit(): return f"{m} {vig}"
+    return m or "Sin Mes"
+
+
+def _crudo(r: random.Random, n: int) -> pd.DataFrame:
+    fechas = [pd.Timestamp("2023-01-01") + pd.Timedelta(days=r.randint(0, 900)) for _ in range(n)]
+    return pd.DataFrame({
+        "FechaRadicacion": [r.choice([f, f.strftime("%Y-%m-%d"), f.strftime("%d/%m/%Y"), None, np.nan, "no es fecha"])
+                            for f in fechas],
+        "Mes": [r.choice(MESES + [None, np.nan, pd.NA, 3]) for _ in range(n)],
+        "Vigencia": [r.choice([2024, "2025", " 2023 ", "", None, np.nan, pd.NA, 2024.0, "n/a"]) for _ in range(n)],
+    }, index=pd.RangeIndex(n) * 2)
+
+
+def _referencia(app, df: pd.DataFrame) -> pd.Series:
+    return df.apply(lambda row: _etq_mes(app, row), axis=1)
+
+
+@pytest.mark.parametrize("semilla", [1, 2, 3])
+def test_igual_a_la_version_por_fila_crudo(app, semilla):
+    df = _crudo(random.Random(semilla), 2000)
+    pd.testing.assert_series_equal(app.mes_clave(df), _referencia(app, df), check_dtype=False)
+
+
+@pytest.mark.parametrize("semilla", [4, 5])
+def test_igual_a_la_version_por_fila_normalizado(app, semilla):
+    crudo = _crudo(random.Random(semilla), 2000)
+    crudo["NumeroFactura"] = [f"F{i}" for i in range(len(crudo))]
+    df = app.normalize_dataframe(crudo)
+    pd.testing.assert_series_equal(app.mes_clave(df), _referencia(app, df), check_dtype=False)
+
+
+@pytest.mark.parametrize("df", [
+    pd.DataFrame(),
+    pd.DataFrame({"Mes": ["Enero", None]}),
+    pd.DataFrame({"Vigencia": [2024, None]}),
+    pd.DataFrame({"FechaRadicacion": ["2025-03-04", None]}),
+])
+def test_columnas_faltantes(app, df):
+    obtenido = app.mes_clave(df)
+    assert obtenido.index.equals(df.index)
+    if len(df):
+        pd.testing.assert_series_equal(obtenido, _referencia(app, df), check_dtype=False)
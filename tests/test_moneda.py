@@ -0,0 +1,74 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ALFABETO = "0123456789.,$ \xa0-+e_abcnaif\t"
+RAROS = ["", "nan", "inf", "-inf", "NaN", "1_000", "1e5", "-1.234,5", "+3", "1,2,3", "$", "  ",
+         ".5", ",5", "1.e3", "Infinity", "1.5E-3", "١٢٣", "N/A", "$ 1.234.567,89"]
+
+
+def _valor(r: random.Random) -> str:
+    k = r.random()
+    if k < 0.3:  # formato colombiano: "$ 1.234.567,89"
+        v = f"{r.uniform(0, 1e9):,.{r.choice([0, 2])}f}"
+        v = v.replace(",", "X").replace(".", ",").replace("X", ".")
+        return r.choice(["$ ", "$", "", "$\xa0"]) + v + r.choice(["", " "])
+    if k < 0.5:
+        return "".join(r.choice(ALFABETO) for _ in range(r.randint(0, 12)))
+    if k < 0.6:
+        return r.choice(RAROS)
+    if k < 0.7:
+        return str(r.randint(-10**20, 10**20))
+    return f"{r.uniform(-1e12, 1e12):.{r.randint(0, 12)}f}".replace(".", r.choice([",", "."]))
+
+
+def _por_fila(app, s: pd.Series) -> np.ndarray:
+    """Referencia: el parser celda a celda, con pd.NA → NaN (ver docstring de _parse_currency_series)."""
+    return np.array([np.nan if x is pd.NA else float(x) for x in s.map(app._parse_currency)], dtype="float64")
+
+
+def _iguales(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a == b) | (np.isnan(a) & np.isnan(b))
+
+
+@pytest.mark.parametrize("semilla", [1, 2, 3])
+@pytest.mark.parametrize("dtype", [object, "str"])
+def test_vectorizado_igual_al_parser_por_fila(app, semilla, dtype):
+    r = random.Random(semilla)
+    s = pd.Series([_valor(r) for _ in range(20_000)], dtype=dtype)
+    obtenido = app._parse_currency_series(s)
+    assert obtenido.dtype == "float64"
+    assert obtenido.index.equals(s.index)
+    esperado = _por_fila(app, s)
+    malos = np.flatnonzero(~_iguales(obtenido.to_numpy(), esperado))
+    assert not len(malos), [(s.iloc[k], obtenido.iloc[k], esperado[k]) for k in malos[:10]]
+
+
+def test_tipos_mezclados(app):
+    s = pd.Series([1234, None, "1.234,5", 7.5, True, pd.NA, "x", np.int64(3), "", np.nan],
+                  index=range(10, 20), dtype=object)
+    obtenido = app._parse_currency_series(s).to_numpy()
+    assert _iguales(obtenido, _por_fila(app, s)).all()
+
+
+@pytest.mark.parametrize("s", [
+    pd.Series([1500.5, np.nan, 3.0]),
+    pd.Series([1, 2, 3], dtype="int64"),
+    pd.Series([1.5, None], dtype="Float64"),
+])
+def test_numericos_no_pasan_por_texto(app, s):
+    # 1500.5 no se vuelve "15005" al quitar separadores
+    obtenido = app._parse_currency_series(s).to_numpy()
+    assert _iguales(obtenido, s.astype("float64").to_numpy()).all()
+
+
+def test_normalize_deja_float64_nullable(app):
+    df = app.normalize_dataframe(pd.DataFrame({
+        "NumeroFactura": ["F1", "F2", "F3"],
+        "Valor Factura": ["$ 1.234.567,89", "", "N/A"],
+    }))
+    assert df["Valor Factura"].dtype == "Float64"
+    assert df["Valor Factura"].iloc[0] == 1234567.89
+    assert df["Valor Factura"].iloc[1:].isna().all()
@@ -0,0 +1,94 @@
+"""Mover facturas de estado en lote (Bandejas): resultado por factura, local y en Supabase con versión."""
+import pandas as pd
+import pytest
+
+import fake_supabase as fake
+
+AHORA = pd.Timestamp("2025-09-01 10:30:00")
+
+
+def _resultado(res: pd.DataFrame) -> dict:
+    return dict(zip(res["NumeroFactura"], res["Resultado"]))
+
+
+def _estados(app) -> dict:
+    df = app.load_data(fresco=True)
+    return dict(zip(df["NumeroFactura"].astype(str), df["Estado"].astype(str)))
+
+
+# ---------- almacén local ----------
+
+def test_local_mueve_y_reporta_cada_factura(app, inventario):
+    ok, msg, res = app.mover_facturas(["FAC002", "FAC003", "FAC001", "FAC999", "", " FAC002 "], "Radicada", ahora=AHORA)
+    assert (ok, msg) == (True, "OK_LOCAL")
+    assert _resultado(res) == {"FAC002": "movida", "FAC003": "movida", "FAC001": "sin cambio", "FAC999": "no existe"}
+    assert dict(zip(res["NumeroFactura"], res["Estado anterior"]))["FAC003"] == "Auditada"
+    assert _estados(app) == {"FAC001": "Radicada", "FAC002": "Radicada", "FAC003": "Radicada"}
+    df = app.load_data(fresco=True).set_index("NumeroFactura")
+    assert df.loc["FAC002", "FechaMovimiento"] == AHORA
+    assert pd.isna(df.loc["FAC001", "FechaMovimiento"])
+
+
+def test_local_transicion_no_permitida(app, inventario, monkeypatch):
+    monkeypatch.setitem(app.TRANSICIONES, "Auditada", {"Subsanada"})
+    ok, msg, res = app.mover_facturas(["FAC002", "FAC003"], "Radicada", ahora=AHORA)
+    assert ok, msg
+    assert _resultado(res) == {"FAC002": "movida", "FAC003": "transición no permitida"}
+    assert _estados(app)["FAC003"] == "Auditada"
+
+
+def test_local_sin_nada_que_mover_no_escribe(app, inventario):
+    app.load_data()
+    v = app.version_datos()
+    ok, msg, res = app.mover_facturas(["FAC001", "FAC999"], "Radicada")
+    assert (ok, msg) == (True, "OK_NOOP")
+    assert _resultado(res) == {"FAC001": "sin cambio", "FAC999": "no existe"}
+    ok, msg, res = app.mover_facturas(["FAC002"], "Archivada")
+    assert (ok, msg) == (True, "OK_NOOP")
+    assert _resultado(res) == {"FAC002": "estado destino inválido"}
+    assert app.version_datos() == v
+
+
+# ---------- Supabase: UPDATE ... AND version = vista ----------
+
+def _fila(nf, estado, version=1):
+    return {"numero_factura": nf, "estado": estado, "eps": "EPS A", "vigencia": 2024,
+            "valor_factura": 100.0, "version": version}
+
+
+def _fila_db(db, nf):
+    return next(r for r in db.tablas["inventario"] if r["numero_factura"] == nf)
+
+
+def _updates(db):
+    return sum(1 for t, op in db.llamadas if (t, op) == ("inventario", "update"))
+
+
+@pytest.fixture
+def db(app, monkeypatch):
+    cliente = fake.Cliente({"inventario": [_fila("FAC001", "Pendiente"), _fila("FAC002", "Pendiente"),
+                                           _fila("FAC003", "Auditada", version=3)]})
+    fake.conectar(app, monkeypatch, cliente)
+    return cliente
+
+
+def test_supabase_un_update_por_version_vista(app, db):
+    ok, msg, res = app.mover_facturas(["FAC001", "FAC002", "FAC003"], "Radicada", ahora=AHORA)
+    assert (ok, msg) == (True, "OK_SUPABASE")
+    assert set(res["Resultado"]) == {"movida"}
+    assert _updates(db) == 2   # versiones vistas 1 y 3
+    assert [(_fila_db(db, nf)["estado"], _fila_db(db, nf)["version"]) for nf in ["FAC001", "FAC002", "FAC003"]] \
+        == [("Radicada", 2), ("Radicada", 2), ("Radicada", 4)]
+    assert _estados(app) == {"FAC001": "Radicada", "FAC002": "Radicada", "FAC003": "Radicada"}
+
+
+def test_supabase_conflicto_si_la_version_cambio(app, db):
+    app.load_data()
+    # Otro usuario movió FAC002 después de que esta sesión leyó el inventario
+    _fila_db(db, "FAC002").update(estado="Subsanada", version=5)
+    ok, msg, res = app.mover_facturas(["FAC001", "FAC002"], "Radicada", ahora=AHORA)
+    assert ok, msg
+    assert _resultado(res) == {"FAC001": "movida", "FAC002": "conflicto de versión"}
+    assert _fila_db(db, "FAC001")["estado"] == "Radicada"
+    assert (_fila_db(db, "FAC002")["estado"], _fila_db(db, "FAC002")["version"]) == ("Subsanada", 5)
+
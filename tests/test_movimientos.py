@@ -0,0 +1,92 @@
+"""Bitácora de movimientos: JSONL que solo se agrega, compactación a Parquet y lectura del flujo."""
+import io
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import fake_supabase as fake
+
+
+def _jsonl(app, n=1):
+    with open(os.path.join(app.MOVIMIENTOS_DIR, f"activo_{n:06d}.jsonl"), encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f]
+
+
+def _flujo(app):
+    """{(Hacia): movimientos} del flujo diario."""
+    f = app.flujo_movimientos("Día")
+    return f.groupby("Hacia")["Movimientos"].sum().to_dict()
+
+
+def test_mover_agrega_al_jsonl_activo(app, inventario):
+    ok, msg, res = app.mover_facturas(["FAC002"], "Auditada")
+    assert ok, msg
+    assert res["Resultado"].tolist() == ["movida"]
+    lineas = _jsonl(app)
+    assert [(m["factura"], m["desde"], m["hacia"], m["origen"]) for m in lineas] == \
+        [("FAC002", "Pendiente", "Auditada", "Bandejas")]
+    # Otro movimiento se agrega al final, sin reescribir lo anterior
+    ok, msg, _ = app.mover_facturas(["FAC002"], "Subsanada")
+    assert ok, msg
+    lineas2 = _jsonl(app)
+    assert lineas2[0] == lineas[0]
+    assert [(m["desde"], m["hacia"]) for m in lineas2[1:]] == [("Auditada", "Subsanada")]
+
+
+def test_sin_cambio_de_estado_no_anota(app, inventario):
+    ok, msg, res = app.mover_facturas(["FAC001"], "Radicada")
+    assert ok and res["Resultado"].tolist() == ["sin cambio"]
+    assert not os.path.exists(app.MOVIMIENTOS_DIR) or not os.listdir(app.MOVIMIENTOS_DIR)
+
+
+def test_activo_lleno_se_compacta_en_segmento(app, inventario, monkeypatch):
+    if not app.PARQUET_OK: pytest.skip("sin pyarrow los segmentos quedan en JSONL")
+    assert app.mover_facturas(["FAC002"], "Auditada")[0]
+    assert _flujo(app) == {"Auditada": 1}   # el lector ya contó la cola del activo
+    monkeypatch.setattr(app, "MOV_ACTIVO_MAX_BYTES", 1)
+    assert app.mover_facturas(["FAC002"], "Subsanada")[0]
+    nombres = sorted(os.listdir(app.MOVIMIENTOS_DIR))
+    assert "seg_000001.parquet" in nombres and "activo_000001.jsonl" not in nombres
+    seg = pd.read_parquet(os.path.join(app.MOVIMIENTOS_DIR, "seg_000001.parquet"))
+    assert seg["hacia"].tolist() == ["Auditada", "Subsanada"]
+    # El siguiente movimiento abre un activo nuevo; el flujo no cuenta dos veces lo ya leído
+    monkeypatch.setattr(app, "MOV_ACTIVO_MAX_BYTES", 4 * 1024 * 1024)
+    assert app.mover_facturas(["FAC003"], "Radicada")[0]
+    assert "activo_000002.jsonl" in os.listdir(app.MOVIMIENTOS_DIR)
+    assert _flujo(app) == {"Auditada": 1, "Subsanada": 1, "Radicada": 1}
+
+
+def test_flujo_tras_mover_e_importar(app, inventario):
+    assert app.mover_facturas(["FAC002", "FAC003"], "Radicada")[0]
+    assert _flujo(app) == {"Radicada": 2}
+    csv = "NumeroFactura,Estado\nFAC001,Pendiente\nFAC050,Auditada\n"
+    ok, msg, _ = app.importar_inventario(io.BytesIO(csv.encode()), "lote.csv", "combinar")
+    assert ok, msg
+    # FAC001 Radicada → Pendiente y FAC050 nueva; FAC002/FAC003 no vienen en el archivo
+    assert _flujo(app) == {"Radicada": 2, "Pendiente": 1, "Auditada": 1}
+    mov = pd.DataFrame(_jsonl(app))
+    imp = mov[mov["origen"] == "Importación"].set_index("factura")
+    assert imp.loc["FAC001", "desde"] == "Radicada"
+    assert pd.isna(imp.loc["FAC050", "desde"])   # nueva: sin estado anterior
+
+
+def _fila(nf, estado, version=1):
+    return {"numero_factura": nf, "estado": estado, "eps": "EPS A", "vigencia": 2024,
+            "valor_factura": 100.0, "version": version}
+
+
+def test_supabase_escribe_y_lee_con_la_service_key(app, monkeypatch):
+    tablas = {"inventario": [_fila("FAC001", "Pendiente"), _fila("FAC002", "Pendiente")], "movimientos": []}
+    anon, servicio = fake.Cliente(tablas, rol="anon"), fake.Cliente(tablas, rol="service_role")
+    anon.denegadas.add("movimientos")   # supabase/movimientos.sql: anon sin acceso
+    fake.conectar(app, monkeypatch, {"anon": anon, "servicio": servicio},
+                  movimientos_tabla="movimientos", service_key="servicio")
+    ok, msg, _ = app.mover_facturas(["FAC001", "FAC002"], "Auditada")
+    assert ok, msg
+    assert sorted((m["factura"], m["hacia"]) for m in tablas["movimientos"]) == \
+        [("FAC001", "Auditada"), ("FAC002", "Auditada")]
+    assert _flujo(app) == {"Auditada": 2}
+    assert not [c for c in anon.llamadas if c[0] == "movimientos"]
+    assert not os.path.exists(app.MOVIMIENTOS_DIR)
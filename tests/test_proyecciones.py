@@ -0,0 +1,34 @@
+"""Metas de Avance en Supabase: lectura con la anon_key, edición solo con la service_key."""
+import pytest
+
+import fake_supabase as fake
+
+
+@pytest.fixture
+def clientes():
+    tablas = {"proyecciones": [{"periodo": "2025-08", "eps": "", "cuentas": 100}]}
+    anon, servicio = fake.Cliente(tablas, rol="anon"), fake.Cliente(tablas, rol="service_role")
+    anon.denegadas |= {("proyecciones", op) for op in ("update", "upsert", "insert", "delete")}
+    return {"anon": anon, "servicio": servicio}
+
+
+def _metas(periodos):
+    import pandas as pd
+    return pd.DataFrame({"Periodo": periodos, "EPS": "", "Cuentas estimadas": 50})
+
+
+def test_editar_metas_usa_la_service_key(app, monkeypatch, clientes):
+    fake.conectar(app, monkeypatch, clientes, proyecciones_tabla="proyecciones", service_key="servicio")
+    assert app.proyecciones()["Cuentas estimadas"].tolist() == [100]
+    ok, msg = app.guardar_proyecciones(_metas(["2025-09", "2025-10"]))
+    assert ok, msg
+    assert sorted(r["periodo"] for r in clientes["servicio"].tablas["proyecciones"]) == ["2025-09", "2025-10"]
+    assert [c for c in clientes["anon"].llamadas if c[1] != "select"] == []
+
+
+def test_sin_service_key_no_edita(app, monkeypatch, clientes):
+    fake.conectar(app, monkeypatch, clientes, proyecciones_tabla="proyecciones")
+    ok, msg = app.guardar_proyecciones(_metas(["2025-09"]))
+    assert not ok
+    assert "service_key" in msg
+    assert [r["periodo"] for r in clientes["anon"].tablas["proyecciones"]] == ["2025-08"]
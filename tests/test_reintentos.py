@@ -0,0 +1,91 @@
+"""ejecutar_supabase: backoff ante fallos transitorios, pero nunca para lo que no es idempotente."""
+import pytest
+
+import fake_supabase as fake
+
+
+def _fila(nf, estado, version=1):
+    return {"numero_factura": nf, "estado": estado, "eps": "EPS A", "vigencia": 2024,
+            "valor_factura": 100.0, "version": version}
+
+
+@pytest.fixture
+def db(app, monkeypatch):
+    cliente = fake.Cliente({"inventario": [_fila("FAC001", "Pendiente"), _fila("FAC002", "Radicada")],
+                            "id_contador": [{"nombre": "inventario", "ultimo": 7}]})
+    cliente.funciones.update(guardar_con_version=fake.guardar_con_version,
+                             reservar_ids=fake.reservar_ids, adelantar_ids=fake.adelantar_ids)
+    fake.conectar(app, monkeypatch, cliente, service_key="anon")
+    return cliente
+
+
+def _intentos(app, operacion):
+    m = app.metricas_df("supabase_llamada")
+    return m[m["operacion"] == operacion]["intentos"].tolist()
+
+
+def _fila_db(db, nf):
+    return next(r for r in db.tablas["inventario"] if r["numero_factura"] == nf)
+
+
+def test_lectura_se_reintenta_hasta_lograrlo(app, db):
+    db.fallos += [(("inventario", "select"), "antes")] * 2
+    df = app.load_data(fresco=True)
+    assert set(df["NumeroFactura"].astype(str)) == {"FAC001", "FAC002"}
+    assert _intentos(app, "select")[0] == 3
+    assert not db.fallos
+
+
+def test_lectura_se_rinde_tras_los_reintentos(app, db):
+    fallo = (("inventario", "select"), "antes")
+    db.fallos += [fallo] * (app.SUPABASE_REINTENTOS + 1)
+    with pytest.raises(TimeoutError):
+        app.ejecutar_supabase(db.table("inventario").select("*"), "select")
+    assert _intentos(app, "select") == [app.SUPABASE_REINTENTOS + 1]
+
+
+def test_error_de_datos_no_se_reintenta(app, db):
+    db.denegadas.add("inventario")
+    with pytest.raises(fake.ErrorPostgrest):
+        app.ejecutar_supabase(db.table("inventario").select("*"), "select")
+    assert _intentos(app, "select") == [1]
+
+
+def test_guardado_versionado_no_se_repite(app, db):
+    base = app.load_data(fresco=True)
+    nuevo = base.copy()
+    nuevo["Observaciones"] = nuevo["Observaciones"].astype(object)
+    nuevo.loc[nuevo["NumeroFactura"] == "FAC001", "Observaciones"] = "mía"
+    # El servidor aplica el compare-and-set y la respuesta se pierde
+    db.fallos.append((("rpc", "guardar_con_version"), "despues"))
+    ok, msg = app.guardar_inventario(nuevo, base=base)
+    assert not ok and "timeout" in msg
+    assert db.llamadas.count(("rpc", "guardar_con_version")) == 1
+    assert _fila_db(db, "FAC001")["observaciones"] == "mía"
+    # Un reintento habría chocado con la versión que acabamos de escribir
+    assert app.conflictos_guardado().empty
+
+
+def test_mover_versionado_no_se_repite(app, db):
+    db.fallos.append((("inventario", "update"), "despues"))
+    ok, msg, _ = app.mover_facturas(["FAC001"], "Auditada")
+    assert not ok and "timeout" in msg
+    assert db.llamadas.count(("inventario", "update")) == 1
+    assert _fila_db(db, "FAC001")["version"] == 2
+
+
+def test_reserva_de_ids_no_se_repite(app, db):
+    db.fallos.append((("rpc", "reservar_ids"), "despues"))
+    with pytest.raises(RuntimeError):
+        app.reservar_ids(3)
+    assert db.llamadas.count(("rpc", "reservar_ids")) == 1
+    assert db.tablas["id_contador"][0]["ultimo"] == 10   # un solo rango gastado
+    assert not app.os.path.exists(app.ID_CONTADOR)       # y sin pasar al contador local
+    assert app.reservar_ids(1) == ["CHIA-0011"]
+
+
+def test_adelantar_ids_si_se_reintenta(app, db):
+    db.fallos.append((("rpc", "adelantar_ids"), "despues"))
+    app.adelantar_ids(50)
+    assert db.llamadas.count(("rpc", "adelantar_ids")) == 2
+    assert db.tablas["id_contador"][0]["ultimo"] == 50
@@ -0,0 +1,77 @@
+"""Sincronización con Supabase: el refresco completo va por edad, sin depender de guardados locales."""
+import pytest
+
+import fake_supabase as fake
+
+
+def _fila(nf, estado="Pendiente", fecha="2025-08-01T10:00:00"):
+    return {"numero_factura": nf, "estado": estado, "eps": "EPS A", "vigencia": 2024,
+            "valor_factura": 100.0, "version": 1, "fecha_movimiento": fecha}
+
+
+@pytest.fixture
+def db(app, monkeypatch):
+    cliente = fake.Cliente({"inventario": [_fila("FAC001"), _fila("FAC002"), _fila("FAC003")]})
+    fake.conectar(app, monkeypatch, cliente)
+    return cliente
+
+
+def _facturas(app):
+    return set(app.load_data()["NumeroFactura"].astype(str))
+
+
+def _lecturas(db):
+    return sum(1 for t, op in db.llamadas if (t, op) == ("inventario", "select"))
+
+
+def _envejecer(app):
+    app._estado_sync()["full_ts"] -= app.SYNC_FULL_CADA_S + 1
+
+
+def test_borrado_remoto_llega_con_el_refresco_por_edad(app, db):
+    assert _facturas(app) == {"FAC001", "FAC002", "FAC003"}
+    # Otro servidor borra FAC002 y edita FAC003 sin mover la marca; aquí nadie guarda
+    db.tablas["inventario"] = [r for r in db.tablas["inventario"] if r["numero_factura"] != "FAC002"]
+    next(r for r in db.tablas["inventario"] if r["numero_factura"] == "FAC003")["estado"] = "Radicada"
+    assert _facturas(app) == {"FAC001", "FAC002", "FAC003"}   # dentro del plazo: snapshot en cache
+    _envejecer(app)
+    df = app.load_data()
+    assert set(df["NumeroFactura"].astype(str)) == {"FAC001", "FAC003"}
+    assert df.loc[df["NumeroFactura"] == "FAC003", "Estado"].astype(str).tolist() == ["Radicada"]
+
+
+def test_refresco_por_edad_sube_la_version_una_sola_vez(app, db):
+    app.load_data()
+    v = app.version_datos()
+    next(r for r in db.tablas["inventario"] if r["numero_factura"] == "FAC003")["estado"] = "Radicada"
+    _envejecer(app)
+    app.load_data()
+    lecturas = _lecturas(db)
+    for _ in range(3):
+        app.load_data()
+    assert app.version_datos() == v + 1
+    assert _lecturas(db) == lecturas
+
+
+def test_refresco_por_edad_sin_cambios_no_sube_la_version(app, db):
+    app.load_data()
+    app.load_data(("NumeroFactura", "Estado"))
+    v = app.version_datos()
+    _envejecer(app)
+    df = app.load_data()
+    assert app.version_datos() == v
+    assert set(df["NumeroFactura"].astype(str)) == {"FAC001", "FAC002", "FAC003"}
+    # Se releyó todo una vez y el plazo vuelve a correr: no relee en cada carga
+    lecturas = _lecturas(db)
+    for _ in range(3):
+        app.load_data()
+    assert _lecturas(db) == lecturas
+    assert app.version_datos() == v
+
+
+def test_sin_supabase_no_hay_refresco_por_edad(app, inventario):
+    app.load_data()
+    v = app.version_datos()
+    app._estado_sync()["full_ts"] = 0.0
+    app.load_data()
+    assert app.version_datos() == v
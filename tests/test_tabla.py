@@ -0,0 +1,76 @@
+"""Guardado de la Tabla por ventanas (delta_tabla) con filas sin NumeroFactura."""
+import pytest
+
+
+@pytest.fixture
+def con_sin_clave(app):
+    df = app.normalize_dataframe(app.pd.DataFrame({
+        "NumeroFactura": ["FAC001", None, "FAC002", None, None],
+        "Paciente": ["Ana", "Sin factura 1", "Luis", "Repetida", "Repetida"],
+        "Estado": ["Radicada", "Pendiente", "Pendiente", "Auditada", "Auditada"],
+        "Valor Factura": [1000, 20, 2500, 5, 5],
+    }))
+    assert app._write_local(df)[0]
+    return app.load_data(fresco=True)
+
+
+def _guardar(app, base, editadas=None, borradas=(), nuevas=()):
+    pend = {"editadas": editadas or {}, "nuevas": list(nuevas), "borradas": set(borradas)}
+    ok, msg = app.guardar_inventario(None, delta=app.delta_tabla(base, pend))
+    assert ok, msg
+    return app.load_data(fresco=True)
+
+
+def _pacientes(df):
+    return df["Paciente"].astype(str).tolist()
+
+
+def _etiqueta(base, paciente):
+    return base.index[base["Paciente"].astype(str) == paciente][0]
+
+
+def test_borrar_fila_sin_clave(app, con_sin_clave):
+    base = con_sin_clave
+    df = _guardar(app, base, borradas=[_etiqueta(base, "Sin factura 1")])
+    assert "Sin factura 1" not in _pacientes(df)
+    assert len(df) == 4
+    assert "1 eliminadas" in app.resumen_guardado()
+
+
+def test_editar_fila_sin_clave_la_reemplaza(app, con_sin_clave):
+    base = con_sin_clave
+    df = _guardar(app, base, editadas={_etiqueta(base, "Sin factura 1"): {"Paciente": "Corregida"}})
+    assert len(df) == 5
+    assert "Sin factura 1" not in _pacientes(df)
+    assert "Corregida" in _pacientes(df)
+    assert "1 actualizadas" in app.resumen_guardado()
+
+
+def test_dar_clave_a_fila_sin_clave(app, con_sin_clave):
+    base = con_sin_clave
+    df = _guardar(app, base, editadas={_etiqueta(base, "Sin factura 1"): {"NumeroFactura": "FAC050"}})
+    assert len(df) == 5
+    fila = df[df["NumeroFactura"].astype(str) == "FAC050"]
+    assert fila["Paciente"].astype(str).tolist() == ["Sin factura 1"]
+
+
+def test_borrar_una_de_dos_filas_sin_clave_iguales(app, con_sin_clave):
+    base = con_sin_clave
+    df = _guardar(app, base, borradas=[_etiqueta(base, "Repetida")])
+    assert _pacientes(df).count("Repetida") == 1
+
+
+def test_edicion_sin_cambios_no_toca_filas_sin_clave(app, con_sin_clave):
+    base = con_sin_clave
+    df = _guardar(app, base, editadas={_etiqueta(base, "Sin factura 1"): {"Paciente": "Sin factura 1"}})
+    assert _pacientes(df) == _pacientes(base)
+    assert app.resumen_guardado().startswith("sin cambios")
+
+
+def test_filas_con_clave_siguen_igual(app, con_sin_clave):
+    base = con_sin_clave
+    df = _guardar(app, base, editadas={_etiqueta(base, "Luis"): {"Estado": "Radicada"}},
+                  borradas=[_etiqueta(base, "Ana")])
+    assert "Ana" not in _pacientes(df)
+    assert df.loc[df["Paciente"].astype(str) == "Luis", "Estado"].astype(str).tolist() == ["Radicada"]
+    assert _pacientes(df).count("Repetida") == 2
@@ -0,0 +1,29 @@
+"""Login contra la tabla de usuarios de Supabase sin exponer los hashes a la anon_key."""
+import pytest
+
+import fake_supabase as fake
+
+
+@pytest.fixture
+def clientes(app, monkeypatch):
+    tablas = {"usuarios": [{"cedula": "123", "contrasena_hash": app.hash_contrasena("clave", 1000),
+                            "rol": "Administrador"}]}
+    anon, servicio = fake.Cliente(tablas, rol="anon"), fake.Cliente(tablas, rol="service_role")
+    anon.denegadas.add("usuarios")   # supabase/usuarios.sql: sin políticas para anon
+    return {"anon": anon, "servicio": servicio}
+
+
+def test_login_lee_usuarios_con_la_service_key(app, monkeypatch, clientes):
+    fake.conectar(app, monkeypatch, clientes, usuarios_tabla="usuarios", service_key="servicio")
+    assert app.autenticar("123", "clave") == {"cedula": "123", "rol": "Administrador"}
+    assert app.autenticar("123", "otra") is None
+    assert not [c for c in clientes["anon"].llamadas if c[0] == "usuarios"]
+
+
+def test_sin_service_key_usa_el_archivo_local(app, monkeypatch, clientes):
+    app.pd.DataFrame({"Cedula": ["9"], "Contrasena": ["local"], "Rol": ["Usuario"]}).to_excel(
+        app.USUARIOS_FILE, index=False)
+    fake.conectar(app, monkeypatch, clientes, usuarios_tabla="usuarios")
+    assert app.autenticar("9", "local") == {"cedula": "9", "rol": "Usuario"}
+    assert app.autenticar("123", "clave") is None
+    assert not clientes["anon"].llamadas